@@ -0,0 +1,90 @@
+"""Packed score cards for polling clients.
+
+``GET /api/games/<id>/`` with ``Accept: application/vnd.rsgolf.scores``
+(or ``?format=packed``) returns an active game's strokes as bytes instead
+of JSON. All integers are big-endian:
+
+    header   4s magic b"RSGS", B layout version, I game id,
+             I game version, B player count, B hole count
+    holes    B hole order, per hole played, in playing order
+    players  I player id, per player, in the game's player order
+    strokes  B strokes, per player then per hole; 0 is not yet scored
+
+An 18 hole card for 16 players is 15 + 18 + 64 + 288 = 385 bytes. The
+game version is the one the ETag is built from, so a client can tell
+whether a card is newer than the last one it decoded.
+"""
+import struct
+from rest_framework import renderers
+from dashboard import models
+
+MEDIA_TYPE = "application/vnd.rsgolf.scores"
+MAGIC = b"RSGS"
+LAYOUT_VERSION = 1
+HEADER = struct.Struct("!4sBIIBB")
+
+
+def pack_game(game):
+    """Return the packed card of ``game``, which needs its id and version
+    loaded. The holes are the ones the game's hole scores are on, which
+    starting the game creates for every hole it plays."""
+    memberships = list(
+        models.PlayerMembership.objects.filter(game=game).values_list("id", "player_id")
+    )
+    rows = {membership_id: row for row, (membership_id, _) in enumerate(memberships)}
+    hole_scores = list(
+        models.HoleScore.objects.filter(player__game=game).values_list(
+            "player_id", "hole__order", "strokes"
+        )
+    )
+    holes = sorted({order for _, order, _ in hole_scores})
+    columns = {order: col for col, order in enumerate(holes)}
+    strokes = bytearray(len(memberships) * len(holes))
+    for membership_id, order, hole_strokes in hole_scores:
+        strokes[rows[membership_id] * len(holes) + columns[order]] = hole_strokes
+    return b"".join([
+        HEADER.pack(
+            MAGIC, LAYOUT_VERSION, game.id, game.version, len(memberships), len(holes)
+        ),
+        bytes(holes),
+        struct.pack(f"!{len(memberships)}I", *[p for _, p in memberships]),
+        bytes(strokes),
+    ])
+
+
+def unpack_game(data):
+    """Decode a packed card, as a client would."""
+    magic, layout, game_id, version, player_count, hole_count = HEADER.unpack_from(data)
+    if magic != MAGIC or layout != LAYOUT_VERSION:
+        raise ValueError("Not a packed score card")
+    offset = HEADER.size
+    holes = list(data[offset:offset + hole_count])
+    offset += hole_count
+    players = list(struct.unpack_from(f"!{player_count}I", data, offset))
+    offset += 4 * player_count
+    return {
+        "id": game_id,
+        "version": version,
+        "holes": holes,
+        "players": players,
+        "strokes": [
+            list(data[offset + row * hole_count:offset + (row + 1) * hole_count])
+            for row in range(player_count)
+        ],
+    }
+
+
+class PackedScoresRenderer(renderers.BaseRenderer):
+    media_type = MEDIA_TYPE
+    format = "packed"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        # Errors are still reported as JSON.
+        response = (renderer_context or {}).get("response")
+        if response is not None:
+            response["Content-Type"] = "application/json"
+        return renderers.JSONRenderer().render(data)
@@ -0,0 +1,34 @@
+from rest_framework import pagination
+
+
+class CursorPagination(pagination.CursorPagination):
+    """
+    Keyset pagination for every list endpoint. Pages seek from the last
+    row seen rather than counting an offset, so a page deep into a season
+    costs the same as the first.
+
+    Views order their pages with ``cursor_ordering`` and can lower the
+    largest page a client may ask for with ``max_page_size``.
+    """
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+    ordering = "-id"
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, "cursor_ordering", self.ordering)
+        if isinstance(ordering, str):
+            return (ordering,)
+        return tuple(ordering)
+
+    def get_page_size(self, request):
+        max_page_size = getattr(self, "view_max_page_size", self.max_page_size)
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return min(self.page_size, max_page_size)
+        return min(max(page_size, 1), max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.view_max_page_size = getattr(view, "max_page_size", self.max_page_size)
+        return super().paginate_queryset(queryset, request, view)
@@ -1,3 +1,7 @@
+import datetime
+from decimal import Decimal
+from django.db.models import Prefetch
+from django.db.models.fields.files import FieldFile
 from rest_framework import serializers
 from rest_framework.reverse import reverse
 from dashboard import models
@@ -5,7 +9,71 @@ from users.api import serializers as core_serializers
 from djmoney.contrib.django_rest_framework import MoneyField
 
 
-class PlayerSerializer(serializers.ModelSerializer):
+class FieldSelection:
+    """
+    The ``?fields=`` and ``?expand=`` of a request. ``fields`` names the
+    top level fields to return, ``id`` always among them. ``expand`` names
+    the nested objects to return in full; the rest are returned as primary
+    keys. Leaving either out selects everything, as before they existed.
+    """
+
+    def __init__(self, fields=None, expand=None):
+        self.fields = fields
+        self.expand = expand
+
+    @classmethod
+    def from_request(cls, request):
+        params = request.query_params if request is not None else {}
+        return cls(
+            cls.parse(params.get("fields")), cls.parse(params.get("expand"))
+        )
+
+    @staticmethod
+    def parse(value):
+        if value is None:
+            return None
+        return {name.strip() for name in value.split(",") if name.strip()}
+
+    def is_selected(self, name):
+        return self.fields is None or name == "id" or name in self.fields
+
+    def is_expanded(self, name):
+        return self.is_selected(name) and (self.expand is None or name in self.expand)
+
+
+class SparseFieldsMixin:
+    """
+    Applies the view's FieldSelection to the top level serializer. Fields
+    that are not selected are dropped before anything reads them, and
+    nested serializers that are not expanded become primary key fields.
+    """
+
+    def is_top_level(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.context.get("selection")
+        if selection is None or not self.is_top_level():
+            return fields
+        for name, field in list(fields.items()):
+            if not selection.is_selected(name):
+                del fields[name]
+            elif not selection.is_expanded(name) and isinstance(
+                field, serializers.BaseSerializer
+            ):
+                fields[name] = serializers.PrimaryKeyRelatedField(
+                    read_only=True,
+                    many=isinstance(field, serializers.ListSerializer),
+                    source=field.source,
+                )
+        return fields
+
+
+class PlayerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     added_by = core_serializers.UserSerializer(many=False, read_only=True)
     user_account = core_serializers.UserSerializer(many=False, read_only=True)
 
@@ -17,7 +85,7 @@ class PlayerSerializer(serializers.ModelSerializer):
         return models.Player.objects.create(**validated_data)
 
 
-class GolfCourseSerializer(serializers.ModelSerializer):
+class GolfCourseSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = models.GolfCourse
         fields = "__all__"
@@ -29,13 +97,13 @@ class HoleScoreSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class TeeSerializer(serializers.ModelSerializer):
+class TeeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Tee
         fields = "__all__"
 
 
-class TeeTimeSerializer(serializers.ModelSerializer):
+class TeeTimeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     course = GolfCourseSerializer(many=False)
     players = PlayerSerializer(many=True)
 
@@ -67,24 +135,47 @@ class PlayerMembershipSerializer(serializers.ModelSerializer):
         ]
 
     def get_scores(self, obj):
-        if type(obj) == "Team":
-            players = models.PlayerMembership.objects.filter(team=obj)
-        elif type(obj) == "Player":
-            players = models.PlayerMembership.objects.filter(player=obj)
-        else:
-            players = models.PlayerMembership.objects.filter(game=obj)
-        queryset = models.HoleScore.objects.filter(player__in=[players])
-        return [HoleScoreSerializer(m).data for m in queryset]
+        # Reads the hole scores prefetched by get_game_queryset.
+        return HoleScoreSerializer(obj.holescore_set.all(), many=True).data
+
+
+def get_game_queryset(selection=None):
+    """Return games with what GameSerializer reads for ``selection``
+    prefetched, and nothing it does not."""
+    selection = selection or FieldSelection()
+    queryset = models.Game.objects.defer("leaderboard")
+    if not selection.is_selected("score"):
+        queryset = queryset.defer("score")
+    if selection.is_expanded("course"):
+        queryset = queryset.select_related("course")
+    if selection.is_expanded("players") or selection.is_selected("player_list"):
+        queryset = queryset.prefetch_related(get_membership_prefetch())
+    elif selection.is_selected("players"):
+        queryset = queryset.prefetch_related("playermembership_set")
+    return queryset
+
+
+def get_membership_prefetch():
+    return Prefetch(
+        "playermembership_set",
+        queryset=models.PlayerMembership.objects.select_related(
+            "player__added_by", "player__user_account"
+        ).prefetch_related(
+            Prefetch("holescore_set", queryset=models.HoleScore.objects.order_by("id"))
+        ),
+    )
 
 
-class GameSerializer(serializers.ModelSerializer):
+class GameSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     course = GolfCourseSerializer(many=False, read_only=True)
-    players = PlayerMembershipSerializer(many=True)
+    players = PlayerMembershipSerializer(
+        many=True, read_only=True, source="playermembership_set"
+    )
     buy_in = MoneyField(max_digits=3, decimal_places=0)
     skin_cost = MoneyField(max_digits=2, decimal_places=0)
     player_list = serializers.SerializerMethodField()
     detail_url = serializers.SerializerMethodField()
-    score = serializers.JSONField(read_only=True, source="score", allow_null=True)
+    score = serializers.JSONField(read_only=True, allow_null=True)
 
     class Meta:
         model = models.Game
@@ -94,9 +185,10 @@ class GameSerializer(serializers.ModelSerializer):
             "date_played",
             "course",
             "players",
-            "holes_played",
+            "holes_to_play",
             "which_holes",
             "status",
+            "version",
             "buy_in",
             "skin_cost",
             "score",
@@ -109,15 +201,16 @@ class GameSerializer(serializers.ModelSerializer):
         return models.Game.objects.create(**validated_data)
 
     def get_player_list(self, obj):
-        queryset = models.PlayerMembership.objects.filter(game=obj)
-        return [SimplePlayerMembershipSerializer(m).data for m in queryset]
+        return SimplePlayerMembershipSerializer(
+            obj.playermembership_set.all(), many=True
+        ).data
 
     def get_detail_url(self, obj):
         if "request" in self.context:
             return reverse(
-                "dashboard:game-detail",
+                "dashboard:game_detail",
                 request=self.context["request"],
-                args={obj.id}
+                args=[obj.id]
             )
         return ""
 
@@ -142,3 +235,113 @@ class TeamSerializer(serializers.ModelSerializer):
         team_players = models.PlayerMembership.objects.filter(team=obj)
         queryset = models.HoleScore.objects.filter(player__in=[team_players])
         return [HoleScoreSerializer(m).data for m in queryset]
+
+
+# Plain dict representations, for clients that poll. They build the same
+# output as the serializers above from the same prefetched queryset,
+# without going through DRF's per-field machinery.
+DATETIME_FIELD = serializers.DateTimeField()
+_field_cache = {}
+
+
+def get_field_value(value, request):
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return DATETIME_FIELD.to_representation(value)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, FieldFile):
+        if not value:
+            return None
+        return request.build_absolute_uri(value.url) if request else value.url
+    return value
+
+
+def model_to_dict(instance, request=None):
+    """Return every concrete field, as a ``fields = "__all__"`` serializer would."""
+    model = type(instance)
+    fields = _field_cache.get(model)
+    if fields is None:
+        fields = _field_cache[model] = [
+            (f.name, f.attname) for f in model._meta.concrete_fields
+        ]
+    return {
+        name: get_field_value(getattr(instance, attname), request)
+        for name, attname in fields
+    }
+
+
+def user_to_dict(user):
+    if user is None:
+        return None
+    return {
+        "id": user.id,
+        "email": user.email,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "user_type": user.user_type,
+    }
+
+
+def player_to_dict(player, request=None):
+    data = model_to_dict(player, request)
+    data["added_by"] = user_to_dict(player.added_by)
+    data["user_account"] = user_to_dict(player.user_account)
+    return data
+
+
+def game_to_dict(game, request=None, selection=None):
+    """Return ``GameSerializer(game).data`` as plain dicts. ``game`` must
+    come from get_game_queryset for the same ``selection``."""
+    selection = selection or FieldSelection()
+    data = {"id": game.id}
+    if selection.is_selected("game_type"):
+        data["game_type"] = game.game_type
+    if selection.is_selected("date_played"):
+        data["date_played"] = get_field_value(game.date_played, request)
+    if selection.is_expanded("course"):
+        data["course"] = model_to_dict(game.course, request)
+    elif selection.is_selected("course"):
+        data["course"] = game.course_id
+    players = {}
+    if selection.is_expanded("players") or selection.is_selected("player_list"):
+        players = {
+            m.id: player_to_dict(m.player, request)
+            for m in game.playermembership_set.all()
+        }
+    if selection.is_expanded("players"):
+        data["players"] = [
+            {
+                "id": m.id,
+                "player": players[m.id],
+                "game": m.game_id,
+                "team": m.team_id,
+                "scores": [
+                    model_to_dict(hole_score) for hole_score in m.holescore_set.all()
+                ],
+            }
+            for m in game.playermembership_set.all()
+        ]
+    elif selection.is_selected("players"):
+        data["players"] = [m.id for m in game.playermembership_set.all()]
+    for name in ["holes_to_play", "which_holes", "status", "version"]:
+        if selection.is_selected(name):
+            data[name] = getattr(game, name)
+    for name in ["buy_in", "skin_cost"]:
+        if selection.is_selected(name):
+            data[name] = str(getattr(game, name).amount)
+    if selection.is_selected("score"):
+        data["score"] = game.score
+    if selection.is_selected("player_list"):
+        data["player_list"] = [
+            {"id": membership_id, "player": player}
+            for membership_id, player in players.items()
+        ]
+    if selection.is_selected("detail_url"):
+        data["detail_url"] = reverse(
+            "dashboard:game_detail", request=request, args=[game.id]
+        ) if request else ""
+    return data
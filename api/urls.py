@@ -9,5 +9,7 @@ router.register("games", views.GameViewSet, basename="game")
 router.register("players", views.PlayerViewSet, basename="players")
 router.register("tee-times", views.TeeTimeViewSet, basename="tee-times")
 router.register("tees", views.TeeViewSet, basename="tee")
+router.register("changes", views.ChangeViewSet, basename="changes")
+router.register("batch", views.BatchViewSet, basename="batch")
 
 urlpatterns = router.urls
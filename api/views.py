@@ -1,42 +1,172 @@
+from django.core.exceptions import ValidationError
 from django.shortcuts import get_object_or_404
 from django.conf import settings
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import Http404, HttpRequest, QueryDict
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from . import packing
+from . import pagination
 from . import serializers
+from dashboard import changes
 from dashboard import models
 from dashboard import utils
+from dashboard import versions
+from dashboard.query_budget import QueryBudgetMixin
+from rest_framework import exceptions
 from rest_framework import viewsets
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 
 
-class GolfCourseViewSet(viewsets.ViewSet):
+class FieldSelectionMixin:
+    """
+    Reads ``?fields=`` and ``?expand=`` into a FieldSelection, which the
+    serializers apply and get_queryset can use to skip unused joins.
+    """
+    pagination_class = pagination.CursorPagination
+
+    def get_selection(self):
+        if not hasattr(self, "_selection"):
+            self._selection = serializers.FieldSelection.from_request(self.request)
+        return self._selection
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["selection"] = self.get_selection()
+        return context
+
+    def get_paginated_data(self, queryset, to_representation=None):
+        page = self.paginate_queryset(queryset)
+        if to_representation is not None:
+            return self.get_paginated_response([to_representation(o) for o in page])
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+def get_versioned_response(request, kind, pk, stamp, get_data, representation=None):
+    """Answer with a 304 when the client already has this version of the
+    object, before ``get_data`` loads or serializes anything.
+
+    ``representation`` names the form the data is served in, the accepted
+    renderer's format unless given, and is part of the ETag so that one
+    form is never revalidated against another."""
+    if stamp is None:
+        raise Http404
+    representation = representation or request.accepted_renderer.format
+    etag = versions.get_etag(request, f"{kind}-{representation}", pk, stamp[0])
+    response = versions.get_not_modified(request, etag, stamp[1])
+    if response is None:
+        response = Response(get_data())
+    patch_vary_headers(response, ["Accept"])
+    return versions.set_headers(response, etag, stamp[1])
+
+
+class GolfCourseViewSet(QueryBudgetMixin, FieldSelectionMixin, viewsets.GenericViewSet):
     """
     API endpoint that allows golf courses to be viewed
     """
+    serializer_class = serializers.GolfCourseSerializer
+    query_budgets = {"list": 3, "retrieve": 4}
+    cursor_ordering = "id"
+
+    def get_queryset(self):
+        return models.GolfCourse.objects.all()
 
     def list(self, request):
-        queryset = models.GolfCourse.objects.all()
-        serializer = serializers.GolfCourseSerializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.get_paginated_data(self.get_queryset())
 
     def retrieve(self, request, pk=None):
-        queryset = models.GolfCourse.objects.all()
-        course = get_object_or_404(queryset, pk=pk)
-        serializer = serializers.GolfCourseSerializer(course)
-        return Response(serializer.data)
+        def get_data():
+            course = get_object_or_404(self.get_queryset(), pk=pk)
+            return self.get_serializer(course).data
+        stamp = versions.get_course_stamp(request, pk)
+        return get_versioned_response(request, "course", pk, stamp, get_data)
 
 
-class GameViewSet(viewsets.ModelViewSet):
+class GameViewSet(QueryBudgetMixin, FieldSelectionMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows games to be viewed or edited
+
+    List and detail take ``?lite=true`` for the same output built as plain
+    dicts, which is much cheaper for clients that poll. Detail of an active
+    game also comes as a packed score card, see api/packing.py.
     """
     permission_classes = [IsAuthenticated]
     serializer_class = serializers.GameSerializer
+    cursor_ordering = "-date_played"
+    # Every game carries its whole score card.
+    max_page_size = 25
+    query_budgets = {
+        "list": 6,
+        "retrieve": 7,
+        "add_player": 14,
+        "remove_player": 16,
+        "set_hole_score": 27,
+        "record_scores": 25,
+        "start_game": 22,
+    }
 
     def get_queryset(self):
         player = self.request.user.player
-        queryset = models.Game.objects.filter(players__in=[player])
-        return queryset
+        return serializers.get_game_queryset(self.get_selection()).filter(
+            players__in=[player]
+        )
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if self.action == "retrieve":
+            renderers.append(packing.PackedScoresRenderer())
+        return renderers
+
+    def is_packed(self):
+        return self.request.accepted_renderer.format == packing.PackedScoresRenderer.format
+
+    def is_lite(self):
+        return self.request.query_params.get("lite") in ("1", "true")
+
+    def to_lite_dict(self, game):
+        return serializers.game_to_dict(game, self.request, self.get_selection())
+
+    def list(self, request):
+        if self.is_lite():
+            return self.get_paginated_data(self.get_queryset(), self.to_lite_dict)
+        return self.get_paginated_data(self.get_queryset())
+
+    def get_representation(self):
+        if self.is_packed():
+            return "packed"
+        if self.is_lite():
+            return "lite"
+        return self.request.accepted_renderer.format
+
+    def retrieve(self, request, pk=None):
+        def get_data():
+            if self.is_packed():
+                return self.get_packed_game(pk)
+            game = get_object_or_404(self.get_queryset(), pk=pk)
+            if self.is_lite():
+                return self.to_lite_dict(game)
+            return self.get_serializer(game).data
+        # Only the player's own games, the same ones get_queryset returns.
+        stamp = versions.get_game_stamp(
+            request, pk, models.Game.objects.filter(players__in=[request.user.player])
+        )
+        return get_versioned_response(
+            request, "game", pk, stamp, get_data, self.get_representation()
+        )
+
+    def get_packed_game(self, pk):
+        game = get_object_or_404(
+            models.Game.objects.filter(players__in=[self.request.user.player]).only(
+                "id", "status", "version"
+            ),
+            pk=pk,
+        )
+        if game.status != models.GameStatusChoices.ACTIVE:
+            raise exceptions.NotAcceptable("Packed scores are only served for active games.")
+        return packing.pack_game(game)
 
     def create(self, request):
         if not hasattr(request.user, "player"):
@@ -49,62 +179,89 @@ class GameViewSet(viewsets.ModelViewSet):
         )
         if serializer.is_valid():
             model_obj = serializer.save()
-            model_obj.players.add(request.user.player)
+            # Through save(), which sets the membership's _order.
+            models.PlayerMembership.objects.create(
+                game=model_obj, player=request.user.player
+            )
             return Response(serializer.data, status=201)
         return Response(serializer.errors, status=400)
 
+    def _get_game(self, pk):
+        return get_object_or_404(models.Game.objects.select_related("course"), pk=pk)
+
+    def _get_game_response(self, game):
+        # Prefetch after the action has changed the game, so the response
+        # reflects it without a query per player.
+        prefetch_related_objects([game], serializers.get_membership_prefetch())
+        return Response(self.get_serializer(game).data)
+
     @action(detail=True, methods=["post"], url_name="add_player")
     def add_player(self, request, pk=None):
-        queryset = models.Game.objects.all()
-        game = get_object_or_404(queryset, pk=pk)
+        game = self._get_game(pk)
         player_id = request.data.get("player")
         player_data = get_object_or_404(models.Player, pk=player_id)
-        game.players.add(player_data)
-        serializer = serializers.GameSerializer(game, many=False)
-        return Response(serializer.data)
+        # Adding a player already in the game leaves it as it is.
+        models.PlayerMembership.objects.get_or_create(game=game, player=player_data)
+        return self._get_game_response(game)
 
     @action(detail=True, methods=["post"], url_name="remove_player")
     def remove_player(self, request, pk=None):
-        queryset = models.Game.objects.all()
-        game = get_object_or_404(queryset, pk=pk)
+        game = self._get_game(pk)
         player_id = request.data.get("player")
         player_data = get_object_or_404(models.Player, pk=player_id)
-        game.players.remove(player_data)
-        serializer = serializers.GameSerializer(game, many=False)
-        return Response(serializer.data)
+        # Deleted one by one, so each logs its hole scores with itself.
+        for membership in game.playermembership_set.filter(player=player_data):
+            membership.delete()
+        return self._get_game_response(game)
 
     @action(detail=True, methods=["post"], url_name="set_score")
     def set_hole_score(self, request, pk=None):
+        game = self._get_game(pk)
+        try:
+            utils.record_scores_for_game(game, self._get_scores(request), request.user)
+        except ValidationError as e:
+            return Response({"message": e.message}, status=400)
+        return self._get_game_response(game)
+
+    @action(detail=True, methods=["post"], url_name="record_scores")
+    def record_scores(self, request, pk=None):
         queryset = models.Game.objects.all()
         game = get_object_or_404(queryset, pk=pk)
-        score_list = request.data.get("score_list")
-        for score_data in score_list:
-            hole_score = models.HoleScore.objects.get(pk=score_data["id"])
-            hole_score_serializer = serializers.HoleScoreSerializer(
-                hole_score, data=score_data, partial=True
+        try:
+            board_slice = utils.record_scores_for_game(
+                game, self._get_scores(request), request.user
             )
-            if hole_score_serializer.is_valid():
-                hole_score_serializer.save()
-            else:
-                return Response(hole_score_serializer.errors, status=400)
-        serializer = serializers.GameSerializer(game, many=False)
-        return Response(serializer.data)
+        except ValidationError as e:
+            return Response({"message": e.message}, status=400)
+        return Response(board_slice)
+
+    def _get_scores(self, request):
+        score_list = request.data.get("score_list")
+        if not score_list:
+            raise ValidationError("Missing score_list")
+        try:
+            return {s["id"]: s["strokes"] for s in score_list}
+        except (KeyError, TypeError):
+            raise ValidationError("Each score needs an id and strokes")
 
     @action(detail=True, methods=["post"], url_name="start_game")
     def start_game(self, request, pk=None):
-        queryset = models.Game.objects.all()
-        game = get_object_or_404(queryset, pk=pk)
+        game = self._get_game(pk)
         game.start(**request.data)
-        serializer = serializers.GameSerializer(game, many=False)
-        return Response(serializer.data)
+        return self._get_game_response(game)
 
 
-class PlayerViewSet(viewsets.ModelViewSet):
+class PlayerViewSet(QueryBudgetMixin, FieldSelectionMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = serializers.PlayerSerializer
+    query_budgets = {"list": 5, "retrieve": 5}
+    cursor_ordering = "id"
 
     def get_queryset(self):
-        return models.Player.objects.filter(added_by=self.request.user)
+        selection = self.get_selection()
+        queryset = models.Player.objects.filter(added_by=self.request.user)
+        related = [f for f in ["added_by", "user_account"] if selection.is_expanded(f)]
+        return queryset.select_related(*related) if related else queryset
 
     def create(self, request):
         serializer = serializers.PlayerSerializer(data=request.data)
@@ -113,32 +270,254 @@ class PlayerViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class TeeTimeViewSet(viewsets.ViewSet):
+class TeeTimeViewSet(QueryBudgetMixin, FieldSelectionMixin, viewsets.GenericViewSet):
     permission_classes = [IsAuthenticated]
+    serializer_class = serializers.TeeTimeSerializer
+    query_budgets = {"list": 7, "retrieve": 7}
+    cursor_ordering = "-tee_time"
 
-    def list(self, request):
-        player = request.user.player
+    def get_queryset(self):
+        selection = self.get_selection()
+        player = self.request.user.player
         queryset = models.TeeTime.objects.filter(players__in=[player])
-        serializer = serializers.TeeTimeSerializer(queryset, many=True)
-        return Response(serializer.data)
+        if selection.is_expanded("course"):
+            queryset = queryset.select_related("course")
+        if selection.is_expanded("players"):
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    "players",
+                    queryset=models.Player.objects.select_related(
+                        "added_by", "user_account"
+                    ),
+                )
+            )
+        elif selection.is_selected("players"):
+            queryset = queryset.prefetch_related("players")
+        return queryset
+
+    def list(self, request):
+        return self.get_paginated_data(self.get_queryset())
 
     def retrieve(self, request, pk=None):
-        player = request.user.player
-        queryset = models.TeeTime.objects.filter(players__in=[player])
-        tee_time = get_object_or_404(queryset, pk=pk)
-        serializer = serializers.TeeTimeSerializer(tee_time, many=False)
-        return Response(serializer.data)
+        tee_time = get_object_or_404(self.get_queryset(), pk=pk)
+        return Response(self.get_serializer(tee_time).data)
 
 
-class TeeViewSet(viewsets.ModelViewSet):
+class TeeViewSet(QueryBudgetMixin, FieldSelectionMixin, viewsets.ModelViewSet):
+    """
+    API endpoint that allows tees to be viewed, filtered to one course or
+    hole with ``?course=`` or ``?hole=``
+    """
     permission_classes = [IsAuthenticated]
-    queryset = models.Tee.objects.all()
+    serializer_class = serializers.TeeSerializer
+    query_budgets = {"list": 3, "retrieve": 3}
+    cursor_ordering = "id"
+
+    def get_queryset(self):
+        queryset = models.Tee.objects.all()
+        for param, lookup in [("course", "hole__course_id"), ("hole", "hole_id")]:
+            value = self.request.query_params.get(param)
+            if not value:
+                continue
+            if not value.isdigit():
+                raise exceptions.ValidationError({param: "Expected an id."})
+            queryset = queryset.filter(**{lookup: value})
+        return queryset
 
     def list(self, request):
-        serializer = serializers.TeeSerializer(self.queryset, many=True)
-        return Response(serializer.data)
+        return self.get_paginated_data(self.get_queryset())
 
     def retrieve(self, request, pk=None):
-        tee = get_object_or_404(self.queryset, pk=pk)
-        serializer = serializers.TeeSerializer(tee, many=False)
-        return Response(serializer.data)
+        tee = get_object_or_404(models.Tee.objects.all(), pk=pk)
+        return Response(self.get_serializer(tee).data)
+
+
+class ChangeViewSet(QueryBudgetMixin, viewsets.ViewSet):
+    """
+    API endpoint that lists what changed after ``?since=<cursor>``: each
+    game, membership, hole score, player, tee time and course created,
+    updated or deleted since, once, with its current data unless it was
+    deleted. Without ``since`` it only returns the cursor to start from.
+
+    Objects the other endpoints would not show the user are left out, and
+    so are deletions of objects they did not show the user, so
+    a page can hold fewer changes than ``page_size`` while ``has_more``
+    says whether to ask again from the returned cursor.
+    """
+    permission_classes = [IsAuthenticated]
+    query_budgets = {"list": 11}
+    # Memberships and hole scores arrive as changes of their own.
+    game_selection = serializers.FieldSelection(
+        fields={
+            "game_type", "date_played", "course", "holes_to_play", "which_holes",
+            "status", "version", "buy_in", "skin_cost", "score", "detail_url",
+        },
+        expand=set(),
+    )
+
+    def get_querysets(self):
+        user = self.request.user
+        player = user.player
+        return {
+            "games": serializers.get_game_queryset(self.game_selection).filter(
+                players__in=[player]
+            ),
+            "player-memberships": models.PlayerMembership.objects.filter(
+                game__players__in=[player]
+            ),
+            "hole-scores": models.HoleScore.objects.filter(
+                player__game__players__in=[player]
+            ),
+            "players": models.Player.objects.filter(added_by=user),
+            "tee-times": models.TeeTime.objects.filter(
+                players__in=[player]
+            ).prefetch_related("players"),
+            "golf-courses": models.GolfCourse.objects.all(),
+        }
+
+    def to_dict(self, resource, instance):
+        if resource == "games":
+            return serializers.game_to_dict(instance, self.request, self.game_selection)
+        data = serializers.model_to_dict(instance, self.request)
+        if resource == "tee-times":
+            data["players"] = [p.id for p in instance.players.all()]
+        return data
+
+    def get_int_param(self, name, default=None):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return default
+        if not value.isdigit():
+            raise exceptions.ValidationError({name: "Expected a whole number."})
+        return int(value)
+
+    def list(self, request):
+        since = self.get_int_param("since")
+        if since is None:
+            return Response({"cursor": changes.get_cursor(), "has_more": False, "changes": []})
+        page_size = min(
+            max(self.get_int_param("page_size", settings.CHANGES_PAGE_SIZE), 1),
+            settings.CHANGES_PAGE_SIZE,
+        )
+        entries, cursor, has_more = changes.get_changes(since, page_size)
+        ids = {}
+        for entry in entries:
+            if entry.action != models.ChangeActionChoices.DELETED:
+                ids.setdefault(entry.resource, set()).add(entry.object_id)
+        querysets = self.get_querysets()
+        objects = {
+            resource: querysets[resource].in_bulk(resource_ids)
+            for resource, resource_ids in ids.items()
+        }
+        results = []
+        for entry in entries:
+            item = {
+                "cursor": entry.id,
+                "resource": entry.resource,
+                "id": entry.object_id,
+                "action": entry.action,
+            }
+            if entry.action == models.ChangeActionChoices.DELETED:
+                if (
+                    entry.resource != "golf-courses"
+                    and request.user.pk not in (entry.audience or [])
+                ):
+                    continue
+            else:
+                instance = objects[entry.resource].get(entry.object_id)
+                if instance is None:
+                    continue
+                item["data"] = self.to_dict(entry.resource, instance)
+            results.append(item)
+        return Response({"cursor": cursor, "has_more": has_more, "changes": results})
+
+
+class BatchViewSet(viewsets.ViewSet):
+    """
+    API endpoint that runs several list requests in one round trip, e.g.
+    ``{"requests": [{"resource": "games", "filters": {"lite": "true"},
+    "fields": ["id", "status"]}, {"resource": "tee-times"}]}``. Each runs
+    as a GET of that endpoint by the same user, with its filters as query
+    parameters, and its status and data come back in the same order.
+
+    The sub-requests share the authenticated user, so lookups hanging off
+    it, such as ``request.user.player``, are only made once.
+    """
+    permission_classes = [IsAuthenticated]
+    resources = {
+        "golf-courses": ("golf-course", GolfCourseViewSet),
+        "games": ("game", GameViewSet),
+        "players": ("players", PlayerViewSet),
+        "tee-times": ("tee-times", TeeTimeViewSet),
+        "tees": ("tee", TeeViewSet),
+        "changes": ("changes", ChangeViewSet),
+    }
+    max_requests = 10
+    # Headers that belong to the batch rather than to what it runs.
+    batch_headers = {
+        "CONTENT_TYPE",
+        "CONTENT_LENGTH",
+        "HTTP_IF_NONE_MATCH",
+        "HTTP_IF_MODIFIED_SINCE",
+    }
+
+    def get_sub_requests(self, data):
+        sub_requests = data.get("requests") if isinstance(data, dict) else None
+        if not isinstance(sub_requests, list) or not sub_requests:
+            raise exceptions.ValidationError({"requests": "Expected a list of requests."})
+        if len(sub_requests) > self.max_requests:
+            raise exceptions.ValidationError(
+                {"requests": f"At most {self.max_requests} requests per batch."}
+            )
+        for index, sub_request in enumerate(sub_requests):
+            resource = sub_request.get("resource") if isinstance(sub_request, dict) else None
+            if resource not in self.resources:
+                raise exceptions.ValidationError(
+                    {"requests": f"Request {index} needs one of: {', '.join(self.resources)}."}
+                )
+            if not isinstance(sub_request.get("filters", {}), dict):
+                raise exceptions.ValidationError(
+                    {"requests": f"Request {index} filters must be an object."}
+                )
+        return sub_requests
+
+    def get_params(self, sub_request):
+        params = QueryDict(mutable=True)
+        for name, value in sub_request.get("filters", {}).items():
+            params[name] = str(value).lower() if isinstance(value, bool) else str(value)
+        for name in ["fields", "expand"]:
+            value = sub_request.get(name)
+            if isinstance(value, list):
+                value = ",".join(map(str, value))
+            if value is not None:
+                params[name] = value
+        return params
+
+    def build_request(self, request, path, params):
+        sub_request = HttpRequest()
+        sub_request.method = "GET"
+        sub_request.path = sub_request.path_info = path
+        sub_request.GET = params
+        sub_request.META = {
+            key: value for key, value in request.META.items()
+            if key not in self.batch_headers
+        }
+        sub_request.META.update(REQUEST_METHOD="GET", QUERY_STRING=params.urlencode())
+        sub_request.session = request._request.session
+        sub_request.user = request.user
+        # Skip authenticating again: every sub-request gets this very user
+        # object, which caches its lookups.
+        sub_request._force_auth_user = request.user
+        sub_request._force_auth_token = request.auth
+        return sub_request
+
+    def create(self, request):
+        responses = []
+        for sub_request in self.get_sub_requests(request.data):
+            basename, viewset = self.resources[sub_request["resource"]]
+            view = viewset.as_view({"get": "list"}, basename=basename, detail=False)
+            response = view(self.build_request(
+                request, reverse(f"api:{basename}-list"), self.get_params(sub_request)
+            ))
+            responses.append({"status": response.status_code, "data": response.data})
+        return Response({"responses": responses})
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 
 import os
 import sys
+import tempfile
 from pathlib import Path
 import logging
 
@@ -60,6 +61,41 @@ LOGOUT_REDIRECT_URL = "/"
 
 
 WSGI_APPLICATION = "core.wsgi.application"
+ASGI_APPLICATION = "core.asgi.application"
+
+# Pub/sub backend for the live leaderboard stream (see dashboard/live.py)
+LIVE_BROKER = "dashboard.live.LocalBroker"
+
+# How league games update Player.handicap: "whs" (best 8 of the last 20
+# differentials) or "average" (average of the old handicap and the game)
+HANDICAP_ENGINE = "whs"
+
+# What to do when a view runs more queries than its budget (see
+# dashboard/query_budget.py): "off", "log" or "raise"
+QUERY_BUDGET_MODE = "off"
+
+# Request profiling (see dashboard/profiling.py): the share of requests
+# sampled, the wall time in ms over which a request is logged with its
+# slowest queries, and a bearer token for scraping profiling/metrics
+PROFILING_ENABLED = True
+PROFILING_SAMPLE_RATE = 0.1
+PROFILING_SLOW_MS = 1000
+PROFILING_METRICS_TOKEN = ""
+
+# Scoring instrumentation (see dashboard/instrumentation.py): the SQLite
+# file workers share timings through, kept in INSTRUMENTATION_DIR (the
+# system temp directory by default), and how often each worker flushes
+# its timings and rereads the on/off switch
+INSTRUMENTATION_PATH = (
+    Path(os.environ.get("INSTRUMENTATION_DIR", tempfile.gettempdir()))
+    / "rsgolf-instrumentation.sqlite3"
+)
+INSTRUMENTATION_POLL_SECONDS = 5
+
+# Change feed (see dashboard/changes.py): how long new entries are held
+# back so slower transactions can commit, and the most entries per page
+CHANGES_SETTLE_SECONDS = 2
+CHANGES_PAGE_SIZE = 500
 
 # Application definition
 BASE_APPS = [
@@ -121,6 +157,7 @@ SITE_ID = 1
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    "dashboard.profiling.ProfilingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
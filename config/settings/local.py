@@ -159,6 +159,11 @@ TAILWIND_CSS_DEV = env(
     default=True,
 )
 
+QUERY_BUDGET_MODE = env(
+    "LOCAL_QUERY_BUDGET_MODE",
+    default="log",
+)
+
 # STATIC
 # ------------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/dev/ref/settings/#static-root
@@ -129,6 +129,11 @@ SECRET_KEY = env(
     default="DJANGO_SECRET_KEY_NOT_SET",
 )
 
+PROFILING_METRICS_TOKEN = env(
+    "PROD_PROFILING_METRICS_TOKEN",
+    default="",
+)
+
 assert (  # nosec
     SECRET_KEY != "DJANGO_SECRET_KEY_NOT_SET"
 ), "Production secret key must be set for security reasons."
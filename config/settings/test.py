@@ -134,6 +134,17 @@ TAILWIND_CSS_DEV = env(
     "TESTING_TAILWIND_CSS_DEV",
     default=False,
 )
+
+QUERY_BUDGET_MODE = env(
+    "TESTING_QUERY_BUDGET_MODE",
+    default="raise",
+)
+
+PROFILING_ENABLED = env.bool(
+    "TESTING_PROFILING_ENABLED",
+    default=False,
+)
+
 # `USE_STATIC` options are `local` or `S3`
 USE_STATIC = env("TESTING_USE_STATIC", default="Local")
 
@@ -17,6 +17,11 @@ admin.site.register(Team)
 admin.site.register(PlayerMembership)
 admin.site.register(HoleScore)
 admin.site.register(TeeTime)
+admin.site.register(ScoreMutation)
+admin.site.register(LeagueStanding)
+admin.site.register(PlayerRound)
+admin.site.register(HandicapHistory)
+admin.site.register(HandicapWindow)
 
 @admin.register(Game)
 class GameAdmin(admin.ModelAdmin):
@@ -0,0 +1,138 @@
+"""Change log behind the ``/api/changes/`` feed.
+
+Saves and deletes of the synced models are logged from signals. The bulk
+writes that skip signals log their rows themselves with ``record``. An
+entry's id is the feed cursor: a client asks for everything after the last
+cursor it saw and gets each changed object once, with its latest action.
+
+``compact`` (``manage.py compact_changes``, run periodically) drops every
+entry that a later entry for the same object supersedes. The log then
+holds at most one row per object, and a client whose cursor is behind a
+dropped row still reads the entry that replaced it.
+
+A deleted object can no longer be looked up, so its entry keeps the ids
+of the users it was shown to, and only they are told of the deletion.
+
+Ids are handed out before commit, so an entry can become visible below a
+cursor that was already served. Entries younger than
+``CHANGES_SETTLE_SECONDS`` are held back so that writes committing within
+that window are not skipped.
+"""
+import datetime
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+from dashboard import models
+
+# Model name: feed resource, named like the api routes.
+RESOURCES = {
+    "Game": "games",
+    "PlayerMembership": "player-memberships",
+    "HoleScore": "hole-scores",
+    "Player": "players",
+    "TeeTime": "tee-times",
+    "GolfCourse": "golf-courses",
+}
+
+
+def record(model, ids, action):
+    """Log ``action`` for the ``model`` rows with ``ids``, in one query."""
+    record_rows([(model, pk, None) for pk in ids], action)
+
+
+def record_rows(rows, action):
+    """Log ``action`` for ``(model, id, audience)`` rows of any synced
+    models."""
+    now = timezone.now()
+    models.Change.objects.bulk_create([
+        models.Change(
+            resource=RESOURCES[model.__name__],
+            object_id=pk,
+            action=action,
+            audience=audience,
+            changed_at=now,
+        )
+        for model, pk, audience in rows
+    ])
+
+
+def get_game_audience(game_id, cache):
+    key = ("game", game_id)
+    if key not in cache:
+        cache[key] = list(
+            models.Player.objects.filter(
+                playermembership__game=game_id, user_account__isnull=False
+            ).values_list("user_account_id", flat=True)
+        )
+    return cache[key]
+
+
+def get_audience(instance, cache):
+    """Return the ids of the users the api shows ``instance`` to, before it
+    is deleted. ``cache`` is shared by the rows one delete cascades to, so
+    that a game's hole scores look its players up once."""
+    if isinstance(instance, models.Game):
+        return get_game_audience(instance.pk, cache)
+    if isinstance(instance, models.PlayerMembership):
+        return get_game_audience(instance.game_id, cache)
+    if isinstance(instance, models.HoleScore):
+        key = ("membership", instance.player_id)
+        if key not in cache:
+            cache.update(
+                (("membership", pk), game_id)
+                for pk, game_id in models.PlayerMembership.objects.filter(
+                    game__playermembership=instance.player_id
+                ).values_list("id", "game_id")
+            )
+        game_id = cache.get(key)
+        return get_game_audience(game_id, cache) if game_id else []
+    if isinstance(instance, models.Player):
+        return [instance.added_by_id]
+    if isinstance(instance, models.TeeTime):
+        return list(
+            instance.players.filter(user_account__isnull=False).values_list(
+                "user_account_id", flat=True
+            )
+        )
+    # Courses are shown to everyone.
+    return None
+
+
+def get_cursor():
+    return models.Change.objects.aggregate(cursor=Max("id"))["cursor"] or 0
+
+
+def get_changes(since, limit):
+    """Return ``(changes, cursor, has_more)`` for up to ``limit`` entries
+    after ``since``. Each object appears once, at its latest entry."""
+    entries = list(
+        models.Change.objects.filter(id__gt=since).order_by("id")[:limit + 1]
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    settled_at = timezone.now() - datetime.timedelta(
+        seconds=settings.CHANGES_SETTLE_SECONDS
+    )
+    for index, entry in enumerate(entries):
+        if entry.changed_at > settled_at:
+            entries = entries[:index]
+            has_more = False
+            break
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.resource, entry.object_id), None)
+        latest[(entry.resource, entry.object_id)] = entry
+    cursor = entries[-1].id if entries else since
+    return list(latest.values()), cursor, has_more
+
+
+def compact():
+    """Drop the entries a later entry for the same object supersedes."""
+    latest = (
+        models.Change.objects.order_by()
+        .values("resource", "object_id")
+        .annotate(latest=Max("id"))
+        .values("latest")
+    )
+    deleted, _ = models.Change.objects.exclude(id__in=latest).delete()
+    return deleted
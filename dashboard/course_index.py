@@ -0,0 +1,94 @@
+"""Per-course hole index.
+
+Course layouts almost never change, so the ordered holes of a course and
+the par/points totals derived from them are kept in a process-local dict
+backed by the shared Django cache. ``signals`` invalidates a course's
+index whenever one of its holes is saved or deleted.
+
+The shared cache also holds a version per course. Process-local entries
+are trusted for ``LOCAL_TTL`` seconds, then re-checked against that
+version, so an edit made through one worker reaches the others quickly
+without a cache round trip on every lookup.
+"""
+import threading
+import time
+from django.core.cache import cache
+from dashboard import models
+from dashboard import utils
+
+LOCAL_TTL = 30
+
+_local = {}
+_lock = threading.Lock()
+
+
+def _index_key(course_id):
+    return f"course-index-{course_id}"
+
+
+def _version_key(course_id):
+    return f"course-index-version-{course_id}"
+
+
+def build_index(course_id):
+    holes = [
+        {
+            "id": hole.id,
+            "name": hole.name,
+            "order": hole.order,
+            "par": hole.par,
+            "handicap": hole.handicap,
+        }
+        for hole in models.Hole.objects.filter(course_id=course_id).order_by("order")
+    ]
+    par = sum([h["par"] for h in holes])
+    return {
+        "holes": holes,
+        "par": par,
+        "front_par": sum([h["par"] for h in holes if 1 <= h["order"] < 10]),
+        "back_par": sum([h["par"] for h in holes if h["order"] >= 10]),
+        "points": utils.round_up(par/2),
+    }
+
+
+def get_index(course_id):
+    now = time.monotonic()
+    entry = _local.get(course_id)
+    if entry is not None and entry["checked"] + LOCAL_TTL > now:
+        return entry["index"]
+    version = cache.get_or_set(_version_key(course_id), time.time_ns, None)
+    if entry is not None and entry["version"] == version:
+        entry["checked"] = now
+        return entry["index"]
+    cached = cache.get(_index_key(course_id))
+    if cached is not None and cached["version"] == version:
+        index = cached["index"]
+    else:
+        index = build_index(course_id)
+        cache.set(_index_key(course_id), {"version": version, "index": index}, None)
+    with _lock:
+        _local[course_id] = {"version": version, "checked": now, "index": index}
+    return index
+
+
+def invalidate(course_id):
+    with _lock:
+        _local.pop(course_id, None)
+    # A fresh version rather than an increment, so a version lost to cache
+    # eviction can never come back and match a stale local entry.
+    cache.set(_version_key(course_id), time.time_ns(), None)
+    cache.delete(_index_key(course_id))
+
+
+def clear():
+    with _lock:
+        _local.clear()
+
+
+def get_par_for_game(game):
+    index = get_index(game.course_id)
+    if game.which_holes == "front":
+        return index["front_par"]
+    if game.which_holes == "back":
+        return index["back_par"]
+    return index["par"]
@@ -0,0 +1,304 @@
+"""Handicap history and handicap index.
+
+Every handicap change is appended to ``HandicapHistory``: one row per
+player per scored league game, plus one per manual edit. ``Player.handicap``
+stays as the denormalized head of that series, so reads of the current
+handicap are unchanged.
+
+Resetting a game reverts its rows in bulk by subtracting each row's change
+from the player's current handicap, which is exact when the game is the
+latest entry and keeps later games' changes when it is not.
+
+The handicap index follows WHS: the best 8 of a player's last 20 league
+differentials. Each player's last 20 are kept in ``HandicapWindow`` and
+updated as a game is scored; only a reset that removes a round from the
+window goes back to ``PlayerRound`` to refill it. With the ``whs`` engine a
+player's handicap becomes their index once they have 3 differentials, and
+the old average is used until then. ``recompute_all_handicaps`` rebuilds
+every window in one pass after ratings or rules change.
+"""
+import datetime
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from dashboard import changes
+from dashboard import leaderboard
+from dashboard import models
+from dashboard import rounds
+from dashboard import standings
+
+WINDOW_SIZE = 20
+MAX_HANDICAP_INDEX = Decimal("54.0")
+# Number of differentials -> (lowest differentials used, adjustment)
+DIFFERENTIALS_USED = {
+    3: (1, -2), 4: (1, -1), 5: (1, 0), 6: (2, -1), 7: (2, 0), 8: (2, 0),
+    9: (3, 0), 10: (3, 0), 11: (3, 0), 12: (4, 0), 13: (4, 0), 14: (4, 0),
+    15: (5, 0), 16: (5, 0), 17: (6, 0), 18: (6, 0), 19: (7, 0), 20: (8, 0),
+}
+
+
+def use_whs():
+    return getattr(settings, "HANDICAP_ENGINE", "whs") == "whs"
+
+
+def get_average_handicap(handicap, game_hcp):
+    return round(sum([Decimal(handicap), game_hcp])/2, 1)
+
+
+def get_handicap_index(differentials):
+    if len(differentials) not in DIFFERENTIALS_USED:
+        return None
+    used, adjustment = DIFFERENTIALS_USED[len(differentials)]
+    lowest = sorted([Decimal(str(d)) for d in differentials])[:used]
+    index = round(sum(lowest) / used + adjustment, 1)
+    return min(index, MAX_HANDICAP_INDEX)
+
+
+def _window_date(date_played):
+    return date_played.astimezone(datetime.timezone.utc).isoformat()
+
+
+def set_differentials(window, differentials):
+    differentials = sorted(differentials, key=lambda d: d[1], reverse=True)
+    window.differentials = differentials[:WINDOW_SIZE]
+    window.handicap_index = get_handicap_index([d[2] for d in window.differentials])
+
+
+def push_differential(window, game, differential):
+    differentials = [d for d in window.differentials if d[0] != game.id]
+    differentials.append([game.id, _window_date(game.date_played), float(differential)])
+    set_differentials(window, differentials)
+
+
+def get_latest_differentials(player_ids=None, exclude_game=None):
+    player_rounds = models.PlayerRound.objects.filter(league_game=True)
+    if player_ids is not None:
+        player_rounds = player_rounds.filter(player__in=player_ids)
+    if exclude_game is not None:
+        player_rounds = player_rounds.exclude(game=exclude_game)
+    player_rounds = player_rounds.annotate(
+        row=Window(
+            RowNumber(),
+            partition_by=F("player"),
+            order_by=[F("date_played").desc(), F("id").desc()],
+        )
+    ).filter(row__lte=WINDOW_SIZE)
+    differentials = {}
+    for player_id, game_id, date_played, differential in player_rounds.values_list(
+        "player_id", "game_id", "date_played", "differential"
+    ):
+        differentials.setdefault(player_id, []).append(
+            [game_id, _window_date(date_played), float(differential)]
+        )
+    return differentials
+
+
+def get_windows(player_ids, exclude_game=None):
+    windows = models.HandicapWindow.objects.in_bulk(player_ids)
+    missing = [pid for pid in player_ids if pid not in windows]
+    if missing:
+        latest = get_latest_differentials(missing, exclude_game)
+        for player_id in missing:
+            window = models.HandicapWindow(player_id=player_id)
+            set_differentials(window, latest.get(player_id, []))
+            windows[player_id] = window
+    return windows
+
+
+def save_windows(windows):
+    models.HandicapWindow.objects.bulk_create(
+        windows,
+        update_conflicts=True,
+        unique_fields=["player"],
+        update_fields=["differentials", "handicap_index", "updated_at"],
+    )
+
+
+def record_player_changes(players):
+    # bulk_update does not send the save signals that log changes.
+    changes.record(
+        models.Player, [p.id for p in players], models.ChangeActionChoices.UPDATED
+    )
+
+
+def apply_game_handicaps(game, hole_data):
+    """Update handicaps from a scored game. Scoring the same game again
+    recomputes from the handicap it started with rather than compounding."""
+    players = models.Player.objects.in_bulk([pd["player_id"] for pd in hole_data])
+    windows = get_windows(list(players.keys()), exclude_game=game)
+    entries = {}
+    later_entries = set()
+    for entry in models.HandicapHistory.objects.filter(
+        Q(game=game) | Q(game__date_played__gt=game.date_played),
+        player__in=players.keys(),
+    ):
+        if entry.game_id == game.id:
+            entries[entry.player_id] = entry
+        else:
+            later_entries.add(entry.player_id)
+    new_entries = []
+    changed_players = []
+    for pd in hole_data:
+        player = players[pd["player_id"]]
+        window = windows[player.id]
+        push_differential(window, game, round(rounds.get_differential(
+            pd["player_score"], pd["par"], game.holes_to_play, game.course
+        ), 1))
+        entry = entries.get(player.id)
+        previous = entry.previous_handicap if entry else player.handicap
+        if use_whs() and window.handicap_index is not None:
+            handicap = window.handicap_index
+        else:
+            handicap = get_average_handicap(previous, pd["game_hcp"])
+        if entry is None:
+            entry = models.HandicapHistory(
+                player=player,
+                game=game,
+                previous_handicap=previous,
+                handicap=handicap,
+                recorded_at=game.date_played,
+                applied=player.id not in later_entries,
+            )
+            new_entries.append(entry)
+            if entry.applied:
+                player.handicap = handicap
+        else:
+            if entry.applied:
+                player.handicap += handicap - entry.handicap
+            entry.handicap = handicap
+        changed_players.append(player)
+    models.Player.objects.bulk_update(changed_players, ["handicap"])
+    record_player_changes(changed_players)
+    models.HandicapHistory.objects.bulk_create(new_entries)
+    models.HandicapHistory.objects.bulk_update(entries.values(), ["handicap"])
+    save_windows(windows.values())
+    return changed_players
+
+
+def revert_game_handicaps(game):
+    entries = list(
+        models.HandicapHistory.objects.filter(game=game).select_related("player")
+    )
+    players = []
+    for entry in entries:
+        player = entry.player
+        if entry.applied:
+            player.handicap -= entry.handicap - entry.previous_handicap
+        players.append(player)
+    models.Player.objects.bulk_update(players, ["handicap"])
+    record_player_changes(players)
+    models.HandicapHistory.objects.filter(game=game).delete()
+    windows = [
+        window for window in models.HandicapWindow.objects.filter(
+            player__in=[p.id for p in players]
+        )
+        if any(d[0] == game.id for d in window.differentials)
+    ]
+    if windows:
+        latest = get_latest_differentials(
+            [w.player_id for w in windows], exclude_game=game
+        )
+        for window in windows:
+            set_differentials(window, latest.get(window.player_id, []))
+        save_windows(windows)
+    return players
+
+
+def recompute_all_handicaps():
+    """Recompute every round's differential and every player's window in one
+    pass over ``PlayerRound``, e.g. after a course rating or slope changes."""
+    changed_rounds = []
+    differentials = {}
+    player_rounds = models.PlayerRound.objects.select_related("course").order_by(
+        "player", "-date_played", "-id"
+    )
+    for player_round in player_rounds.iterator(chunk_size=2000):
+        differential = round(rounds.get_differential(
+            player_round.gross,
+            player_round.par,
+            player_round.holes_played,
+            player_round.course,
+        ), 1)
+        if differential != player_round.differential:
+            player_round.differential = differential
+            changed_rounds.append(player_round)
+        player_differentials = differentials.setdefault(player_round.player_id, [])
+        if player_round.league_game and len(player_differentials) < WINDOW_SIZE:
+            player_differentials.append([
+                player_round.game_id,
+                _window_date(player_round.date_played),
+                float(differential),
+            ])
+    models.PlayerRound.objects.bulk_update(
+        changed_rounds, ["differential"], batch_size=500
+    )
+    windows = []
+    for player_id, player_differentials in differentials.items():
+        window = models.HandicapWindow(player_id=player_id)
+        set_differentials(window, player_differentials)
+        windows.append(window)
+    models.HandicapWindow.objects.exclude(player__in=differentials.keys()).delete()
+    save_windows(windows)
+    if use_whs():
+        update_handicaps_from_windows(windows)
+    return windows
+
+
+def update_handicaps_from_windows(windows):
+    indexes = {
+        w.player_id: w.handicap_index for w in windows
+        if w.handicap_index is not None
+    }
+    players = []
+    entries = []
+    for player in models.Player.objects.filter(pk__in=indexes.keys()):
+        if player.handicap == indexes[player.id]:
+            continue
+        entries.append(models.HandicapHistory(
+            player=player,
+            previous_handicap=player.handicap,
+            handicap=indexes[player.id],
+            recorded_at=timezone.now(),
+        ))
+        player.handicap = indexes[player.id]
+        players.append(player)
+    models.Player.objects.bulk_update(players, ["handicap"], batch_size=500)
+    record_player_changes(players)
+    models.HandicapHistory.objects.bulk_create(entries, batch_size=500)
+    if players:
+        standings.recompute_standings()
+        leaderboard.clear_leaderboard(
+            models.Game.objects.filter(
+                players__in=players, status="active"
+            ).values("pk")
+        )
+    return players
+
+
+def record_manual_change(player, previous_handicap):
+    models.HandicapHistory.objects.create(
+        player=player,
+        previous_handicap=previous_handicap,
+        handicap=player.handicap,
+        recorded_at=timezone.now(),
+    )
+
+
+def get_handicap_as_of(player, when):
+    entry = (
+        models.HandicapHistory.objects.filter(player=player, recorded_at__lte=when)
+        .order_by("-recorded_at", "-id")
+        .first()
+    )
+    if entry is not None:
+        return entry.handicap
+    first_entry = (
+        models.HandicapHistory.objects.filter(player=player)
+        .order_by("recorded_at", "id")
+        .first()
+    )
+    if first_entry is not None and first_entry.previous_handicap is not None:
+        return first_entry.previous_handicap
+    return player.handicap
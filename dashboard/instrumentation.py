@@ -0,0 +1,219 @@
+"""Timing and call counts for the scoring hot paths.
+
+Functions decorated with ``@timed`` record their wall time and query count
+while instrumentation is switched on. Calls are keyed by their path through
+other timed calls (``utils.score_game > scoring.get_skins``) and labelled
+with the game size, the number of players scored, so one phase of scoring
+can be compared across field sizes.
+
+Records are buffered per process and flushed every few seconds into a
+SQLite file at ``INSTRUMENTATION_PATH``, which every worker on the host
+shares. The switch lives in the same file, so ``manage.py instrumentation
+on`` reaches running workers within ``INSTRUMENTATION_POLL_SECONDS``.
+While the file does not exist instrumentation is off and costs one clock
+read per call.
+"""
+import atexit
+import contextvars
+import functools
+import logging
+import sqlite3
+import threading
+import time
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS switch (
+    name TEXT PRIMARY KEY,
+    enabled INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS timings (
+    phase TEXT NOT NULL,
+    game_size INTEGER NOT NULL,
+    calls INTEGER NOT NULL,
+    total_ms REAL NOT NULL,
+    max_ms REAL NOT NULL,
+    queries INTEGER NOT NULL,
+    PRIMARY KEY (phase, game_size)
+);
+"""
+
+_lock = threading.Lock()
+_buffer = {}
+_state = {"enabled": False, "checked_at": None, "flushed_at": time.monotonic()}
+_call = contextvars.ContextVar("instrumented_call", default=None)
+
+
+def get_path():
+    return settings.INSTRUMENTATION_PATH
+
+
+def connect(create=False):
+    path = get_path()
+    if not create:
+        # Opening read-write without create keeps instrumentation from
+        # leaving files behind until someone switches it on.
+        uri = f"file:{path}?mode=rw"
+        db = sqlite3.connect(uri, uri=True, timeout=5)
+    else:
+        db = sqlite3.connect(path, timeout=5)
+        db.executescript(SCHEMA)
+    return db
+
+
+def set_enabled(enabled):
+    with connect(create=True) as db:
+        db.execute(
+            "INSERT INTO switch (name, enabled) VALUES ('scoring', ?) "
+            "ON CONFLICT (name) DO UPDATE SET enabled = excluded.enabled",
+            [int(enabled)],
+        )
+    db.close()
+    _state["checked_at"] = None
+
+
+def is_enabled():
+    now = time.monotonic()
+    checked_at = _state["checked_at"]
+    if checked_at is not None and now - checked_at < settings.INSTRUMENTATION_POLL_SECONDS:
+        return _state["enabled"]
+    try:
+        db = connect()
+        row = db.execute("SELECT enabled FROM switch WHERE name = 'scoring'").fetchone()
+        db.close()
+    except sqlite3.Error:
+        row = None
+    _state["enabled"] = bool(row and row[0])
+    _state["checked_at"] = now
+    return _state["enabled"]
+
+
+def set_game_size(size):
+    """Label the current timed call, and the calls around it, with ``size``."""
+    call = _call.get()
+    if call is not None:
+        call["frame"]["game_size"] = size
+
+
+def record(phase, game_size, elapsed_ms, queries):
+    key = (phase, game_size or 0)
+    with _lock:
+        calls, total_ms, max_ms, total_queries = _buffer.get(key, (0, 0.0, 0.0, 0))
+        _buffer[key] = (
+            calls + 1,
+            total_ms + elapsed_ms,
+            max(max_ms, elapsed_ms),
+            total_queries + queries,
+        )
+    if time.monotonic() - _state["flushed_at"] >= settings.INSTRUMENTATION_POLL_SECONDS:
+        flush()
+
+
+def flush():
+    with _lock:
+        rows = [(*key, *values) for key, values in _buffer.items()]
+        _buffer.clear()
+        _state["flushed_at"] = time.monotonic()
+    if not rows:
+        return
+    try:
+        db = connect(create=True)
+    except sqlite3.Error:
+        logger.exception("Could not open %s, dropped %d timings", get_path(), len(rows))
+        return
+    with db:
+        db.executemany(
+            "INSERT INTO timings (phase, game_size, calls, total_ms, max_ms, queries) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (phase, game_size) DO UPDATE SET "
+            "calls = calls + excluded.calls, "
+            "total_ms = total_ms + excluded.total_ms, "
+            "max_ms = max(max_ms, excluded.max_ms), "
+            "queries = queries + excluded.queries",
+            rows,
+        )
+    db.close()
+
+
+def get_report():
+    """Return the shared timings, slowest phases first."""
+    flush()
+    try:
+        db = connect()
+        rows = db.execute(
+            "SELECT phase, game_size, calls, total_ms, max_ms, queries "
+            "FROM timings ORDER BY total_ms DESC"
+        ).fetchall()
+        db.close()
+    except sqlite3.Error:
+        return []
+    return [
+        {
+            "phase": phase,
+            "game_size": game_size,
+            "calls": calls,
+            "total_ms": total_ms,
+            "mean_ms": total_ms / calls,
+            "max_ms": max_ms,
+            "queries": queries / calls,
+        }
+        for phase, game_size, calls, total_ms, max_ms, queries in rows
+    ]
+
+
+def reset():
+    with _lock:
+        _buffer.clear()
+    try:
+        with connect() as db:
+            db.execute("DELETE FROM timings")
+        db.close()
+    except sqlite3.Error:
+        pass
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def timed(get_size=None):
+    """Time a scoring function. ``get_size(result)`` labels the call with
+    its game size when the result is the first place that is known."""
+    def decorator(func):
+        name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return func(*args, **kwargs)
+            parent = _call.get()
+            call = {
+                "path": f"{parent['path']} > {name}" if parent else name,
+                "frame": parent["frame"] if parent else {"game_size": None},
+            }
+            token = _call.set(call)
+            counter = _QueryCounter()
+            started = time.perf_counter()
+            try:
+                with connection.execute_wrapper(counter):
+                    result = func(*args, **kwargs)
+            finally:
+                _call.reset(token)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if get_size is not None and call["frame"]["game_size"] is None:
+                call["frame"]["game_size"] = get_size(result)
+            record(call["path"], call["frame"]["game_size"], elapsed_ms, counter.count)
+            return result
+        return wrapper
+    return decorator
+
+
+atexit.register(flush)
@@ -0,0 +1,301 @@
+"""Running leaderboard for active games.
+
+The leaderboard is stored on ``Game.leaderboard`` and built once from the
+``ScoreMatrix``. After that every ``HoleScore`` write applies a delta to it:
+the player's totals, the team best-ball low on that hole and the skins
+state of that hole. Reads never touch ``HoleScore``.
+
+Anything that changes the shape of a game (players, teams, holes,
+handicaps) clears the leaderboard and it is rebuilt on the next read.
+"""
+from django.db import transaction
+from dashboard import live
+from dashboard import models
+from dashboard import scoring
+from dashboard import versions
+
+
+def build_leaderboard(score_data):
+    matrix = score_data["matrix"]
+    holes = score_data["holes"]
+    columns = [matrix.columns[h.id] for h in holes]
+    board = {
+        "holes": [
+            {"id": h.id, "name": h.name, "order": h.order, "par": h.par}
+            for h in holes
+        ],
+        "rows": {},
+        "players": [],
+        "teams": [],
+        "skins": [],
+    }
+    for row, player_mem in enumerate(matrix.players):
+        player = player_mem.player
+        row_points = matrix.row_points(row)
+        hole_scores = []
+        par = 0
+        points = 0
+        for col in columns:
+            if not matrix.is_present(row, col):
+                hole_scores.append(None)
+                continue
+            hole_scores.append([
+                matrix.get_hole_score_id(row, col),
+                matrix.get_strokes(row, col),
+            ])
+            par += matrix.par[col]
+            points += row_points[col] or 0
+        strokes = sum([hs[1] for hs in hole_scores if hs])
+        points_needed = scoring.get_points_needed(score_data, player_mem)
+        board["rows"][str(player_mem.id)] = row
+        board["players"].append({
+            "membership_id": player_mem.id,
+            "player_id": player.id,
+            "player_name": player.name,
+            "hcp": float(player.handicap),
+            "skins": player_mem.skins,
+            "team_id": player_mem.team_id,
+            "points_needed": points_needed,
+            "par": par,
+            "strokes": strokes,
+            "points": points,
+            "game_hcp": strokes - par,
+            "game_points": points - points_needed,
+            "hole_scores": hole_scores,
+        })
+    for team in score_data["teams"]:
+        team_data = {
+            "team_id": team.id,
+            "team_name": team.name,
+            "lows": [None] * len(holes),
+            "team_score": 0,
+        }
+        board["teams"].append(team_data)
+    for index in range(len(holes)):
+        for team_data in board["teams"]:
+            update_team_hole(board, team_data, index)
+        board["skins"].append(None)
+        update_skins_hole(board, index)
+    return board
+
+
+def update_team_hole(board, team_data, index):
+    scores = [
+        p["hole_scores"][index][1]
+        for p in board["players"]
+        if p["team_id"] == team_data["team_id"]
+        and p["hole_scores"][index]
+        and p["hole_scores"][index][1]
+    ]
+    old_low = team_data["lows"][index] or 0
+    new_low = min(scores) if scores else None
+    team_data["lows"][index] = new_low
+    team_data["team_score"] += (new_low or 0) - old_low
+
+
+def update_skins_hole(board, index):
+    scores = [
+        (p["player_name"], p["hole_scores"][index][1])
+        for p in board["players"]
+        if p["skins"] and p["hole_scores"][index] and p["hole_scores"][index][1]
+    ]
+    if not scores:
+        board["skins"][index] = None
+        return
+    low_score = min([s for _, s in scores])
+    low_players = [name for name, s in scores if s == low_score]
+    board["skins"][index] = {
+        "hole": board["holes"][index]["name"],
+        "low": low_score,
+        "player": low_players[0] if len(low_players) == 1 else "carry",
+    }
+
+
+def apply_hole_score(board, membership_id, hole_id, hole_score_id, strokes):
+    row = board["rows"].get(str(membership_id))
+    index = next(
+        (i for i, h in enumerate(board["holes"]) if h["id"] == hole_id), None
+    )
+    if row is None or index is None:
+        return False
+    player = board["players"][row]
+    par = board["holes"][index]["par"]
+    current = player["hole_scores"][index]
+    old_strokes = current[1] if current else 0
+    if current is None:
+        player["par"] += par
+    player["hole_scores"][index] = [hole_score_id, strokes]
+    points_delta = (
+        (scoring.get_hole_points(strokes, par) or 0)
+        - (scoring.get_hole_points(old_strokes, par) or 0)
+    )
+    player["strokes"] += strokes - old_strokes
+    player["points"] += points_delta
+    player["game_hcp"] = player["strokes"] - player["par"]
+    player["game_points"] = player["points"] - player["points_needed"]
+    for team_data in board["teams"]:
+        if team_data["team_id"] == player["team_id"]:
+            update_team_hole(board, team_data, index)
+    if player["skins"]:
+        update_skins_hole(board, index)
+    return True
+
+
+def record_hole_score(hole_score):
+    game_id = (
+        models.PlayerMembership.objects.filter(pk=hole_score.player_id)
+        .order_by()
+        .values_list("game_id", flat=True)
+        .first()
+    )
+    record_hole_scores(game_id, [hole_score])
+
+
+def record_hole_scores(game_id, hole_scores):
+    with transaction.atomic():
+        game = (
+            models.Game.objects.select_for_update()
+            .only("id", "leaderboard")
+            .filter(pk=game_id)
+            .order_by()
+            .first()
+        )
+        if game is None:
+            return
+        if game.leaderboard is None:
+            versions.bump(models.Game.objects.filter(pk=game_id))
+            return
+        for hole_score in hole_scores:
+            applied = apply_hole_score(
+                game.leaderboard,
+                hole_score.player_id,
+                hole_score.hole_id,
+                hole_score.id,
+                hole_score.strokes,
+            )
+            if not applied:
+                game.leaderboard = None
+                break
+        # The write that bumps the game's version for these scores.
+        models.Game.objects.filter(pk=game_id).update(
+            leaderboard=game.leaderboard, **versions.get_bump_fields()
+        )
+        if game.leaderboard is None:
+            message = {"type": "reset"}
+        else:
+            message = get_diff(game.leaderboard, hole_scores)
+        transaction.on_commit(lambda: live.publish_game(game_id, message))
+
+
+def clear_leaderboard(game_ids):
+    # Whatever clears a leaderboard changes what the game renders, so the
+    # version of every game goes up, built leaderboard or not.
+    games = models.Game.objects.filter(pk__in=game_ids)
+    built_ids = list(
+        games.filter(leaderboard__isnull=False).values_list("pk", flat=True)
+    )
+    games.update(leaderboard=None, **versions.get_bump_fields())
+    for game_id in built_ids:
+        transaction.on_commit(
+            lambda game_id=game_id: live.publish_game(game_id, {"type": "reset"})
+        )
+
+
+def get_leaderboard(game):
+    if game.leaderboard is None:
+        # Build under the same row lock as ``record_hole_score`` so a score
+        # written mid-build is applied on top rather than lost.
+        with transaction.atomic():
+            locked_game = (
+                models.Game.objects.select_for_update()
+                .only("id", "leaderboard")
+                .get(pk=game.pk)
+            )
+            if locked_game.leaderboard is None:
+                score_data = scoring.load_game_scores(game)
+                locked_game.leaderboard = build_leaderboard(score_data)
+                locked_game.save(update_fields=["leaderboard"])
+            game.leaderboard = locked_game.leaderboard
+    return game.leaderboard
+
+
+def get_standings(board, use_points=False):
+    if use_points:
+        return sorted(board["players"], key=lambda p: -p["game_points"])
+    return sorted(board["players"], key=lambda p: p["strokes"])
+
+
+def get_hole_data(board):
+    hole_data = []
+    for player in board["players"]:
+        hole_list = []
+        for hole, hole_score in zip(board["holes"], player["hole_scores"]):
+            if hole_score is None:
+                continue
+            hole_list.append({
+                "hole_score_id": hole_score[0],
+                "hole_order": hole["order"],
+                "hole_name": hole["name"],
+                "hole_strokes": hole_score[1],
+                "hole_par": hole["par"],
+            })
+        hole_data.append({
+            "player_id": player["player_id"],
+            "player_name": player["player_name"],
+            "hole_list": hole_list,
+            "player_score": player["strokes"],
+            "player_points": player["points"],
+            "par": player["par"],
+            "game_hcp": player["game_hcp"],
+            "game_points": player["game_points"],
+        })
+    return hole_data
+
+
+def get_slice(board, hole_scores):
+    rows = {board["rows"][str(hs.player_id)] for hs in hole_scores}
+    hole_ids = {hs.hole_id for hs in hole_scores}
+    players = [board["players"][row] for row in sorted(rows)]
+    team_ids = {p["team_id"] for p in players}
+    return {
+        "players": players,
+        "teams": [t for t in board["teams"] if t["team_id"] in team_ids],
+        "skins": [
+            skin for hole, skin in zip(board["holes"], board["skins"])
+            if hole["id"] in hole_ids
+        ],
+    }
+
+
+def get_diff(board, hole_scores):
+    board_slice = get_slice(board, hole_scores)
+    hole_index = {h["id"]: i for i, h in enumerate(board["holes"])}
+    changed = {}
+    for hs in hole_scores:
+        changed.setdefault(hs.player_id, []).append(hole_index[hs.hole_id])
+    return {
+        "type": "diff",
+        "players": [
+            {
+                "membership_id": p["membership_id"],
+                "strokes": p["strokes"],
+                "points": p["points"],
+                "game_hcp": p["game_hcp"],
+                "game_points": p["game_points"],
+                "holes": [
+                    [i, p["hole_scores"][i][1]]
+                    for i in changed[p["membership_id"]]
+                ],
+            }
+            for p in board_slice["players"]
+        ],
+        "teams": [
+            {"team_id": t["team_id"], "team_score": t["team_score"]}
+            for t in board_slice["teams"]
+        ],
+        "skins": [
+            [i, board["skins"][i]] for i in sorted({
+                i for indexes in changed.values() for i in indexes
+            })
+        ],
+    }
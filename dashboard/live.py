@@ -0,0 +1,82 @@
+"""In-process pub/sub feeding the live leaderboard stream.
+
+``leaderboard.record_hole_scores`` publishes one compact diff per score
+change to the game's channel and every open stream for that game receives
+it. The backend is chosen by ``settings.LIVE_BROKER``. The default
+``LocalBroker`` only reaches viewers connected to the same process.
+Deployments running several ASGI workers can point the setting at a
+backend with the same interface that fans out between processes.
+
+Streams are only served under ASGI. A WSGI worker would be held for as
+long as the page stays open, so there the game page keeps polling its
+leaderboard instead.
+"""
+import asyncio
+import threading
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.module_loading import import_string
+
+DEFAULT_BROKER = "dashboard.live.LocalBroker"
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def can_stream(request):
+    return isinstance(request, ASGIRequest)
+
+
+def game_channel(game_id):
+    return f"game-{game_id}"
+
+
+class LocalBroker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def subscribe(self, channel):
+        """Register an ``asyncio.Queue`` on the running loop for ``channel``."""
+        queue = asyncio.Queue(maxsize=100)
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add((loop, queue))
+        return queue
+
+    def unsubscribe(self, channel, queue):
+        with self.lock:
+            subscribers = self.subscribers.get(channel, set())
+            subscribers.difference_update({s for s in subscribers if s[1] is queue})
+            if not subscribers:
+                self.subscribers.pop(channel, None)
+
+    def publish(self, channel, message):
+        # Publishers run in sync code (often a worker thread), subscribers on
+        # the event loop, so hand each message over thread-safely.
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_put_message, queue, message)
+
+
+def _put_message(queue, message):
+    if queue.full():
+        # A viewer this far behind gets a reset and reloads the board.
+        while not queue.empty():
+            queue.get_nowait()
+        message = {"type": "reset"}
+    queue.put_nowait(message)
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, "LIVE_BROKER", DEFAULT_BROKER))()
+        return _broker
+
+
+def publish_game(game_id, message):
+    get_broker().publish(game_channel(game_id), message)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from dashboard import changes
+
+
+class Command(BaseCommand):
+    help = "Drops change log entries superseded by a later change to the same object"
+
+    def handle(self, *args, **options):
+        deleted = changes.compact()
+        self.stdout.write(self.style.SUCCESS(f"Dropped {deleted} change log entries"))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from dashboard import instrumentation
+
+
+class Command(BaseCommand):
+    help = "Switches scoring instrumentation on or off and reports its timings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["on", "off", "report", "reset"])
+        parser.add_argument(
+            "--size", type=int, help="Only report games with this many players"
+        )
+
+    def handle(self, *args, **options):
+        action = options["action"]
+        if action in ("on", "off"):
+            instrumentation.set_enabled(action == "on")
+            self.stdout.write(self.style.SUCCESS(
+                f"Scoring instrumentation {action} for {instrumentation.get_path()}"
+            ))
+            return
+        if action == "reset":
+            instrumentation.reset()
+            self.stdout.write(self.style.SUCCESS("Cleared scoring timings"))
+            return
+        rows = instrumentation.get_report()
+        if options["size"] is not None:
+            rows = [r for r in rows if r["game_size"] == options["size"]]
+        if not rows:
+            self.stdout.write("No scoring timings recorded")
+            return
+        self.stdout.write(
+            f"{'players':>7} {'calls':>7} {'total ms':>10} {'mean ms':>9} "
+            f"{'max ms':>9} {'queries':>7}  phase"
+        )
+        for row in rows:
+            self.stdout.write(
+                f"{row['game_size']:>7} {row['calls']:>7} {row['total_ms']:>10.1f} "
+                f"{row['mean_ms']:>9.2f} {row['max_ms']:>9.2f} {row['queries']:>7.1f}  "
+                f"{row['phase']}"
+            )
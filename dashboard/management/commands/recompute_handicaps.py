@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from dashboard import handicaps
+
+
+class Command(BaseCommand):
+    help = "Recomputes round differentials and handicap indexes for every player"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            windows = handicaps.recompute_all_handicaps()
+        indexed = len([w for w in windows if w.handicap_index is not None])
+        self.stdout.write(self.style.SUCCESS(
+            f"Recomputed {len(windows)} players, {indexed} with a handicap index"
+        ))
@@ -0,0 +1,109 @@
+import datetime
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from dashboard import handicaps
+from dashboard import models
+from dashboard import rescore
+
+
+def parse_date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date: {value}, expected YYYY-MM-DD")
+
+
+class Command(BaseCommand):
+    help = "Recomputes the stored score of completed games"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--course", type=int, help="Only games on this course id")
+        parser.add_argument("--start", type=parse_date, help="Played on or after YYYY-MM-DD")
+        parser.add_argument("--end", type=parse_date, help="Played on or before YYYY-MM-DD")
+        parser.add_argument("--season", type=int, help="Only games played in this year")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of worker processes, 1 scores in this process",
+        )
+        parser.add_argument("--chunk-size", type=int, default=25)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Print a diff of the games that would change and write nothing",
+        )
+        parser.add_argument(
+            "--handicaps",
+            action="store_true",
+            help="Recompute every handicap index from the rescored rounds",
+        )
+
+    def handle(self, *args, **options):
+        if options["course"] and not models.GolfCourse.objects.filter(
+            pk=options["course"]
+        ).exists():
+            raise CommandError(f"No course with id {options['course']}")
+        started = time.perf_counter()
+        games = rescore.get_games(
+            course=options["course"],
+            start=options["start"],
+            end=options["end"],
+            season=options["season"],
+        ).in_bulk()
+        game_ids = list(games.keys())
+        chunk_size = max(options["chunk_size"], 1)
+        chunks = [
+            game_ids[i:i + chunk_size] for i in range(0, len(game_ids), chunk_size)
+        ]
+        self.stdout.write(f"Rescoring {len(game_ids)} games in {len(chunks)} chunks")
+        changed = []
+        timings = []
+        for results in self.run_chunks(chunks, options["workers"]):
+            for game_id, score, seconds in results:
+                game = games[game_id]
+                timings.append((seconds, game_id))
+                if options["verbosity"] > 1:
+                    self.stdout.write(f"  game {game_id}: {seconds * 1000:.1f} ms")
+                if score == game.score:
+                    continue
+                if options["dry_run"]:
+                    self.stdout.write("\n".join(rescore.diff_scores(game, score)))
+                game.score = score
+                changed.append(game)
+            self.stdout.write(f"[{len(timings)}/{len(game_ids)}] games scored")
+        if changed and not options["dry_run"]:
+            with transaction.atomic():
+                rescore.save_scores(changed)
+                if options["handicaps"]:
+                    handicaps.recompute_all_handicaps()
+        elapsed = time.perf_counter() - started
+        if timings:
+            slowest, slowest_id = max(timings)
+            self.stdout.write(
+                f"Per game: {sum(t for t, _ in timings) / len(timings) * 1000:.1f} ms avg, "
+                f"{slowest * 1000:.1f} ms max (game {slowest_id})"
+            )
+        verb = "would change" if options["dry_run"] else "changed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(changed)} of {len(game_ids)} games {verb} in {elapsed:.2f}s"
+        ))
+
+    def run_chunks(self, chunks, workers):
+        if workers <= 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                yield rescore.rescore_chunk(chunk)
+            return
+        # Forked workers must not share the parent's database connections.
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(chunks)), mp_context=context
+        ) as executor:
+            futures = [executor.submit(rescore.rescore_chunk, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                yield future.result()
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0047_alter_game_date_played'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='leaderboard',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:51
+
+from django.db import migrations
+
+
+def remove_duplicate_hole_scores(apps, schema_editor):
+    HoleScore = apps.get_model("dashboard", "HoleScore")
+    seen = set()
+    duplicates = []
+    hole_scores = HoleScore.objects.order_by("player", "hole", "-strokes", "id")
+    for hole_score in hole_scores.iterator():
+        key = (hole_score.player_id, hole_score.hole_id)
+        if key in seen:
+            duplicates.append(hole_score.id)
+        seen.add(key)
+    HoleScore.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0048_game_leaderboard'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicate_hole_scores, migrations.RunPython.noop
+        ),
+        migrations.AlterUniqueTogether(
+            name='holescore',
+            unique_together={('player', 'hole')},
+        ),
+    ]
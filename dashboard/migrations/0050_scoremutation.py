@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0049_holescore_unique_player_hole'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreMutation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mutation_id', models.UUIDField(unique=True)),
+                ('strokes', models.PositiveSmallIntegerField(choices=[(0, ' 0'), (1, ' 1'), (2, ' 2'), (3, ' 3'), (4, ' 4'), (5, ' 5'), (6, ' 6'), (7, ' 7'), (8, ' 8'), (9, ' 9')])),
+                ('recorded_at', models.DateTimeField()),
+                ('priority', models.PositiveSmallIntegerField(default=0)),
+                ('applied', models.BooleanField(default=False)),
+                ('synced_at', models.DateTimeField(auto_now_add=True)),
+                ('hole_score', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dashboard.holescore')),
+                ('recorded_by', models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'score mutations',
+                'ordering': ['hole_score', 'recorded_at'],
+            },
+        ),
+    ]
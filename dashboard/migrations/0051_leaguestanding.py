@@ -0,0 +1,71 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:01
+
+import django.db.models.deletion
+import math
+from django.db import migrations, models
+from django.utils import timezone
+
+LEAGUE_POINTS = 36
+
+
+def round_up(x):
+    frac = x - math.floor(x)
+    if frac < 0.5:
+        return math.floor(x)
+    return math.ceil(x)
+
+
+def backfill_standings(apps, schema_editor):
+    Player = apps.get_model("dashboard", "Player")
+    LeagueStanding = apps.get_model("dashboard", "LeagueStanding")
+    season = timezone.localdate().year
+    players = Player.objects.annotate(
+        games_played=models.Count(
+            "playermembership",
+            filter=models.Q(
+                playermembership__game__league_game=True,
+                playermembership__game__status="completed",
+                playermembership__game__date_played__year=season,
+            ),
+        )
+    ).order_by("handicap", "last_name", "first_name")
+    LeagueStanding.objects.bulk_create([
+        LeagueStanding(
+            season=season,
+            player_id=player.id,
+            rank=rank,
+            handicap=player.handicap,
+            points=LEAGUE_POINTS - round_up(player.handicap),
+            games_played=player.games_played,
+        )
+        for rank, player in enumerate(players, start=1)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0050_scoremutation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeagueStanding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('season', models.PositiveSmallIntegerField()),
+                ('rank', models.PositiveIntegerField()),
+                ('handicap', models.DecimalField(decimal_places=1, max_digits=3)),
+                ('points', models.SmallIntegerField()),
+                ('games_played', models.PositiveSmallIntegerField(default=0)),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dashboard.player')),
+            ],
+            options={
+                'verbose_name_plural': 'league standings',
+                'ordering': ['season', 'rank'],
+                'indexes': [models.Index(fields=['season', 'rank'], name='dashboard_l_season_8cb10b_idx')],
+                'unique_together': {('season', 'player')},
+            },
+        ),
+        migrations.RunPython(backfill_standings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:02
+
+import django.db.models.deletion
+import math
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def round_up(x):
+    frac = x - math.floor(x)
+    if frac < 0.5:
+        return math.floor(x)
+    return math.ceil(x)
+
+
+def backfill_player_rounds(apps, schema_editor):
+    Game = apps.get_model("dashboard", "Game")
+    PlayerRound = apps.get_model("dashboard", "PlayerRound")
+    player_rounds = []
+    for game in Game.objects.filter(status="completed").exclude(score=None).iterator():
+        for score in game.score.get("scores") or []:
+            gross = score["player_score"]
+            par = score["par"]
+            handicap = Decimal(str(score["hcp"]))
+            strokes = handicap if game.holes_to_play == 18 else handicap / 2
+            player_rounds.append(PlayerRound(
+                player_id=score["player_id"],
+                game_id=game.id,
+                course_id=game.course_id,
+                date_played=game.date_played,
+                league_game=game.league_game,
+                holes_played=game.holes_to_play,
+                handicap=handicap,
+                par=par,
+                gross=gross,
+                net=gross - round_up(strokes),
+                points=score["player_points"],
+                differential=round(Decimal(gross - par) * 18 / game.holes_to_play, 1),
+            ))
+    PlayerRound.objects.bulk_create(player_rounds, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0051_leaguestanding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerRound',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_played', models.DateTimeField()),
+                ('league_game', models.BooleanField(default=True)),
+                ('holes_played', models.PositiveSmallIntegerField(choices=[(9, '9 Holes'), (18, '18 Holes')], default=18)),
+                ('handicap', models.DecimalField(decimal_places=1, max_digits=3)),
+                ('par', models.PositiveSmallIntegerField()),
+                ('gross', models.PositiveSmallIntegerField()),
+                ('net', models.SmallIntegerField()),
+                ('points', models.SmallIntegerField()),
+                ('differential', models.DecimalField(decimal_places=1, max_digits=4)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dashboard.golfcourse')),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dashboard.game')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dashboard.player')),
+            ],
+            options={
+                'verbose_name_plural': 'player rounds',
+                'ordering': ['player', '-date_played'],
+                'indexes': [models.Index(fields=['player', 'course', '-date_played'], name='dashboard_p_player__a9782c_idx'), models.Index(fields=['player', '-date_played'], name='dashboard_p_player__dd9a3b_idx')],
+                'unique_together': {('player', 'game')},
+            },
+        ),
+        migrations.RunPython(backfill_player_rounds, migrations.RunPython.noop),
+    ]
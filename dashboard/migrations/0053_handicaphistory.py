@@ -0,0 +1,52 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:04
+
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def backfill_handicap_history(apps, schema_editor):
+    Game = apps.get_model("dashboard", "Game")
+    HandicapHistory = apps.get_model("dashboard", "HandicapHistory")
+    entries = []
+    games = Game.objects.filter(status="completed", league_game=True).exclude(score=None)
+    for game in games.iterator():
+        for score in game.score.get("scores") or []:
+            previous = Decimal(str(score["hcp"]))
+            entries.append(HandicapHistory(
+                player_id=score["player_id"],
+                game_id=game.id,
+                previous_handicap=previous,
+                handicap=round((previous + score["game_hcp"]) / 2, 1),
+                recorded_at=game.date_played,
+            ))
+    HandicapHistory.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0052_playerround'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HandicapHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('previous_handicap', models.DecimalField(blank=True, decimal_places=1, default=None, max_digits=3, null=True)),
+                ('handicap', models.DecimalField(decimal_places=1, max_digits=3)),
+                ('recorded_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('game', models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.CASCADE, to='dashboard.game')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dashboard.player')),
+            ],
+            options={
+                'verbose_name_plural': 'handicap history',
+                'ordering': ['player', 'recorded_at', 'id'],
+                'indexes': [models.Index(fields=['player', 'recorded_at'], name='dashboard_h_player__333614_idx')],
+                'constraints': [models.UniqueConstraint(fields=('player', 'game'), name='unique_handicap_per_player_game')],
+            },
+        ),
+        migrations.RunPython(backfill_handicap_history, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0053_handicaphistory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HandicapWindow',
+            fields=[
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='handicap_window', serialize=False, to='dashboard.player')),
+                ('differentials', models.JSONField(blank=True, default=list)),
+                ('handicap_index', models.DecimalField(blank=True, decimal_places=1, default=None, max_digits=3, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='golfcourse',
+            name='course_rating',
+            field=models.DecimalField(blank=True, decimal_places=1, default=None, max_digits=4, null=True, verbose_name='Course Rating'),
+        ),
+        migrations.AddField(
+            model_name='golfcourse',
+            name='slope_rating',
+            field=models.PositiveSmallIntegerField(default=113, verbose_name='Slope Rating'),
+        ),
+    ]
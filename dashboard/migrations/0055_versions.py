@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0054_handicap_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='modified_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='golfcourse',
+            name='modified_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='golfcourse',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0056_change_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='handicaphistory',
+            name='applied',
+            field=models.BooleanField(default=True),
+        ),
+    ]
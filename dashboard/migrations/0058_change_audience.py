@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0057_handicap_history_applied'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='change',
+            name='audience',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from datetime import datetime
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce, Floor
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.utils import timezone
@@ -7,6 +9,10 @@ from django.utils.translation import gettext_lazy as _
 from djmoney.models.fields import MoneyField
 from djmoney.models.validators import MaxMoneyValidator, MinMoneyValidator
 from djmoney.money import Money
+from dashboard import course_index
+from dashboard import live
+from dashboard import rounds
+from dashboard import standings
 from dashboard import utils
 
 User = get_user_model()
@@ -116,6 +122,12 @@ class StrokeChoices(models.IntegerChoices):
     _9 = 9
 
 
+class ChangeActionChoices(models.TextChoices):
+    CREATED = "created", _("Created")
+    UPDATED = "updated", _("Updated")
+    DELETED = "deleted", _("Deleted")
+
+
 class GolfCourse(models.Model):
     name = models.CharField(max_length=128)
     initials = models.CharField(
@@ -144,6 +156,22 @@ class GolfCourse(models.Model):
         blank=True,
         null=True
     )
+    course_rating = models.DecimalField(
+        verbose_name="Course Rating",
+        max_digits=4,
+        decimal_places=1,
+        default=None,
+        blank=True,
+        null=True
+    )
+    slope_rating = models.PositiveSmallIntegerField(
+        verbose_name="Slope Rating",
+        default=113
+    )
+    # Bumped whenever the course, its holes or its tees change, see
+    # dashboard/versions.py.
+    version = models.PositiveIntegerField(default=1, editable=False)
+    modified_at = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         unique_together = ["name", "city", "state"]
@@ -158,7 +186,7 @@ class GolfCourse(models.Model):
 
     @property
     def points(self):
-        return utils.round_up(self.par/2)
+        return course_index.get_index(self.id)["points"]
 
 
 class Hole(models.Model):
@@ -267,6 +295,7 @@ class Game(models.Model):
         ],
     )
     score = models.JSONField(blank=True, null=True)
+    leaderboard = models.JSONField(blank=True, null=True, editable=False)
     use_teams = models.BooleanField(default=False)
     use_skins = models.BooleanField(default=True)
     league_game = models.BooleanField(default=True)
@@ -274,6 +303,10 @@ class Game(models.Model):
         choices=PayoutChoices.choices,
         default=PayoutChoices._1,
     )
+    # Bumped whenever anything the game renders changes, see
+    # dashboard/versions.py.
+    version = models.PositiveIntegerField(default=1, editable=False)
+    modified_at = models.DateTimeField(default=timezone.now, editable=False)
 
     @property
     def par(self):
@@ -285,7 +318,7 @@ class Game(models.Model):
 
     @property
     def points(self):
-        return self.course.points
+        return course_index.get_index(self.course_id)["points"]
 
     @property
     def skin_pot(self):
@@ -298,6 +331,18 @@ class Game(models.Model):
         else:
             return f"{self.course.initials} - {self.status}"
 
+    def save(self, *args, **kwargs):
+        # A full save can change anything the leaderboard is built from and
+        # would overwrite concurrent score updates with a stale copy.
+        if kwargs.get("update_fields") is None:
+            self.leaderboard = None
+            if self.pk:
+                game_id = self.pk
+                transaction.on_commit(
+                    lambda: live.publish_game(game_id, {"type": "reset"})
+                )
+        super().save(*args, **kwargs)
+
     def start(self, **kwargs):
         for key, value in kwargs.items():
             if key == "which_holes":
@@ -314,23 +359,32 @@ class Game(models.Model):
                 self.league_game = value
             if key == "payout_positions":
                 self.payout_positions = value
-        utils.create_hole_scores_for_game(self)
-        if self.use_teams:
-            utils.create_teams_for_game(self)
-        self.status = GameStatusChoices.ACTIVE
-        self.save()
+        with transaction.atomic():
+            utils.create_hole_scores_for_game(self)
+            if self.use_teams:
+                utils.create_teams_for_game(self)
+            self.status = GameStatusChoices.ACTIVE
+            self.save()
 
     def stop(self):
         if self.status != GameStatusChoices.COMPLETED:
-            self.score = utils.score_game(self)
-            self.status = GameStatusChoices.COMPLETED
-            self.save()
+            # All or nothing: a completed game is never stopped again, so a
+            # failure part way must not leave it completed.
+            with transaction.atomic():
+                self.score = utils.score_game(self)
+                self.status = GameStatusChoices.COMPLETED
+                self.save()
+                rounds.record_rounds(self)
+                standings.recompute_standings(standings.get_season(self))
 
     def reset(self):
-        utils.clean_game(self)
-        self.score = None
-        self.status = GameStatusChoices.SETUP
-        self.save()
+        with transaction.atomic():
+            rounds.delete_rounds(self)
+            utils.clean_game(self)
+            self.score = None
+            self.status = GameStatusChoices.SETUP
+            self.save()
+            standings.recompute_standings(standings.get_season(self))
 
     def clean(self):
         num_holes = self.course.hole_count - self.holes_to_play
@@ -396,6 +450,16 @@ class Player(models.Model):
         related_name="added_by"
     )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_handicap = instance.__dict__.get("handicap")
+        return instance
+
+    @property
+    def handicap_changed(self):
+        return getattr(self, "_loaded_handicap", None) != self.handicap
+
     @property
     def name(self):
         return f"{self.first_name} {self.last_name}"
@@ -429,6 +493,36 @@ class Team(models.Model):
         verbose_name_plural = "teams"
 
 
+class PlayerMembershipQuerySet(models.QuerySet):
+    def with_player_data(self):
+        """
+        Annotate handicap, team name and points needed so a game's roster
+        is read in one query. points_needed matches
+        ``game.points - round_up(player.handicap)``; round_up(x) is
+        floor(x + 0.5).
+        """
+        course_par = Subquery(
+            Hole.objects.filter(course=OuterRef("game__course"))
+            .order_by()
+            .values("course")
+            .annotate(total=Sum("par"))
+            .values("total")
+        )
+        course_points = Floor(
+            Cast(Coalesce(course_par, 0), models.FloatField()) / 2 + 0.5
+        )
+        hcp_strokes = Floor(
+            Cast(F("player__handicap"), models.FloatField()) + 0.5
+        )
+        return self.select_related("player", "team").annotate(
+            player_handicap=F("player__handicap"),
+            team_name=F("team__name"),
+            player_points_needed=Cast(
+                course_points - hcp_strokes, models.IntegerField()
+            ),
+        )
+
+
 class PlayerMembership(models.Model):
     game = models.ForeignKey(Game, on_delete=models.CASCADE)
     player = models.ForeignKey(Player, on_delete=models.CASCADE)
@@ -456,8 +550,12 @@ class PlayerMembership(models.Model):
         null=True
     )
 
+    objects = PlayerMembershipQuerySet.as_manager()
+
     @property
     def points_needed(self):
+        if hasattr(self, "player_points_needed"):
+            return self.player_points_needed
         return self.game.points - utils.round_up(self.player.handicap)
 
     def __str__(self):
@@ -549,9 +647,34 @@ class HoleScore(models.Model):
 
     class Meta:
         ordering = ["player", "hole", "-strokes"]
+        unique_together = ["player", "hole"]
         verbose_name_plural = "scores"
 
 
+class ScoreMutation(models.Model):
+    mutation_id = models.UUIDField(unique=True)
+    hole_score = models.ForeignKey(HoleScore, on_delete=models.CASCADE)
+    strokes = models.PositiveSmallIntegerField(choices=StrokeChoices.choices)
+    recorded_at = models.DateTimeField()
+    recorded_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        default=None,
+        blank=True,
+        null=True
+    )
+    priority = models.PositiveSmallIntegerField(default=0)
+    applied = models.BooleanField(default=False)
+    synced_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.hole_score} - {self.strokes} @ {self.recorded_at}"
+
+    class Meta:
+        ordering = ["hole_score", "recorded_at"]
+        verbose_name_plural = "score mutations"
+
+
 class TeeTime(models.Model):
     course = models.ForeignKey(GolfCourse, on_delete=models.CASCADE)
     tee_time = models.DateTimeField()
@@ -579,3 +702,127 @@ class TeeTime(models.Model):
         ordering = ["tee_time"]
         verbose_name_plural = "tee_times"
 
+
+
+class LeagueStanding(models.Model):
+    season = models.PositiveSmallIntegerField()
+    player = models.ForeignKey(Player, on_delete=models.CASCADE)
+    rank = models.PositiveIntegerField()
+    handicap = models.DecimalField(max_digits=3, decimal_places=1)
+    points = models.SmallIntegerField()
+    games_played = models.PositiveSmallIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.season} - {self.rank}. {self.player}"
+
+    class Meta:
+        unique_together = ["season", "player"]
+        ordering = ["season", "rank"]
+        indexes = [models.Index(fields=["season", "rank"])]
+        verbose_name_plural = "league standings"
+
+
+class PlayerRound(models.Model):
+    player = models.ForeignKey(Player, on_delete=models.CASCADE)
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    course = models.ForeignKey(GolfCourse, on_delete=models.CASCADE)
+    date_played = models.DateTimeField()
+    league_game = models.BooleanField(default=True)
+    holes_played = models.PositiveSmallIntegerField(
+        choices=HolesToPlayChoices.choices,
+        default=HolesToPlayChoices.HOLES_18
+    )
+    handicap = models.DecimalField(max_digits=3, decimal_places=1)
+    par = models.PositiveSmallIntegerField()
+    gross = models.PositiveSmallIntegerField()
+    net = models.SmallIntegerField()
+    points = models.SmallIntegerField()
+    differential = models.DecimalField(max_digits=4, decimal_places=1)
+
+    def __str__(self):
+        return f"{self.player} - {self.course.initials} - {self.date_played.date()}"
+
+    class Meta:
+        unique_together = ["player", "game"]
+        ordering = ["player", "-date_played"]
+        indexes = [
+            models.Index(fields=["player", "course", "-date_played"]),
+            models.Index(fields=["player", "-date_played"]),
+        ]
+        verbose_name_plural = "player rounds"
+
+
+class HandicapHistory(models.Model):
+    player = models.ForeignKey(Player, on_delete=models.CASCADE)
+    game = models.ForeignKey(
+        Game,
+        on_delete=models.CASCADE,
+        default=None,
+        blank=True,
+        null=True
+    )
+    previous_handicap = models.DecimalField(
+        max_digits=3,
+        decimal_places=1,
+        default=None,
+        blank=True,
+        null=True
+    )
+    handicap = models.DecimalField(max_digits=3, decimal_places=1)
+    recorded_at = models.DateTimeField(default=timezone.now)
+    # False when a later game had already set the player's handicap, so
+    # this entry's change was never applied to it.
+    applied = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.player} - {self.handicap} @ {self.recorded_at.date()}"
+
+    class Meta:
+        ordering = ["player", "recorded_at", "id"]
+        indexes = [models.Index(fields=["player", "recorded_at"])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["player", "game"], name="unique_handicap_per_player_game"
+            ),
+        ]
+        verbose_name_plural = "handicap history"
+
+
+class HandicapWindow(models.Model):
+    player = models.OneToOneField(
+        Player,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="handicap_window"
+    )
+    differentials = models.JSONField(default=list, blank=True)
+    handicap_index = models.DecimalField(
+        max_digits=3,
+        decimal_places=1,
+        default=None,
+        blank=True,
+        null=True
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.player} - {self.handicap_index}"
+
+
+class Change(models.Model):
+    """One entry in the change log behind ``/api/changes/``. The id is the
+    feed's cursor, see dashboard/changes.py."""
+    id = models.BigAutoField(primary_key=True)
+    resource = models.CharField(max_length=20)
+    object_id = models.PositiveIntegerField()
+    action = models.CharField(max_length=7, choices=ChangeActionChoices.choices)
+    # Ids of the users a deleted object was shown to.
+    audience = models.JSONField(blank=True, null=True)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.resource} {self.object_id} {self.action} @ {self.changed_at}"
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [models.Index(fields=["resource", "object_id", "id"])]
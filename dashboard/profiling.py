@@ -0,0 +1,215 @@
+"""Request profiling.
+
+``ProfilingMiddleware`` samples requests and records, per URL name, wall
+time, SQL count, SQL time, template render time and response size into
+in-process histograms. Each worker process keeps its own; the admin page
+and the text endpoint show the process that serves them.
+
+Histograms are HDR style: values are bucketed by power of two with 16
+linear sub-buckets each, so percentiles are within about 6% and memory is
+bounded by the range of values rather than the number of requests.
+
+Settings: ``PROFILING_ENABLED``, ``PROFILING_SAMPLE_RATE`` (0-1),
+``PROFILING_SLOW_MS`` (requests at or over it are logged with their
+slowest queries) and ``PROFILING_METRICS_TOKEN`` (lets a scraper read the
+text endpoint without an admin session).
+"""
+import contextvars
+import logging
+import random
+import threading
+import time
+from django.conf import settings
+from django.db import connection
+from django.template.backends import django as django_backend
+
+logger = logging.getLogger(__name__)
+
+SUB_BUCKET_BITS = 4
+METRICS = {
+    "wall_ms": 1000,
+    "sql_count": 1,
+    "sql_ms": 1000,
+    "template_ms": 1000,
+    "response_bytes": 1,
+}
+PERCENTILES = [50, 90, 99]
+SLOW_QUERY_COUNT = 5
+
+_lock = threading.Lock()
+_views = {}
+_template_time = contextvars.ContextVar("template_time", default=None)
+_template_depth = contextvars.ContextVar("template_depth", default=0)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def get_bucket(value):
+        exponent = max(value.bit_length() - SUB_BUCKET_BITS - 1, 0)
+        return exponent, value >> exponent
+
+    def record(self, value):
+        value = max(int(value), 0)
+        bucket = self.get_bucket(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+        target = self.count * percent / 100
+        seen = 0
+        for exponent, sub_bucket in sorted(self.buckets, key=lambda b: b[1] << b[0]):
+            seen += self.buckets[(exponent, sub_bucket)]
+            if seen >= target:
+                upper = ((sub_bucket + 1) << exponent) - 1
+                return min(upper, self.max)
+        return self.max
+
+
+def record(view_name, values):
+    with _lock:
+        histograms = _views.get(view_name)
+        if histograms is None:
+            histograms = _views[view_name] = {m: Histogram() for m in METRICS}
+        for metric, value in values.items():
+            histograms[metric].record(value)
+
+
+def reset():
+    with _lock:
+        _views.clear()
+
+
+def get_stats():
+    """Return a snapshot: {view name: {metric: summary}} in display units."""
+    with _lock:
+        stats = {}
+        for view_name, histograms in sorted(_views.items()):
+            stats[view_name] = {}
+            for metric, histogram in histograms.items():
+                scale = METRICS[metric]
+                summary = {
+                    "count": histogram.count,
+                    "mean": histogram.total / histogram.count / scale if histogram.count else 0,
+                    "max": (histogram.max or 0) / scale,
+                    "sum": histogram.total / scale,
+                }
+                for percent in PERCENTILES:
+                    summary[f"p{percent}"] = histogram.percentile(percent) / scale
+                stats[view_name][metric] = summary
+        return stats
+
+
+def format_metrics(stats):
+    """Format a snapshot in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        name = f"rsgolf_request_{metric}"
+        lines.append(f"# TYPE {name} summary")
+        for view_name, metrics in stats.items():
+            summary = metrics[metric]
+            label = f'view="{view_name}"'
+            for percent in PERCENTILES:
+                lines.append(
+                    f'{name}{{{label},quantile="{percent / 100}"}} {summary[f"p{percent}"]:g}'
+                )
+            lines.append(f"{name}_sum{{{label}}} {summary['sum']:g}")
+            lines.append(f"{name}_count{{{label}}} {summary['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class QueryCollector:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((time.perf_counter() - started, sql))
+
+
+def _timed_render(render):
+    def wrapper(self, *args, **kwargs):
+        timings = _template_time.get()
+        if timings is None:
+            return render(self, *args, **kwargs)
+        # Only top-level renders are recorded; nested ones (a form widget,
+        # render_to_string in a tag) are already inside their parent's time.
+        depth = _template_depth.get()
+        token = _template_depth.set(depth + 1)
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            _template_depth.reset(token)
+            if depth == 0:
+                timings.append(time.perf_counter() - started)
+    wrapper.profiled = True
+    return wrapper
+
+
+def install_template_timer():
+    render = django_backend.Template.render
+    if not getattr(render, "profiled", False):
+        django_backend.Template.render = _timed_render(render)
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_template_timer()
+
+    def __call__(self, request):
+        if not getattr(settings, "PROFILING_ENABLED", False) or (
+            random.random() >= getattr(settings, "PROFILING_SAMPLE_RATE", 1)
+        ):
+            return self.get_response(request)
+        collector = QueryCollector()
+        template_times = []
+        token = _template_time.set(template_times)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(collector):
+                response = self.get_response(request)
+        finally:
+            _template_time.reset(token)
+        wall = time.perf_counter() - started
+        match = request.resolver_match
+        view_name = match.view_name if match else "<unresolved>"
+        values = {
+            "wall_ms": wall * 1_000_000,
+            "sql_count": len(collector.queries),
+            "sql_ms": sum(d for d, _ in collector.queries) * 1_000_000,
+            "template_ms": sum(template_times) * 1_000_000,
+        }
+        if not response.streaming:
+            values["response_bytes"] = len(response.content)
+        record(view_name, values)
+        if wall * 1000 >= getattr(settings, "PROFILING_SLOW_MS", 1000):
+            self.log_slow_request(request, view_name, wall, collector.queries)
+        return response
+
+    def log_slow_request(self, request, view_name, wall, queries):
+        slowest = sorted(queries, key=lambda q: q[0], reverse=True)[:SLOW_QUERY_COUNT]
+        logger.warning(
+            "Slow request %s %s (%s): %.0f ms, %d queries\n%s",
+            request.method,
+            request.path,
+            view_name,
+            wall * 1000,
+            len(queries),
+            "\n".join(f"  {d * 1000:.1f} ms  {sql[:300]}" for d, sql in slowest),
+        )
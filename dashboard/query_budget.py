@@ -0,0 +1,89 @@
+"""Query budgets for views and API actions.
+
+A budget is the most queries a view may run however big the game or
+league it serves, so going over it almost always means an N+1 crept in.
+Function views declare theirs with ``@query_budget(n)`` and DRF viewsets
+with ``QueryBudgetMixin.query_budgets``; both land in ``BUDGETS``.
+
+``QUERY_BUDGET_MODE`` decides what happens when a budget is exceeded:
+``"raise"`` (tests), ``"log"`` (local) or ``"off"`` (production, where the
+views run unwrapped).
+"""
+import functools
+import logging
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+BUDGETS = {}
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def get_mode():
+    return getattr(settings, "QUERY_BUDGET_MODE", "off")
+
+
+def check_budget(name, count):
+    budget = BUDGETS.get(name)
+    if budget is None or count <= budget:
+        return
+    message = f"{name} ran {count} queries, over its budget of {budget}"
+    if get_mode() == "raise":
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def get_view_name(view):
+    return f"{view.__module__}.{view.__qualname__}"
+
+
+def query_budget(max_queries):
+    def decorator(view):
+        name = get_view_name(view)
+        BUDGETS[name] = max_queries
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if get_mode() == "off":
+                return view(request, *args, **kwargs)
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                response = view(request, *args, **kwargs)
+            check_budget(name, counter.count)
+            return response
+
+        wrapper.query_budget = name
+        return wrapper
+    return decorator
+
+
+class QueryBudgetMixin:
+    """Budget a viewset's actions, e.g. ``query_budgets = {"list": 4}``."""
+    query_budgets = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for action, max_queries in cls.query_budgets.items():
+            BUDGETS[f"{get_view_name(cls)}.{action}"] = max_queries
+
+    def dispatch(self, request, *args, **kwargs):
+        if get_mode() == "off":
+            return super().dispatch(request, *args, **kwargs)
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = super().dispatch(request, *args, **kwargs)
+        check_budget(f"{get_view_name(type(self))}.{self.action}", counter.count)
+        return response
@@ -0,0 +1,83 @@
+"""Per-player round history.
+
+``Game.stop`` writes one ``PlayerRound`` per player from the final score,
+and ``Game.reset`` removes them again. Course averages, recent form and
+league standings inputs are then range scans on
+``(player, course, date_played)`` rather than walks over every game.
+
+The differential is ``113 / slope * (gross - course rating)``, scaled to
+18 holes. Courses without a rating fall back to par and a slope of 113.
+"""
+from decimal import Decimal
+from django.db.models import Avg
+from dashboard import models
+from dashboard import utils
+
+
+def get_net_score(gross, handicap, holes_played):
+    strokes = handicap if holes_played == 18 else handicap / 2
+    return gross - utils.round_up(strokes)
+
+
+def get_differential(gross, par, holes_played, course=None):
+    rating = Decimal(par)
+    slope = 113
+    if course is not None:
+        if course.course_rating is not None:
+            rating = course.course_rating * holes_played / int(course.hole_count)
+        slope = course.slope_rating or 113
+    return Decimal(113) / slope * (gross - rating) * 18 / holes_played
+
+
+def build_rounds(game):
+    player_rounds = []
+    for score in game.score.get("scores", []):
+        gross = score["player_score"]
+        handicap = Decimal(str(score["hcp"]))
+        player_rounds.append(models.PlayerRound(
+            player_id=score["player_id"],
+            game=game,
+            course_id=game.course_id,
+            date_played=game.date_played,
+            league_game=game.league_game,
+            holes_played=game.holes_to_play,
+            handicap=handicap,
+            par=score["par"],
+            gross=gross,
+            net=get_net_score(gross, handicap, game.holes_to_play),
+            points=score["player_points"],
+            differential=round(get_differential(
+                gross, score["par"], game.holes_to_play, game.course
+            ), 1),
+        ))
+    return player_rounds
+
+
+def record_rounds(game):
+    models.PlayerRound.objects.filter(game=game).delete()
+    models.PlayerRound.objects.bulk_create(build_rounds(game))
+
+
+def delete_rounds(game):
+    models.PlayerRound.objects.filter(game=game).delete()
+
+
+def get_rounds(player, course=None, league_only=False):
+    player_rounds = models.PlayerRound.objects.filter(player=player)
+    if course is not None:
+        player_rounds = player_rounds.filter(course=course)
+    if league_only:
+        player_rounds = player_rounds.filter(league_game=True)
+    return player_rounds.order_by("-date_played")
+
+
+def get_course_average(player, course, league_only=True):
+    return get_rounds(player, course, league_only).aggregate(avg=Avg("gross"))["avg"]
+
+
+def get_recent_average(player, last=5, course=None):
+    recent = get_rounds(player, course).values_list("gross", flat=True)[:last]
+    recent = list(recent)
+    if not recent:
+        return None
+    return sum(recent) / len(recent)
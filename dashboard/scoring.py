@@ -0,0 +1,401 @@
+"""Set-based scoring for games.
+
+Everything needed to score a game is loaded up front by ``load_game_scores``
+in a fixed number of queries into a ``ScoreMatrix``, and every section of
+``Game.score`` is then built from that in-memory snapshot.
+"""
+from array import array
+from dashboard import changes
+from dashboard import instrumentation
+from dashboard import models
+from dashboard import utils
+
+
+def get_hole_points(strokes, par):
+    if not strokes:
+        return 0
+    return utils.points_map.get(strokes - par)
+
+
+class ScoreMatrix:
+    """Dense players x holes grid of strokes for one game.
+
+    Rows follow ``players`` (memberships) and columns follow ``holes``.
+    Strokes, par and hole handicap are kept in flat arrays so totals and
+    per-hole lows are slice operations instead of per-object lookups.
+    A hole score id of 0 marks a cell with no ``HoleScore`` row.
+    """
+
+    def __init__(self, players, holes):
+        self.players = list(players)
+        self.holes = list(holes)
+        self.width = len(self.holes)
+        self.rows = {p.id: i for i, p in enumerate(self.players)}
+        self.columns = {h.id: i for i, h in enumerate(self.holes)}
+        self.par = array("B", [h.par for h in self.holes])
+        self.handicap = array("B", [h.handicap for h in self.holes])
+        self.front = [i for i, h in enumerate(self.holes) if h.order < 10]
+        self.back = [i for i, h in enumerate(self.holes) if h.order >= 10]
+        size = len(self.players) * self.width
+        self.strokes = array("B", bytes(size))
+        self.hole_score_ids = array("q", [0]) * size
+
+    def index(self, row, col):
+        return row * self.width + col
+
+    def set_score(self, player_id, hole_id, strokes, hole_score_id=None):
+        row = self.rows.get(player_id)
+        col = self.columns.get(hole_id)
+        if row is None or col is None:
+            return False
+        i = self.index(row, col)
+        self.strokes[i] = strokes
+        if hole_score_id is not None:
+            self.hole_score_ids[i] = hole_score_id
+        return True
+
+    def get_strokes(self, row, col):
+        return self.strokes[self.index(row, col)]
+
+    def get_hole_score_id(self, row, col):
+        return self.hole_score_ids[self.index(row, col)]
+
+    def is_present(self, row, col):
+        return self.hole_score_ids[self.index(row, col)] != 0
+
+    def row_strokes(self, row):
+        start = row * self.width
+        return self.strokes[start:start + self.width]
+
+    def row_present(self, row):
+        start = row * self.width
+        return [bool(i) for i in self.hole_score_ids[start:start + self.width]]
+
+    def column_strokes(self, col):
+        return self.strokes[col::self.width]
+
+    def player_strokes(self, row):
+        return sum(self.row_strokes(row))
+
+    def player_par(self, row):
+        return sum([p for p, present in zip(self.par, self.row_present(row)) if present])
+
+    def player_front_back(self, row):
+        strokes = self.row_strokes(row)
+        return (
+            sum([strokes[c] for c in self.front]),
+            sum([strokes[c] for c in self.back]),
+        )
+
+    def row_points(self, row):
+        return [get_hole_points(s, p) for s, p in zip(self.row_strokes(row), self.par)]
+
+    def player_points(self, row):
+        return sum([p or 0 for p in self.row_points(row)])
+
+    def hole_low(self, col, rows):
+        column = self.column_strokes(col)
+        scores = [(r, column[r]) for r in rows if self.is_present(r, col)]
+        if not scores:
+            return None, []
+        low_score = min([s for _, s in scores])
+        return low_score, [r for r, s in scores if s == low_score]
+
+
+@instrumentation.timed(get_size=lambda score_data: len(score_data["memberships"]))
+def load_game_scores(game):
+    course_holes = list(
+        models.Hole.objects.filter(course_id=game.course_id).order_by("order")
+    )
+    memberships = list(
+        models.PlayerMembership.objects.filter(game=game)
+        .select_related("player", "team")
+        .order_by("player__last_name", "player__first_name")
+    )
+    matrix = ScoreMatrix(memberships, course_holes)
+    hole_scores = models.HoleScore.objects.filter(player__game=game).values_list(
+        "id", "player_id", "hole_id", "strokes"
+    )
+    for hole_score_id, player_id, hole_id, strokes in hole_scores:
+        matrix.set_score(player_id, hole_id, strokes, hole_score_id)
+    teams = []
+    if game.use_teams:
+        teams = list(models.Team.objects.filter(game=game))
+    return {
+        "game": game,
+        "course_par": sum(matrix.par),
+        "holes": filter_holes_for_game(game, course_holes),
+        "memberships": memberships,
+        "matrix": matrix,
+        "teams": teams,
+    }
+
+
+def filter_holes_for_game(game, course_holes):
+    if game.which_holes == "front":
+        return [h for h in course_holes if 1 <= h.order < 10]
+    elif game.which_holes == "back":
+        return [h for h in course_holes if h.order >= 10]
+    return list(course_holes)
+
+
+def get_points_needed(score_data, player_mem):
+    course_points = utils.round_up(score_data["course_par"]/2)
+    return course_points - utils.round_up(player_mem.player.handicap)
+
+
+def get_pot(score_data):
+    return score_data["game"].buy_in * len(score_data["memberships"])
+
+
+@instrumentation.timed()
+def get_all_scores(score_data):
+    matrix = score_data["matrix"]
+    all_scores = []
+    for hole in score_data["holes"]:
+        col = matrix.columns[hole.id]
+        hole_data = {
+            "order": hole.order,
+            "name": hole.name,
+            "scores": [],
+            "par": hole.par,
+            "handicap": int(hole.handicap),
+        }
+        par = matrix.par[col]
+        for row, player_mem in enumerate(matrix.players):
+            if not matrix.is_present(row, col):
+                continue
+            strokes = matrix.get_strokes(row, col)
+            hole_data["scores"].append({
+                "player": player_mem.player.name,
+                "strokes": strokes,
+                "points": get_hole_points(strokes, par),
+                "score": strokes - par if strokes else 0,
+                "skins": player_mem.skins,
+            })
+        hole_data["scores"].sort(key=lambda s: s["strokes"])
+        all_scores.append(hole_data)
+    all_scores.sort(key=lambda h: h["order"])
+    return all_scores
+
+
+@instrumentation.timed()
+def get_hole_data(score_data, final_scores=False):
+    game = score_data["game"]
+    matrix = score_data["matrix"]
+    hole_data = []
+    for row, player_mem in enumerate(matrix.players):
+        player = player_mem.player
+        player_data = {
+            "course_name": game.course.name,
+            "player_id": player.id,
+            "player_name": player.name,
+            "hcp": float(player.handicap),
+            "skins": player_mem.skins,
+            "points_needed": get_points_needed(score_data, player_mem),
+            "team_id": None,
+            "team_name": None,
+            "team_hcp": None,
+            "game_hcp": None,
+            "game_points": None,
+            "hole_list": [],
+            "player_score": matrix.player_strokes(row),
+            "player_points": matrix.player_points(row),
+            "par": matrix.player_par(row),
+            "winner": False,
+            "money": 0,
+        }
+        if game.use_teams and player_mem.team is not None:
+            player_data["team_id"] = player_mem.team.id
+            player_data["team_name"] = player_mem.team.name
+            player_data["team_hcp"] = str(player_mem.team.handicap)
+        row_points = matrix.row_points(row)
+        for col, strokes in enumerate(matrix.row_strokes(row)):
+            if not matrix.is_present(row, col):
+                continue
+            hole = matrix.holes[col]
+            player_data["hole_list"].append(
+                {
+                    "hole_score_id": matrix.get_hole_score_id(row, col),
+                    "hole_order": hole.order,
+                    "hole_name": hole.name,
+                    "hole_strokes": strokes,
+                    "hole_points": row_points[col],
+                    "hole_par": hole.par,
+                    "hole_handicap": str(hole.handicap),
+                    "hole_score": strokes - hole.par if strokes else 0,
+                }
+            )
+        player_data["game_hcp"] = player_data["player_score"] - player_data["par"]
+        player_data["game_points"] = player_data["player_points"] - player_data["points_needed"]
+        if final_scores:
+            player_mem.game_handicap = player_data["game_hcp"]
+            player_mem.game_score = player_data["player_score"]
+            player_mem.game_points = player_data["game_points"]
+        hole_data.append(player_data)
+    if final_scores:
+        models.PlayerMembership.objects.bulk_update(
+            matrix.players,
+            ["game_handicap", "game_score", "game_points"],
+        )
+        changes.record(
+            models.PlayerMembership,
+            [m.id for m in matrix.players],
+            models.ChangeActionChoices.UPDATED,
+        )
+    return hole_data
+
+
+def get_skin_holes(score_data):
+    matrix = score_data["matrix"]
+    skin_rows = [r for r, p in enumerate(matrix.players) if p.skins]
+    skin_holes = []
+    for hole in score_data["holes"]:
+        col = matrix.columns[hole.id]
+        hole_data = {
+            "order": hole.order,
+            "name": hole.name,
+            "scores": [],
+            "par": hole.par,
+            "handicap": str(hole.handicap),
+        }
+        for row in skin_rows:
+            if matrix.is_present(row, col):
+                hole_data["scores"].append(
+                    {
+                        "player": matrix.players[row].player.name,
+                        "strokes": matrix.get_strokes(row, col),
+                    }
+                )
+        skin_holes.append(hole_data)
+    skin_holes.sort(key=lambda s: s["order"])
+    return skin_holes
+
+
+@instrumentation.timed()
+def get_skins(score_data):
+    matrix = score_data["matrix"]
+    skin_cost = score_data["game"].skin_cost
+    skin_rows = [r for r, p in enumerate(matrix.players) if p.skins]
+    skins = []
+    carry_money = None
+    for hole in sorted(score_data["holes"], key=lambda h: h.order):
+        col = matrix.columns[hole.id]
+        low_score, low_rows = matrix.hole_low(col, skin_rows)
+        if low_score is None:
+            continue
+        num_scores = len([r for r in skin_rows if matrix.is_present(r, col)])
+        hole_money = skin_cost * num_scores
+        if len(low_rows) == 1:
+            player = matrix.players[low_rows[0]].player.name
+            if carry_money == None:
+                money = hole_money
+            else:
+                money = hole_money + carry_money
+                carry_money = None
+        else:
+            player = "carry"
+            money = "---"
+            if carry_money == None:
+                carry_money = hole_money
+            else:
+                carry_money += hole_money
+        skins.append({"hole": hole.name, "player": player, "money": str(money)})
+    return skins
+
+
+@instrumentation.timed()
+def get_team_score(score_data, team):
+    matrix = score_data["matrix"]
+    team_score = {
+        "team_id": team.id,
+        "team_name": team.name,
+        "handicap": str(team.handicap),
+        "players": [],
+        "hole_list": [],
+        "team_score": 0,
+        "winner": False,
+        "money": 0,
+    }
+    hole_index = {}
+    for row, player_mem in enumerate(matrix.players):
+        if player_mem.team_id != team.id:
+            continue
+        player = player_mem.player
+        team_score["players"].append(player.name)
+        for col, strokes in enumerate(matrix.row_strokes(row)):
+            if not strokes or not matrix.is_present(row, col):
+                continue
+            hole = matrix.holes[col]
+            hole_data = {
+                "player_name": player.name,
+                "hole_order": hole.order,
+                "hole_name": hole.name,
+                "hole_score": strokes,
+                "hole_par": hole.par,
+                "hole_handicap": str(hole.handicap),
+            }
+            index = hole_index.get(hole.order)
+            if index is None:
+                hole_index[hole.order] = len(team_score["hole_list"])
+                team_score["hole_list"].append(hole_data)
+                continue
+            current_hole = team_score["hole_list"][index]
+            if current_hole["hole_score"] > strokes:
+                team_score["hole_list"][index] = hole_data
+            elif current_hole["hole_score"] == strokes:
+                hole_data.update(player_name="Multiple")
+                team_score["hole_list"][index] = hole_data
+    team_score["team_score"] = sum([_h["hole_score"] for _h in team_score["hole_list"]])
+    return team_score
+
+
+@instrumentation.timed()
+def score_teams(score_data):
+    game = score_data["game"]
+    pot = get_pot(score_data)
+    team_data = [get_team_score(score_data, t) for t in score_data["teams"]]
+    score_list = [td["team_score"] for td in team_data]
+    if not team_data:
+        return team_data
+    if not game.payout_positions or game.payout_positions == 1:
+        team_data, _ = utils.update_team_data_low_score(team_data, score_list, pot)
+    elif game.payout_positions == 2:
+        team_data, sl = utils.update_team_data_low_score(team_data, score_list, pot, 80)
+        team_data, _ = utils.update_team_data_low_score(team_data, sl, pot, 20)
+    elif game.payout_positions == 3:
+        team_data, sl = utils.update_team_data_low_score(team_data, score_list, pot, 70)
+        team_data, sl = utils.update_team_data_low_score(team_data, sl, pot, 20)
+        team_data, _ = utils.update_team_data_low_score(team_data, sl, pot, 10)
+    return team_data
+
+
+@instrumentation.timed(get_size=lambda game_score: len(game_score["scores"]))
+def score_game(game, score_data=None, final_scores=True):
+    """Score a game. With ``final_scores`` off nothing is written: player
+    memberships and handicaps are left alone, as when re-scoring archives."""
+    score_data = score_data or load_game_scores(game)
+    pot = get_pot(score_data)
+    hole_list = utils.get_hole_list_for_game(game)
+    all_scores = get_all_scores(score_data)
+    hole_data = get_hole_data(score_data, final_scores=final_scores)
+    if game.game_type == "stableford":
+        scores = utils.score_hole_data(hole_data, pot, game.payout_positions, use_points=True)
+    else:
+        scores = utils.score_hole_data(hole_data, pot, game.payout_positions)
+    game_score = {
+        "all_scores": all_scores,
+        "hole_list": hole_list,
+        "scores": scores,
+    }
+    if game.use_skins:
+        # Game.score has always stored only the skins players in
+        # ``all_scores`` once skins are on.
+        utils.filter_skins_from_all_scores(all_scores)
+        game_score.update({"skins": get_skins(score_data)})
+    if game.use_teams:
+        team_scores = score_teams(score_data)
+        game_score.update({"team_scores": team_scores})
+    if game.league_game and final_scores:
+        utils.update_player_hcp(game, hole_data)
+    return game_score
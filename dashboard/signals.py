@@ -1,8 +1,17 @@
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db.models import F, Q
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
 from django.core.mail import send_mail
 from django.conf import settings
+from django.utils import timezone
+from dashboard import changes
+from dashboard import course_index
+from dashboard import handicaps
+from dashboard import leaderboard
+from dashboard import models
+from dashboard import standings
+from dashboard import versions
 
 
 @receiver(post_save, sender=get_user_model())
@@ -18,3 +27,186 @@ def send_email_to_admin(sender, instance, created, **kwargs):
                 settings.DEFAULT_FROM_EMAIL,
                 admin_list
             )
+
+
+@receiver(post_save, sender=models.HoleScore)
+def update_leaderboard_for_hole_score(sender, instance, created, **kwargs):
+    if created:
+        leaderboard.clear_leaderboard(
+            models.Game.objects.filter(playermembership=instance.player_id).values("pk")
+        )
+    else:
+        leaderboard.record_hole_score(instance)
+
+
+@receiver(post_delete, sender=models.HoleScore)
+def clear_leaderboard_for_hole_score(sender, instance, origin=None, **kwargs):
+    # When a membership, hole or game delete cascades here, its own signal
+    # clears the game once rather than once per hole score.
+    if getattr(origin, "model", type(origin)) is not models.HoleScore:
+        return
+    leaderboard.clear_leaderboard(
+        models.Game.objects.filter(playermembership=instance.player_id).values("pk")
+    )
+
+
+@receiver(post_save, sender=models.PlayerMembership)
+@receiver(post_delete, sender=models.PlayerMembership)
+@receiver(post_save, sender=models.Team)
+@receiver(post_delete, sender=models.Team)
+def clear_leaderboard_for_game(sender, instance, **kwargs):
+    leaderboard.clear_leaderboard([instance.game_id])
+
+
+@receiver(post_save, sender=models.Player)
+def recompute_standings_for_player(sender, instance, created, **kwargs):
+    if created:
+        # A new player's handicap is where their history starts, not an edit.
+        standings.add_player_standing(instance)
+        instance._loaded_handicap = instance.handicap
+    elif instance.handicap_changed:
+        handicaps.record_manual_change(
+            instance, getattr(instance, "_loaded_handicap", None)
+        )
+        standings.recompute_standings()
+        instance._loaded_handicap = instance.handicap
+
+
+@receiver(post_delete, sender=models.Player)
+def recompute_standings_for_deleted_player(sender, instance, **kwargs):
+    standings.recompute_standings()
+
+
+@receiver(post_save, sender=models.Player)
+def clear_leaderboard_for_player(sender, instance, **kwargs):
+    leaderboard.clear_leaderboard(
+        models.Game.objects.filter(players=instance, status="active").values("pk")
+    )
+
+
+@receiver(post_save, sender=models.Hole)
+@receiver(post_delete, sender=models.Hole)
+def invalidate_course_index(sender, instance, **kwargs):
+    course_index.invalidate(instance.course_id)
+
+
+@receiver(post_save, sender=models.Hole)
+@receiver(post_delete, sender=models.Hole)
+def clear_leaderboard_for_hole(sender, instance, **kwargs):
+    leaderboard.clear_leaderboard(
+        models.Game.objects.filter(course_id=instance.course_id, status="active").values("pk")
+    )
+
+
+@receiver(pre_save, sender=models.Game)
+@receiver(pre_save, sender=models.GolfCourse)
+def bump_version(sender, instance, update_fields=None, **kwargs):
+    if instance._state.adding or update_fields is not None:
+        return
+    instance.version = F("version") + 1
+    instance.modified_at = timezone.now()
+
+
+@receiver(post_save, sender=models.Game)
+@receiver(post_save, sender=models.GolfCourse)
+def bump_version_for_update_fields(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return
+    if update_fields is None:
+        # Leave the version deferred so it is read back, not the expression.
+        instance.__dict__.pop("version", None)
+        return
+    if set(update_fields) - versions.UNVERSIONED_FIELDS - {"version", "modified_at"}:
+        versions.bump(sender.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=models.Hole)
+@receiver(post_delete, sender=models.Hole)
+def bump_course_version_for_hole(sender, instance, **kwargs):
+    versions.bump(models.GolfCourse.objects.filter(pk=instance.course_id))
+
+
+@receiver(post_save, sender=models.Tee)
+@receiver(post_delete, sender=models.Tee)
+def bump_course_version_for_tee(sender, instance, **kwargs):
+    versions.bump(models.GolfCourse.objects.filter(hole=instance.hole_id))
+
+
+@receiver(post_save, sender=models.Player)
+@receiver(post_delete, sender=models.Player)
+def bump_game_version_for_player(sender, instance, **kwargs):
+    # Games show their players' names, and games in setup list every
+    # player that could still be added.
+    versions.bump(models.Game.objects.filter(Q(players=instance) | Q(status="setup")))
+
+
+@receiver(post_save, sender=models.Game)
+@receiver(post_save, sender=models.PlayerMembership)
+@receiver(post_save, sender=models.HoleScore)
+@receiver(post_save, sender=models.Player)
+@receiver(post_save, sender=models.TeeTime)
+@receiver(post_save, sender=models.GolfCourse)
+def record_change(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= versions.UNVERSIONED_FIELDS:
+        return
+    action = (
+        models.ChangeActionChoices.CREATED if created
+        else models.ChangeActionChoices.UPDATED
+    )
+    changes.record(sender, [instance.pk], action)
+
+
+@receiver(pre_delete, sender=models.Game)
+@receiver(pre_delete, sender=models.PlayerMembership)
+@receiver(pre_delete, sender=models.HoleScore)
+@receiver(pre_delete, sender=models.Player)
+@receiver(pre_delete, sender=models.TeeTime)
+@receiver(pre_delete, sender=models.GolfCourse)
+def get_deletion_audience(sender, instance, origin=None, **kwargs):
+    # Every row a delete cascades to is still there when this is sent.
+    cache = origin.__dict__.setdefault("_audience_cache", {})
+    instance._deletion_audience = changes.get_audience(instance, cache)
+
+
+@receiver(post_delete, sender=models.Game)
+@receiver(post_delete, sender=models.PlayerMembership)
+@receiver(post_delete, sender=models.HoleScore)
+@receiver(post_delete, sender=models.Player)
+@receiver(post_delete, sender=models.TeeTime)
+@receiver(post_delete, sender=models.GolfCourse)
+def record_deletion(sender, instance, origin=None, **kwargs):
+    # A delete sends a signal per row it cascades to, before the signal for
+    # the row deleted. Rows deleted along with a synced object are logged
+    # with it, in one query.
+    deleted = models.ChangeActionChoices.DELETED
+    row = (sender, instance.pk, instance.__dict__.get("_deletion_audience", []))
+    if origin is not instance:
+        if (
+            type(origin).__name__ in changes.RESOURCES
+            and not getattr(origin, "_deletion_logged", False)
+        ):
+            origin.__dict__.setdefault("_cascaded_deletions", []).append(row)
+        else:
+            changes.record_rows([row], deleted)
+        return
+    rows = instance.__dict__.pop("_cascaded_deletions", [])
+    changes.record_rows([*rows, row], deleted)
+    instance._deletion_logged = True
+
+
+@receiver(m2m_changed, sender=models.TeeTime.players.through)
+def record_tee_time_players_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith("post_"):
+            changes.record(models.TeeTime, [instance.pk], models.ChangeActionChoices.UPDATED)
+        return
+    # Changed from the player's side, where a clear does not pass the ids.
+    if action == "pre_clear":
+        instance._cleared_tee_time_ids = list(
+            instance.teetime_set.values_list("pk", flat=True)
+        )
+    elif action == "post_clear":
+        ids = instance.__dict__.pop("_cleared_tee_time_ids", [])
+        changes.record(models.TeeTime, ids, models.ChangeActionChoices.UPDATED)
+    elif action.startswith("post_"):
+        changes.record(models.TeeTime, pk_set, models.ChangeActionChoices.UPDATED)
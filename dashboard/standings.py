@@ -0,0 +1,123 @@
+"""Materialized league standings.
+
+Standings are stored per season in ``LeagueStanding`` and recomputed only
+when their inputs change: a game is scored or reset, or a player's
+handicap is edited. Ranking is done by the database with a window
+function, so the dashboard reads a pre-ranked page in one query.
+"""
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from dashboard import models
+from dashboard import utils
+
+LEAGUE_POINTS = 36
+
+
+def current_season():
+    return timezone.localdate().year
+
+
+def get_season(game):
+    return timezone.localtime(game.date_played).year
+
+
+def recompute_standings(season=None):
+    season = season or current_season()
+    league_games = Q(
+        playermembership__game__league_game=True,
+        playermembership__game__status=models.GameStatusChoices.COMPLETED,
+        playermembership__game__date_played__year=season,
+    )
+    ranked_players = models.Player.objects.annotate(
+        rank=Window(
+            RowNumber(),
+            order_by=[F("handicap").asc(), F("last_name").asc(), F("first_name").asc()],
+        ),
+        games_played=Count("playermembership", filter=league_games),
+    ).values_list("id", "rank", "handicap", "games_played")
+    standings = [
+        models.LeagueStanding(
+            season=season,
+            player_id=player_id,
+            rank=rank,
+            handicap=handicap,
+            points=LEAGUE_POINTS - utils.round_up(handicap),
+            games_played=games_played,
+        )
+        for player_id, rank, handicap, games_played in ranked_players
+    ]
+    with transaction.atomic():
+        models.LeagueStanding.objects.filter(season=season).delete()
+        models.LeagueStanding.objects.bulk_create(standings)
+
+
+def add_player_standing(player, season=None):
+    """Rank a new player into the season's standings. They have played no
+    games, so only the players ranked below them move down one place."""
+    season = season or current_season()
+    if player.last_name is None or player.first_name is None:
+        # Where the database sorts a missing name depends on the database.
+        recompute_standings(season)
+        return
+    standings = models.LeagueStanding.objects.filter(season=season)
+    counts = standings.aggregate(
+        total=Count("id"),
+        ahead=Count("id", filter=(
+            Q(handicap__lt=player.handicap)
+            | Q(handicap=player.handicap, player__last_name__lt=player.last_name)
+            | Q(
+                handicap=player.handicap,
+                player__last_name=player.last_name,
+                player__first_name__lt=player.first_name,
+            )
+        )),
+    )
+    if not counts["total"]:
+        # Not computed yet; get_standings computes it in full.
+        return
+    rank = counts["ahead"] + 1
+    with transaction.atomic():
+        standings.filter(rank__gte=rank).update(rank=F("rank") + 1)
+        models.LeagueStanding.objects.create(
+            season=season,
+            player=player,
+            rank=rank,
+            handicap=player.handicap,
+            points=LEAGUE_POINTS - utils.round_up(player.handicap),
+        )
+
+
+def get_ranked_standings(season):
+    return (
+        models.LeagueStanding.objects.filter(season=season)
+        .select_related("player")
+        .order_by("rank")
+    )
+
+
+def get_standings(season=None):
+    """Return the season's standings, computing them on the first read of
+    a new season (or of a fresh install)."""
+    season = season or current_season()
+    standings = get_ranked_standings(season)
+    # Testing the queryset loads it, so a computed season is one query.
+    if not standings and models.Player.objects.exists():
+        recompute_standings(season)
+        standings = get_ranked_standings(season)
+    return standings
+
+
+def get_standings_page(page_number=1, season=None):
+    season = season or current_season()
+    paginator = Paginator(
+        get_ranked_standings(season), getattr(settings, "PAGINATION_COUNT", 25)
+    )
+    if paginator.count == 0 and models.Player.objects.exists():
+        # Counted rather than loaded, unlike get_standings.
+        recompute_standings(season)
+        paginator = Paginator(get_ranked_standings(season), paginator.per_page)
+    return paginator.get_page(page_number)
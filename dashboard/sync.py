@@ -0,0 +1,175 @@
+"""Server side of offline score capture.
+
+Scorers queue score changes on the device while they have no signal and
+send them here in one request when they reconnect. Each mutation carries a
+client generated ``mutation_id`` so a retried sync never applies twice,
+and the time it was recorded on the device.
+
+When two mutations target the same hole score the one from the higher
+priority scorer wins (admin over the player whose card it is, over anyone
+else), and between equal priorities the later recorded one wins. Scores
+entered online are logged as mutations recorded when they reach the
+server, so they take part in the same comparison.
+"""
+import uuid
+from datetime import timezone as dt_timezone
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from dashboard import changes
+from dashboard import leaderboard
+from dashboard import models
+from dashboard import utils
+
+PRIORITY_OTHER = 0
+PRIORITY_PLAYER = 1
+PRIORITY_ADMIN = 2
+
+
+def get_scorer_priorities(user, hole_score_ids):
+    """Return the priority of ``user`` on each hole score's card."""
+    if user is None:
+        return dict.fromkeys(hole_score_ids, PRIORITY_OTHER)
+    if utils.is_admin(user):
+        return dict.fromkeys(hole_score_ids, PRIORITY_ADMIN)
+    own_cards = set(
+        models.HoleScore.objects.filter(
+            pk__in=hole_score_ids, player__player__user_account=user
+        ).values_list("pk", flat=True)
+    )
+    return {
+        pk: PRIORITY_PLAYER if pk in own_cards else PRIORITY_OTHER
+        for pk in hole_score_ids
+    }
+
+
+def record_online_scores(user, hole_scores):
+    """Log the scores ``user`` just saved online as applied mutations, so
+    an offline mutation recorded before them does not overwrite them."""
+    priorities = get_scorer_priorities(user, [hs.pk for hs in hole_scores])
+    recorded_at = timezone.now()
+    models.ScoreMutation.objects.bulk_create([
+        models.ScoreMutation(
+            mutation_id=uuid.uuid4(),
+            hole_score=hole_score,
+            strokes=hole_score.strokes,
+            recorded_at=recorded_at,
+            recorded_by=user,
+            priority=priorities[hole_score.pk],
+            applied=True,
+        )
+        for hole_score in hole_scores
+    ])
+
+
+def parse_mutation(data):
+    try:
+        mutation_id = uuid.UUID(str(data["mutation_id"]))
+        hole_score_id = int(data["hole_score_id"])
+        strokes = int(data["strokes"])
+        recorded_at = parse_datetime(str(data["recorded_at"]))
+    except (KeyError, TypeError, ValueError):
+        raise ValidationError(f"Invalid mutation: {data}")
+    if recorded_at is None:
+        raise ValidationError(f"Invalid recorded_at: {data['recorded_at']}")
+    if timezone.is_naive(recorded_at):
+        recorded_at = timezone.make_aware(recorded_at, dt_timezone.utc)
+    # A device clock running fast must not let its scores win forever.
+    recorded_at = min(recorded_at, timezone.now())
+    if strokes not in models.StrokeChoices.values:
+        raise ValidationError(f"Invalid strokes: {strokes}")
+    return {
+        "mutation_id": mutation_id,
+        "hole_score_id": hole_score_id,
+        "strokes": strokes,
+        "recorded_at": recorded_at,
+    }
+
+
+def get_rejected_result(data, message):
+    mutation_id = data.get("mutation_id") if isinstance(data, dict) else None
+    return {
+        "mutation_id": None if mutation_id is None else str(mutation_id),
+        "status": "rejected",
+        "message": message,
+    }
+
+
+def sync_score_mutations(game, user, mutations):
+    # A mutation that can never apply is rejected on its own, so the
+    # client can drop it without holding back the rest of the batch.
+    results = []
+    parsed = []
+    for data in mutations:
+        try:
+            parsed.append(parse_mutation(data))
+        except ValidationError as e:
+            results.append(get_rejected_result(data, e.message))
+    mutations = parsed
+    with transaction.atomic():
+        seen = set(
+            models.ScoreMutation.objects.filter(
+                mutation_id__in=[m["mutation_id"] for m in mutations]
+            ).values_list("mutation_id", flat=True)
+        )
+        hole_scores = (
+            models.HoleScore.objects.select_for_update()
+            .filter(pk__in=[m["hole_score_id"] for m in mutations], player__game=game)
+            .order_by()
+            .in_bulk()
+        )
+        priorities = get_scorer_priorities(user, list(hole_scores))
+        winners = {}
+        applied_mutations = models.ScoreMutation.objects.filter(
+            hole_score__in=hole_scores.keys(), applied=True
+        ).values_list("hole_score_id", "priority", "recorded_at")
+        for hole_score_id, mut_priority, recorded_at in applied_mutations:
+            key = (mut_priority, recorded_at)
+            winners[hole_score_id] = max(winners.get(hole_score_id, key), key)
+        new_mutations = []
+        changed = {}
+        for mutation in sorted(mutations, key=lambda m: m["recorded_at"]):
+            hole_score = hole_scores.get(mutation["hole_score_id"])
+            result = {
+                "mutation_id": str(mutation["mutation_id"]),
+                "hole_score_id": mutation["hole_score_id"],
+            }
+            results.append(result)
+            if mutation["mutation_id"] in seen:
+                result["status"] = "duplicate"
+                continue
+            if hole_score is None:
+                result["status"] = "rejected"
+                result["message"] = "Hole score not found for this game"
+                continue
+            seen.add(mutation["mutation_id"])
+            priority = priorities[hole_score.pk]
+            key = (priority, mutation["recorded_at"])
+            applied = hole_score.pk not in winners or key >= winners[hole_score.pk]
+            if applied:
+                winners[hole_score.pk] = key
+                hole_score.strokes = mutation["strokes"]
+                changed[hole_score.pk] = hole_score
+            result["status"] = "applied" if applied else "superseded"
+            new_mutations.append(models.ScoreMutation(
+                mutation_id=mutation["mutation_id"],
+                hole_score=hole_score,
+                strokes=mutation["strokes"],
+                recorded_at=mutation["recorded_at"],
+                recorded_by=user,
+                priority=priority,
+                applied=applied,
+            ))
+        models.ScoreMutation.objects.bulk_create(new_mutations)
+        if changed:
+            models.HoleScore.objects.bulk_update(changed.values(), ["strokes"])
+            changes.record(
+                models.HoleScore, changed.keys(), models.ChangeActionChoices.UPDATED
+            )
+            leaderboard.record_hole_scores(game.pk, list(changed.values()))
+    for result in results:
+        hole_score = hole_scores.get(result.get("hole_score_id"))
+        if hole_score is not None:
+            result["strokes"] = hole_score.strokes
+    return results
@@ -0,0 +1,154 @@
+"""Synthetic league data for benchmarks and load testing.
+
+``generate_league`` builds a course with a realistic par 72 layout and
+stroke index, a roster of players with spread out handicaps, and a run of
+completed and active games with random strokes around each player's
+handicap. Everything is seeded, so the same arguments give the same league.
+"""
+import datetime
+import random
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from dashboard import leaderboard
+from dashboard import models
+
+PARS = [4, 5, 3, 4, 4, 3, 4, 5, 4, 4, 3, 5, 4, 4, 3, 4, 5, 4]
+
+
+def get_stroke_index(rng, hole_count):
+    # Odd stroke indexes on the front nine and even on the back, as most
+    # card layouts do, shuffled within each nine.
+    if hole_count == 9:
+        stroke_index = list(range(1, 10))
+        rng.shuffle(stroke_index)
+        return stroke_index
+    front = list(range(1, 19, 2))
+    back = list(range(2, 19, 2))
+    rng.shuffle(front)
+    rng.shuffle(back)
+    return front + back
+
+
+def create_course(rng, name="Synthetic National", hole_count=18):
+    pars = PARS[:hole_count]
+    course = models.GolfCourse.objects.create(
+        name=name,
+        initials="SN",
+        city="Synthetic",
+        state="SY",
+        hole_count=hole_count,
+        course_rating=round(Decimal(sum(pars)) + Decimal(rng.uniform(-1.5, 2.5)), 1),
+        slope_rating=rng.randint(113, 140),
+    )
+    stroke_index = get_stroke_index(rng, hole_count)
+    models.Hole.objects.bulk_create([
+        models.Hole(
+            name=f"Hole{num}",
+            course=course,
+            order=num,
+            par=par,
+            handicap=stroke_index[num - 1],
+        )
+        for num, par in enumerate(pars, start=1)
+    ])
+    return course
+
+
+def create_players(rng, user, count):
+    return models.Player.objects.bulk_create([
+        models.Player(
+            first_name=f"Player{num}",
+            last_name=f"Synthetic{num}",
+            handicap=round(Decimal(rng.uniform(2, 30)), 1),
+            added_by=user,
+        )
+        for num in range(count)
+    ])
+
+
+def get_strokes(rng, par, handicap, hole_handicap, hole_count):
+    # Strokes over par follow the player's handicap, weighted towards the
+    # harder holes, with a bit of noise.
+    strokes_given = float(handicap) / hole_count
+    strokes_given += 0.5 if hole_handicap <= float(handicap) % hole_count else 0
+    strokes = par + round(rng.gauss(strokes_given, 1))
+    return min(max(strokes, 1), 9)
+
+
+def create_game(rng, course, players, date_played, use_teams=False):
+    game = models.Game.objects.create(
+        course=course,
+        date_played=date_played,
+        use_teams=use_teams,
+        use_skins=True,
+    )
+    # bulk_create does not fill in order_with_respect_to's _order.
+    models.PlayerMembership.objects.bulk_create([
+        models.PlayerMembership(
+            game=game, player=player, skins=rng.random() < 0.7, _order=order
+        )
+        for order, player in enumerate(players)
+    ])
+    game.start()
+    hole_scores = list(
+        models.HoleScore.objects.filter(player__game=game).select_related(
+            "player__player", "hole"
+        )
+    )
+    for hole_score in hole_scores:
+        hole_score.strokes = get_strokes(
+            rng,
+            hole_score.hole.par,
+            hole_score.player.player.handicap,
+            hole_score.hole.handicap,
+            int(course.hole_count),
+        )
+    models.HoleScore.objects.bulk_update(hole_scores, ["strokes"])
+    leaderboard.clear_leaderboard([game.id])
+    return game
+
+
+def generate_league(
+    players=12,
+    completed_games=4,
+    active_games=1,
+    field_size=None,
+    use_teams=True,
+    seed=0,
+):
+    rng = random.Random(seed)
+    user, _ = get_user_model().objects.get_or_create(
+        username="synthetic", defaults={"email": "synthetic@example.com"}
+    )
+    course = create_course(rng)
+    roster = create_players(rng, user, players)
+    field_size = min(field_size or players, players)
+    now = timezone.now()
+    completed = []
+    for week in range(completed_games, 0, -1):
+        game = create_game(
+            rng,
+            course,
+            rng.sample(roster, field_size),
+            now - datetime.timedelta(weeks=week),
+            use_teams=use_teams and field_size >= 4,
+        )
+        game.stop()
+        completed.append(game)
+    active = [
+        create_game(
+            rng,
+            course,
+            rng.sample(roster, field_size),
+            now,
+            use_teams=use_teams and field_size >= 4,
+        )
+        for _ in range(active_games)
+    ]
+    return {
+        "course": course,
+        "players": roster,
+        "completed": completed,
+        "active": active,
+    }
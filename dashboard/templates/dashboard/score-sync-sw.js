@@ -0,0 +1,15 @@
+{% load static %}importScripts("{% static 'js/score-queue.js' %}");
+
+// Background sync fires once the device is back online, even if the game
+// page has been closed in the meantime.
+self.addEventListener("sync", (event) => {
+  if (event.tag === "score-sync") {
+    event.waitUntil(ScoreQueue.flush());
+  }
+});
+
+self.addEventListener("install", () => self.skipWaiting());
+
+self.addEventListener("activate", (event) => {
+  event.waitUntil(self.clients.claim());
+});
@@ -33,6 +33,10 @@ def format_list(the_list):
         the_list = str(the_list).lstrip('[').rstrip(']').replace("'", "")
     return the_list
 
-@register.simple_tag
-def player_in_skins(player, game):
-    return utils.is_player_in_skins(player, game)
+@register.simple_tag(takes_context=True)
+def player_in_skins(context, player, game):
+    # Looked up once per game per render, not once per player in the loop.
+    cache = context.render_context.setdefault("skins_player_ids", {})
+    if game.id not in cache:
+        cache[game.id] = utils.get_skins_player_ids(game)
+    return player.id in cache[game.id]
@@ -1,9 +1,37 @@
+import datetime
 import pytest
 import json
+from decimal import Decimal
+import asyncio
+from types import SimpleNamespace
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db.models import Count
 from django.shortcuts import reverse
-from django.test import Client
+from django.test import AsyncRequestFactory, Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from dashboard import changes
+from dashboard import course_index
+from dashboard import handicaps
+from dashboard import instrumentation
 from dashboard import utils
+from dashboard import leaderboard
+from dashboard import live
 from dashboard import models
+from dashboard import profiling
+from dashboard import rounds
+from dashboard import scoring
+from dashboard import standings
+from dashboard import sync
+
+
+@pytest.fixture(autouse=True)
+def clear_course_index():
+    # Primary keys are reused between tests, so never carry an index over.
+    course_index.clear()
+    cache.clear()
 
 
 @pytest.mark.django_db
@@ -83,3 +111,673 @@ def test_start_game_sets_correct_status(normal_user, golf_game):
     assert golf_game.status == "setup"
     golf_game.start()
     assert golf_game.status == "active"
+
+
+def make_scored_game(num_players, use_teams=False):
+    user = models.User.objects.create_user(
+        username=f"scorer{num_players}",
+        email=f"scorer{num_players}@example.com",
+        password="scorerpw",
+    )
+    course = models.GolfCourse.objects.create(
+        name=f"Course {num_players}", initials="TC", city="City", state="ST"
+    )
+    utils.create_holes_for_course(course)
+    game = models.Game.objects.create(course=course, use_teams=use_teams)
+    for num in range(num_players):
+        player = models.Player.objects.create(
+            first_name=f"Player{num}", last_name=f"Game{num_players}", added_by=user
+        )
+        models.PlayerMembership.objects.create(game=game, player=player, skins=True)
+    game.start()
+    for hole_score in models.HoleScore.objects.filter(player__game=game):
+        hole_score.strokes = 3 + (hole_score.id % 3)
+        hole_score.save()
+    return game
+
+
+@pytest.mark.django_db
+def test_score_game_query_count_is_constant(django_assert_num_queries):
+    small_game = models.Game.objects.get(pk=make_scored_game(2).pk)
+    large_game = models.Game.objects.get(pk=make_scored_game(12).pk)
+    with django_assert_num_queries(16):
+        small_score = utils.score_game(small_game)
+    with django_assert_num_queries(16):
+        large_score = utils.score_game(large_game)
+    assert len(small_score["scores"]) == 2
+    assert len(large_score["scores"]) == 12
+    assert len(large_score["all_scores"]) == 18
+
+
+@pytest.mark.django_db
+def test_score_game_with_teams():
+    game = make_scored_game(8, use_teams=True)
+    game_score = utils.score_game(game)
+    assert len(game_score["team_scores"]) == 2
+    assert all(len(t["hole_list"]) == 18 for t in game_score["team_scores"])
+
+
+def test_score_matrix_totals_and_skins_low():
+    holes = [
+        SimpleNamespace(id=order, order=order, par=par, handicap=order)
+        for order, par in zip(range(8, 12), [3, 4, 5, 4])
+    ]
+    players = [SimpleNamespace(id=1), SimpleNamespace(id=2), SimpleNamespace(id=3)]
+    matrix = scoring.ScoreMatrix(players, holes)
+    for hole_score_id, (player_id, hole_id, strokes) in enumerate([
+        (1, 8, 3), (1, 9, 4), (1, 10, 4), (1, 11, 6),
+        (2, 8, 2), (2, 9, 4), (2, 10, 0),
+        (3, 8, 4), (3, 9, 5), (3, 10, 6), (3, 11, 5),
+    ], start=1):
+        matrix.set_score(player_id, hole_id, strokes, hole_score_id)
+    assert matrix.player_strokes(0) == 17
+    assert matrix.player_front_back(0) == (7, 10)
+    assert matrix.player_par(1) == 12
+    assert matrix.row_points(0) == [2, 2, 3, 0]
+    assert matrix.player_points(1) == 5
+    assert matrix.hole_low(0, [0, 1, 2]) == (2, [1])
+    assert matrix.hole_low(1, [0, 1]) == (4, [0, 1])
+    assert matrix.hole_low(3, [1]) == (None, [])
+
+
+@pytest.mark.django_db
+def test_leaderboard_applies_hole_score_deltas(django_assert_max_num_queries):
+    game = make_scored_game(4, use_teams=True)
+    board = leaderboard.get_leaderboard(game)
+    hole_scores = list(models.HoleScore.objects.filter(player__game=game)[:6])
+    for hole_score in hole_scores:
+        with django_assert_max_num_queries(7):
+            hole_score.score_hole(hole_score.strokes + 1)
+    hole_scores[0].reset_score()
+    game.refresh_from_db()
+    rebuilt = leaderboard.build_leaderboard(scoring.load_game_scores(game))
+    assert game.leaderboard == rebuilt
+    assert game.leaderboard != board
+    hole_data = utils.get_hole_data_for_game(game)
+    assert [p["player_score"] for p in hole_data] == [
+        p["strokes"] for p in game.leaderboard["players"]
+    ]
+
+
+@pytest.mark.django_db
+def test_leaderboard_cleared_when_players_change():
+    game = make_scored_game(2)
+    leaderboard.get_leaderboard(game)
+    models.PlayerMembership.objects.filter(game=game).first().delete()
+    game.refresh_from_db()
+    assert game.leaderboard is None
+    assert len(leaderboard.get_leaderboard(game)["players"]) == 1
+
+
+@pytest.mark.django_db
+def test_start_game_provisions_scores_in_bulk(django_assert_max_num_queries):
+    small_game = make_scored_game(2, use_teams=True)
+    large_game = make_scored_game(24, use_teams=True)
+    models.HoleScore.objects.filter(player__game=large_game, hole__order=1).delete()
+    with django_assert_max_num_queries(6):
+        utils.create_hole_scores_for_game(large_game)
+    assert models.HoleScore.objects.filter(player__game=large_game).count() == 24 * 18
+    assert models.HoleScore.objects.filter(player__game=small_game).count() == 2 * 18
+    memberships = models.PlayerMembership.objects.filter(game=large_game)
+    assert not memberships.filter(team=None).exists()
+    assert models.Team.objects.filter(game=large_game).count() == 6
+
+
+@pytest.mark.django_db
+def test_record_scores_for_game_applies_batch(django_assert_max_num_queries):
+    game = make_scored_game(4, use_teams=True)
+    leaderboard.get_leaderboard(game)
+    hole_scores = models.HoleScore.objects.filter(player__game=game, hole__order=1)
+    scores = {hs.id: 7 for hs in hole_scores}
+    with django_assert_max_num_queries(12):
+        board_slice = utils.record_scores_for_game(game, scores)
+    assert set(
+        models.HoleScore.objects.filter(pk__in=scores).values_list("strokes", flat=True)
+    ) == {7}
+    assert len(board_slice["players"]) == 4
+    assert [skin["low"] for skin in board_slice["skins"]] == [7]
+    game.refresh_from_db()
+    assert game.leaderboard == leaderboard.build_leaderboard(
+        scoring.load_game_scores(game)
+    )
+
+
+@pytest.mark.django_db
+def test_record_scores_for_game_rejects_other_games():
+    game = make_scored_game(2)
+    other_game = make_scored_game(3)
+    other_score = models.HoleScore.objects.filter(player__game=other_game).first()
+    with pytest.raises(ValidationError):
+        utils.record_scores_for_game(game, {other_score.id: 9})
+    with pytest.raises(ValidationError):
+        utils.record_scores_for_game(game, {other_score.id: 40})
+    other_score.refresh_from_db()
+    assert other_score.strokes != 9
+
+
+@pytest.mark.django_db
+def test_sync_score_mutations_is_idempotent_and_last_write_wins():
+    game = make_scored_game(2)
+    leaderboard.get_leaderboard(game)
+    user = models.User.objects.get(username="scorer2")
+    hole_score = models.HoleScore.objects.filter(player__game=game).first()
+    late = {
+        "mutation_id": "8a6e0f3e-2f5c-4c55-9d0b-1f1d3f3b1a01",
+        "hole_score_id": hole_score.id,
+        "strokes": 6,
+        "recorded_at": "2024-05-01T10:05:00Z",
+    }
+    early = {
+        "mutation_id": "8a6e0f3e-2f5c-4c55-9d0b-1f1d3f3b1a02",
+        "hole_score_id": hole_score.id,
+        "strokes": 8,
+        "recorded_at": "2024-05-01T10:00:00Z",
+    }
+    results = sync.sync_score_mutations(game, user, [late])
+    assert results[0]["status"] == "applied"
+    results = sync.sync_score_mutations(game, user, [late, early])
+    assert [r["status"] for r in results] == ["superseded", "duplicate"]
+    assert results[0]["strokes"] == 6
+    hole_score.refresh_from_db()
+    assert hole_score.strokes == 6
+    assert models.ScoreMutation.objects.count() == 2
+    game.refresh_from_db()
+    assert game.leaderboard == leaderboard.build_leaderboard(
+        scoring.load_game_scores(game)
+    )
+
+
+@pytest.mark.django_db
+def test_sync_score_mutations_card_owner_outranks_other_players():
+    game = make_scored_game(2)
+    owner, other = [
+        models.User.objects.create_user(
+            username=name, email=f"{name}@example.com", password="scorerpw"
+        )
+        for name in ["owner", "other"]
+    ]
+    for num, user in enumerate([owner, other]):
+        models.Player.objects.filter(
+            first_name=f"Player{num}", last_name="Game2"
+        ).update(user_account=user)
+    hole_score = models.HoleScore.objects.filter(
+        player__player__user_account=owner
+    ).first()
+    sync.sync_score_mutations(game, owner, [{
+        "mutation_id": "8a6e0f3e-2f5c-4c55-9d0b-1f1d3f3b1a06",
+        "hole_score_id": hole_score.id,
+        "strokes": 5,
+        "recorded_at": "2024-05-01T10:00:00Z",
+    }])
+    results = sync.sync_score_mutations(game, other, [{
+        "mutation_id": "8a6e0f3e-2f5c-4c55-9d0b-1f1d3f3b1a07",
+        "hole_score_id": hole_score.id,
+        "strokes": 7,
+        "recorded_at": "2024-05-01T10:10:00Z",
+    }])
+    assert results[0]["status"] == "superseded"
+    hole_score.refresh_from_db()
+    assert hole_score.strokes == 5
+
+
+@pytest.mark.django_db
+def test_sync_rejects_bad_mutations_without_failing_the_batch(client):
+    game = make_scored_game(2)
+    user = models.User.objects.get(username="scorer2")
+    hole_score = models.HoleScore.objects.filter(player__game=game).first()
+    good = {
+        "mutation_id": "8a6e0f3e-2f5c-4c55-9d0b-1f1d3f3b1a08",
+        "hole_score_id": hole_score.id,
+        "strokes": 6,
+        "recorded_at": "2024-05-01T10:00:00Z",
+    }
+    bad = {**good, "mutation_id": "8a6e0f3e-2f5c-4c55-9d0b-1f1d3f3b1a09", "strokes": 40}
+    orphan = {**good, "mutation_id": "8a6e0f3e-2f5c-4c55-9d0b-1f1d3f3b1a10", "hole_score_id": 0}
+    results = sync.sync_score_mutations(game, user, [bad, good, orphan])
+    statuses = {r["mutation_id"]: r["status"] for r in results}
+    assert statuses == {
+        bad["mutation_id"]: "rejected",
+        good["mutation_id"]: "applied",
+        orphan["mutation_id"]: "rejected",
+    }
+    hole_score.refresh_from_db()
+    assert hole_score.strokes == 6
+    client.force_login(user)
+    res = client.post(
+        reverse("dashboard:ajax_sync_scores"),
+        json.dumps({"game_id": 0, "mutations": [good]}),
+        content_type="application/json",
+    )
+    assert res.status_code == 200
+    assert [r["status"] for r in res.json()["results"]] == ["rejected"]
+
+
+@pytest.mark.django_db
+def test_online_score_wins_over_older_offline_mutation():
+    game = make_scored_game(2)
+    user = models.User.objects.get(username="scorer2")
+    hole_score = models.HoleScore.objects.filter(player__game=game).first()
+    utils.record_scores_for_game(game, {hole_score.id: 5}, user)
+    results = sync.sync_score_mutations(game, user, [{
+        "mutation_id": "8a6e0f3e-2f5c-4c55-9d0b-1f1d3f3b1a05",
+        "hole_score_id": hole_score.id,
+        "strokes": 7,
+        "recorded_at": (timezone.now() - datetime.timedelta(minutes=5)).isoformat(),
+    }])
+    assert results[0]["status"] == "superseded"
+    assert results[0]["strokes"] == 5
+    hole_score.refresh_from_db()
+    assert hole_score.strokes == 5
+
+
+@pytest.mark.django_db
+def test_sync_score_mutations_admin_priority_wins():
+    game = make_scored_game(2)
+    user = models.User.objects.get(username="scorer2")
+    admin = models.User.objects.create_superuser(
+        username="admin", email="admin@example.com", password="adminpw"
+    )
+    hole_score = models.HoleScore.objects.filter(player__game=game).first()
+    sync.sync_score_mutations(game, admin, [{
+        "mutation_id": "8a6e0f3e-2f5c-4c55-9d0b-1f1d3f3b1a03",
+        "hole_score_id": hole_score.id,
+        "strokes": 5,
+        "recorded_at": "2024-05-01T10:00:00Z",
+    }])
+    results = sync.sync_score_mutations(game, user, [{
+        "mutation_id": "8a6e0f3e-2f5c-4c55-9d0b-1f1d3f3b1a04",
+        "hole_score_id": hole_score.id,
+        "strokes": 7,
+        "recorded_at": "2024-05-01T10:10:00Z",
+    }])
+    assert results[0]["status"] == "superseded"
+    hole_score.refresh_from_db()
+    assert hole_score.strokes == 5
+
+
+def test_local_broker_delivers_to_subscribers():
+    broker = live.LocalBroker()
+
+    async def listen():
+        queue = broker.subscribe("game-1")
+        other = broker.subscribe("game-2")
+        broker.publish("game-1", {"type": "diff"})
+        message = await asyncio.wait_for(queue.get(), timeout=1)
+        broker.unsubscribe("game-1", queue)
+        broker.unsubscribe("game-2", other)
+        return message, other.empty()
+
+    assert asyncio.run(listen()) == ({"type": "diff"}, True)
+    assert broker.subscribers == {}
+
+
+@pytest.mark.django_db
+@override_settings(STATIC_URL="/static/")
+def test_leaderboard_is_polled_without_an_asgi_server(client):
+    game = make_scored_game(2)
+    client.force_login(models.User.objects.get(username="scorer2"))
+    res = client.get(reverse("dashboard:game_detail", args=[game.id]))
+    assert b"new EventSource" not in res.content
+    assert b"every 30s" in res.content
+    res = client.get(reverse("dashboard:game_leaderboard_stream", args=[game.id]))
+    assert res.status_code == 404
+    assert live.can_stream(AsyncRequestFactory().get("/"))
+
+
+@pytest.mark.django_db
+def test_hole_score_change_publishes_diff(monkeypatch, django_capture_on_commit_callbacks):
+    game = make_scored_game(2)
+    leaderboard.get_leaderboard(game)
+    published = []
+    monkeypatch.setattr(live, "publish_game", lambda *args: published.append(args))
+    hole_score = models.HoleScore.objects.filter(player__game=game).first()
+    with django_capture_on_commit_callbacks(execute=True):
+        hole_score.score_hole(9)
+    game_id, message = published[-1]
+    assert game_id == game.id
+    assert message["type"] == "diff"
+    assert message["players"][0]["membership_id"] == hole_score.player_id
+    assert message["players"][0]["holes"] == [[0, 9]]
+
+
+@pytest.mark.django_db
+def test_game_fragments_render_from_leaderboard(client, django_assert_max_num_queries):
+    game = make_scored_game(4, use_teams=True)
+    client.force_login(models.User.objects.get(username="scorer4"))
+    leaderboard.get_leaderboard(game)
+    for name in ["game_score_grid", "game_leaderboard", "game_team_list", "game_skins"]:
+        with django_assert_max_num_queries(6):
+            res = client.get(reverse(f"dashboard:{name}", args=[game.id]), HTTP_HX_REQUEST="true")
+        assert res.status_code == 200
+        assert b"<table" in res.content
+
+
+@pytest.mark.django_db
+def test_membership_queryset_annotates_roster(django_assert_num_queries):
+    game = make_scored_game(6)
+    hole = models.Hole.objects.get(course=game.course, order=1)
+    hole.par = 5
+    hole.save()
+    for num, hcp in enumerate(["0.0", "10.4", "10.5", "-1.5", "-1.3", "35.9"]):
+        models.Player.objects.filter(first_name=f"Player{num}", last_name="Game6").update(
+            handicap=hcp
+        )
+    models.PlayerMembership.objects.filter(game=game, player__first_name="Player0").update(
+        skins=False
+    )
+    game = models.Game.objects.get(pk=game.pk)
+    with django_assert_num_queries(1):
+        current_players = utils.get_current_players_for_game(game)
+    expected = {
+        m.player_id: m.game.points - utils.round_up(m.player.handicap)
+        for m in models.PlayerMembership.objects.filter(game=game)
+    }
+    assert {p["id"]: p["points_needed"] for p in current_players} == expected
+    with django_assert_num_queries(1):
+        assert utils.num_players_in_skins(game) == 5
+
+
+@pytest.mark.django_db
+def test_course_index_serves_par_without_queries(django_assert_num_queries):
+    game = make_scored_game(2)
+    course = models.GolfCourse.objects.get(pk=game.course_id)
+    game = models.Game.objects.get(pk=game.pk)
+    assert course.par == 72
+    with django_assert_num_queries(0):
+        assert (course.par, course.points, game.par, game.points) == (72, 36, 72, 36)
+    hole = models.Hole.objects.get(course=course, order=10)
+    hole.par = 5
+    hole.save()
+    game.which_holes = "back"
+    assert (course.par, course.points, game.par) == (73, 37, 37)
+    course_index.clear()
+    with django_assert_num_queries(0):
+        assert course.par == 73
+
+
+@pytest.mark.django_db
+def test_league_standings_are_ranked_and_follow_handicap_edits(django_assert_num_queries):
+    game = make_scored_game(3)
+    season = standings.get_season(game)
+    for num, hcp in enumerate(["12.0", "4.5", "20.0"]):
+        player = models.Player.objects.get(first_name=f"Player{num}", last_name="Game3")
+        player.handicap = hcp
+        player.save()
+    with django_assert_num_queries(1):
+        ranked = [(s.rank, s.player.first_name, s.points) for s in standings.get_standings()]
+    assert ranked == [(1, "Player1", 31), (2, "Player0", 24), (3, "Player2", 16)]
+    game.stop()
+    stopped = models.LeagueStanding.objects.filter(season=season)
+    assert set(stopped.values_list("games_played", flat=True)) == {1}
+    assert [r for r, _ in utils.get_ranked_players()] == [1, 2, 3]
+
+
+@pytest.mark.django_db
+def test_new_player_is_ranked_without_a_handicap_edit():
+    game = make_scored_game(3)
+    models.LeagueStanding.objects.all().delete()
+    assert [r for r, _ in utils.get_ranked_players()] == [1, 2, 3]
+    player = models.Player.objects.create(
+        first_name="New", last_name="Player", handicap=0, added_by=game.players.first().added_by
+    )
+    assert not models.HandicapHistory.objects.filter(player=player).exists()
+    ranked = [(s["rank"], s["id"]) for s in utils.get_league_standings()]
+    assert ranked[0] == (1, player.id)
+    assert [r for r, _ in ranked] == [1, 2, 3, 4]
+    standings.recompute_standings()
+    assert [(s["rank"], s["id"]) for s in utils.get_league_standings()] == ranked
+
+
+@pytest.mark.django_db
+def test_stop_records_round_history(django_assert_num_queries):
+    game = make_scored_game(2)
+    game.stop()
+    player = models.Player.objects.get(first_name="Player0", last_name="Game2")
+    player_round = models.PlayerRound.objects.get(player=player, game=game)
+    score = next(s for s in game.score["scores"] if s["player_id"] == player.id)
+    assert player_round.gross == score["player_score"]
+    assert player_round.differential == player_round.gross - player_round.par
+    with django_assert_num_queries(1):
+        assert utils.get_player_scores_for_course(player, game.course) == [player_round.gross]
+    assert rounds.get_course_average(player, game.course) == player_round.gross
+    game.reset()
+    assert not models.PlayerRound.objects.filter(game=game).exists()
+
+
+@pytest.mark.django_db
+def test_failed_stop_leaves_the_game_active(monkeypatch):
+    game = make_scored_game(2)
+
+    def fail(season):
+        raise RuntimeError("standings failed")
+
+    monkeypatch.setattr(standings, "recompute_standings", fail)
+    with pytest.raises(RuntimeError):
+        game.stop()
+    game.refresh_from_db()
+    assert game.status == models.GameStatusChoices.ACTIVE
+    assert not models.PlayerRound.objects.filter(game=game).exists()
+    monkeypatch.undo()
+    game.stop()
+    assert models.PlayerRound.objects.filter(game=game).count() == 2
+
+
+@pytest.mark.django_db
+def test_reset_reverts_handicap_history(django_assert_max_num_queries):
+    game = make_scored_game(3)
+    players = list(models.Player.objects.filter(last_name="Game3"))
+    start = {p.id: p.handicap for p in players}
+    game.stop()
+    history = models.HandicapHistory.objects.filter(game=game)
+    assert history.count() == 3
+    for entry in history:
+        assert entry.previous_handicap == start[entry.player_id]
+        assert models.Player.objects.get(pk=entry.player_id).handicap == entry.handicap
+        assert handicaps.get_handicap_as_of(entry.player, game.date_played) == entry.handicap
+    utils.score_game(game)
+    assert history.count() == 3
+    with django_assert_max_num_queries(7):
+        handicaps.revert_game_handicaps(game)
+    for player in players:
+        player.refresh_from_db()
+        assert player.handicap == start[player.id]
+    assert not models.HandicapHistory.objects.filter(game=game).exists()
+
+
+@pytest.mark.django_db
+def test_back_dated_game_does_not_move_handicap_on_score_or_reset():
+    game = make_scored_game(3)
+    game.stop()
+    players = list(models.Player.objects.filter(last_name="Game3"))
+    current = {p.id: p.handicap for p in players}
+    back_dated = models.Game.objects.create(
+        course=game.course, date_played=game.date_played - datetime.timedelta(days=7)
+    )
+    for player in players:
+        models.PlayerMembership.objects.create(game=back_dated, player=player)
+    back_dated.start()
+    for hole_score in models.HoleScore.objects.filter(player__game=back_dated):
+        hole_score.strokes = 9
+        hole_score.save()
+    back_dated.stop()
+    assert not models.HandicapHistory.objects.filter(game=back_dated, applied=True).exists()
+    for player in players:
+        player.refresh_from_db()
+        assert player.handicap == current[player.id]
+    back_dated.reset()
+    for player in players:
+        player.refresh_from_db()
+        assert player.handicap == current[player.id]
+
+
+def test_handicap_index_uses_best_eight_of_last_twenty():
+    assert handicaps.get_handicap_index([4, 6]) is None
+    assert handicaps.get_handicap_index([5, 7, 9]) == Decimal("3.0")
+    window = models.HandicapWindow()
+    for day in range(1, 23):
+        game = SimpleNamespace(
+            id=day, date_played=datetime.datetime(2024, 5, day, tzinfo=datetime.timezone.utc)
+        )
+        handicaps.push_differential(window, game, day)
+    assert len(window.differentials) == 20
+    assert window.handicap_index == Decimal("6.5")
+
+
+@pytest.mark.django_db
+def test_recompute_all_handicaps_applies_course_rating():
+    game = make_scored_game(2)
+    game.stop()
+    player_round = models.PlayerRound.objects.filter(game=game).first()
+    window = models.HandicapWindow.objects.get(player=player_round.player)
+    assert window.differentials[0][2] == float(player_round.differential)
+    models.GolfCourse.objects.filter(pk=game.course_id).update(
+        course_rating=player_round.par - 2, slope_rating=126
+    )
+    handicaps.recompute_all_handicaps()
+    player_round.refresh_from_db()
+    window.refresh_from_db()
+    expected = round(Decimal(113) / 126 * (player_round.gross - player_round.par + 2), 1)
+    assert player_round.differential == expected
+    assert window.differentials[0][2] == float(expected)
+
+
+@pytest.mark.django_db
+def test_rescore_games_dry_run_then_write(capsys):
+    game = make_scored_game(2)
+    game.stop()
+    stored = models.Game.objects.get(pk=game.pk).score
+    models.Player.objects.filter(last_name="Game2").update(handicap=5)
+    hole = models.Hole.objects.get(course=game.course, order=1)
+    hole.par = hole.par + 1
+    hole.save()
+    call_command("rescore_games", workers=1, dry_run=True)
+    assert "(rescored)" in capsys.readouterr().out
+    assert models.Game.objects.get(pk=game.pk).score == stored
+    call_command("rescore_games", workers=1)
+    rescored = models.Game.objects.get(pk=game.pk).score
+    assert [s["hcp"] for s in rescored["scores"]] == [s["hcp"] for s in stored["scores"]]
+    assert [s["par"] for s in rescored["scores"]] == [s["par"] + 1 for s in stored["scores"]]
+    assert set(
+        models.PlayerRound.objects.filter(game=game).values_list("par", flat=True)
+    ) == {stored["scores"][0]["par"] + 1}
+
+
+def test_profiling_histogram_percentiles_are_bounded():
+    histogram = profiling.Histogram()
+    for value in range(1, 100_001):
+        histogram.record(value)
+    assert len(histogram.buckets) < 250
+    for percent in [50, 90, 99]:
+        expected = 100_000 * percent / 100
+        assert abs(histogram.percentile(percent) - expected) / expected < 0.07
+    assert histogram.percentile(100) == 100_000
+
+
+def test_profiling_sums_top_level_template_renders(monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr(profiling.time, "perf_counter", lambda: next(clock))
+    render = profiling._timed_render(lambda template, nested=None: nested and nested(None))
+    timings = []
+    token = profiling._template_time.set(timings)
+    try:
+        # A page from 0 to 2 with a widget rendered inside it at 1, then a
+        # second page from 3 to 4.
+        render(None, lambda template: render(template))
+        render(None)
+    finally:
+        profiling._template_time.reset(token)
+    assert timings == [2, 1]
+
+
+@pytest.mark.django_db
+@override_settings(
+    PROFILING_ENABLED=True,
+    PROFILING_SAMPLE_RATE=1,
+    PROFILING_METRICS_TOKEN="scrape",
+    STATIC_URL="/static/",
+)
+def test_profiling_middleware_records_per_view(client):
+    profiling.reset()
+    game = make_scored_game(2)
+    client.force_login(models.User.objects.get(username="scorer2"))
+    for _ in range(3):
+        assert client.get(reverse("dashboard:game_score_grid", args=[game.id])).status_code == 200
+    stats = profiling.get_stats()["dashboard:game_score_grid"]
+    assert stats["wall_ms"]["count"] == 3
+    assert stats["sql_count"]["p50"] > 0
+    assert stats["template_ms"]["p50"] > 0
+    assert stats["response_bytes"]["p50"] > 0
+    client.logout()
+    url = reverse("dashboard:profiling_metrics")
+    assert client.get(url).status_code == 403
+    res = client.get(url, HTTP_AUTHORIZATION="Bearer scrape")
+    assert 'rsgolf_request_wall_ms_count{view="dashboard:game_score_grid"} 3' in res.content.decode()
+
+
+@pytest.mark.django_db
+def test_instrumentation_records_scoring_phases(tmp_path):
+    game = make_scored_game(4, use_teams=True)
+    path = tmp_path / "instrumentation.sqlite3"
+    with override_settings(INSTRUMENTATION_PATH=path, INSTRUMENTATION_POLL_SECONDS=0):
+        utils.score_game(game)
+        assert not path.exists()
+        call_command("instrument_scoring", "on")
+        utils.score_game(game)
+        utils.score_game(game)
+        call_command("instrument_scoring", "off")
+        utils.score_game(game)
+        report = {r["phase"]: r for r in instrumentation.get_report()}
+    assert "utils.score_game" not in report
+    outer = report["scoring.score_game"]
+    assert (outer["calls"], outer["game_size"]) == (2, 4)
+    assert outer["queries"] > 0
+    load = report["scoring.score_game > scoring.load_game_scores"]
+    assert 0 < load["queries"] <= outer["queries"]
+    assert "scoring.score_game > scoring.score_teams > scoring.get_team_score" in report
+
+
+@pytest.mark.django_db
+@override_settings(STATIC_URL="/static/")
+def test_game_etag_short_circuits_until_a_score_changes(client, django_assert_num_queries):
+    game = make_scored_game(2)
+    client.force_login(models.User.objects.get(username="scorer2"))
+    url = reverse("dashboard:game_score_grid", args=[game.id])
+    res = client.get(url)
+    assert res.status_code == 200
+    etag = res["ETag"]
+    assert res["Last-Modified"]
+    with django_assert_num_queries(3):
+        # Session, user and the version stamp.
+        res = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert res.status_code == 304
+    hole_score = models.HoleScore.objects.filter(player__game=game).first()
+    hole_score.strokes += 1
+    hole_score.save()
+    res = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert res.status_code == 200
+    assert res["ETag"] != etag
+    models.Hole.objects.filter(course=game.course).first().save()
+    course_url = reverse("dashboard:course_detail", args=[game.course_id])
+    assert client.get(url, HTTP_IF_NONE_MATCH=res["ETag"]).status_code == 200
+    res = client.get(course_url)
+    assert client.get(course_url, HTTP_IF_NONE_MATCH=res["ETag"]).status_code == 304
+
+
+@pytest.mark.django_db
+@override_settings(CHANGES_SETTLE_SECONDS=0)
+def test_compacted_change_log_keeps_latest_entry_per_object():
+    game = make_scored_game(2)
+    cursor = changes.get_cursor()
+    hole_score = models.HoleScore.objects.filter(player__game=game).first()
+    hole_score.save()
+    models.PlayerMembership.objects.filter(game=game).first().delete()
+    before, _, _ = changes.get_changes(cursor, 100)
+    call_command("compact_changes")
+    after, after_cursor, _ = changes.get_changes(cursor, 100)
+    assert [(e.resource, e.object_id, e.action) for e in after] == [
+        (e.resource, e.object_id, e.action) for e in before
+    ]
+    assert after_cursor == changes.get_cursor()
+    assert not models.Change.objects.values("resource", "object_id").annotate(
+        entries=Count("id")
+    ).filter(entries__gt=1).exists()
@@ -12,6 +12,7 @@ urlpatterns =  [
         name="download-scorecard",
     ),
     path("location-test/", views.location_test, name="location-test"),
+    path("score-sync-sw.js", views.score_sync_worker, name="score_sync_worker"),
     path("no-permission/", views.no_permission, name="no_permission"),
     path("courses/", views.course_list, name="courses"),
     path("courses/add/", views.create_course, name="create_course"),
@@ -25,6 +26,11 @@ urlpatterns =  [
     path("games/", views.game_list, name="games"),
     path("games/<int:pk>/", views.game_detail, name="game_detail"),
     path("games/<int:pk>/edit", views.edit_game, name="edit_game"),
+    path("games/<int:pk>/live", views.game_leaderboard_stream, name="game_leaderboard_stream"),
+    path("games/<int:pk>/score-grid", views.game_score_grid, name="game_score_grid"),
+    path("games/<int:pk>/leaderboard", views.game_leaderboard, name="game_leaderboard"),
+    path("games/<int:pk>/teams", views.game_team_list, name="game_team_list"),
+    path("games/<int:pk>/skins", views.game_skins, name="game_skins"),
     path("games/<int:pk>/score", views.game_score, name="game_score"),
     path("games/<int:pk>/score_details", views.game_score_detail, name="game_score_detail"),
     path("games/add/", views.create_game, name="create_game"),
@@ -38,6 +44,8 @@ urlpatterns =  [
     path("tee-times/", views.tee_time_list, name="tee_times"),
     path("tee-times/add/", views.create_tee_time, name="create_tee_time"),
     path("tee-times/<int:pk>/", views.tee_time_detail, name="tee_time_detail"),
+    path("profiling/", views.profiling_stats, name="profiling"),
+    path("profiling/metrics", views.profiling_metrics, name="profiling_metrics"),
     # ajax
     path("ajax/manage-game/", views.ajax_manage_game, name="ajax_manage_game"),
     path("ajax/delete-tee/", views.ajax_delete_tee, name="ajax_delete_tee"),
@@ -51,6 +59,12 @@ urlpatterns =  [
         views.ajax_record_score_for_hole,
         name="ajax_record_score_for_hole",
     ),
+    path(
+        "ajax/record-scores-for-game/",
+        views.ajax_record_scores_for_game,
+        name="ajax_record_scores_for_game",
+    ),
+    path("ajax/sync-scores/", views.ajax_sync_scores, name="ajax_sync_scores"),
     path(
         "ajax/edit-hole-score/",
         views.ajax_edit_hole_score,
@@ -1,5 +1,16 @@
 import json, math, random
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from dashboard import changes
+from dashboard import course_index
+from dashboard import handicaps
+from dashboard import instrumentation
+from dashboard import leaderboard
 from dashboard import models
+from dashboard import rounds
+from dashboard import scoring
+from dashboard import standings
+from dashboard import sync
 from djmoney.money import Money
 
 
@@ -26,12 +37,20 @@ def is_admin(user):
 
 
 def is_player_in_skins(player, game):
-    player_mem = models.PlayerMembership.objects.filter(game=game, player=player).first()
-    return player_mem.skins
+    return models.PlayerMembership.objects.filter(
+        game=game, player=player, skins=True
+    ).exists()
+
+
+def get_skins_player_ids(game):
+    return set(
+        models.PlayerMembership.objects.filter(game=game, skins=True)
+        .values_list("player_id", flat=True)
+    )
 
 
 def num_players_in_skins(game):
-    return len([p for p in game.players.all() if is_player_in_skins(p, game)])
+    return models.PlayerMembership.objects.filter(game=game, skins=True).count()
 
 
 def get_first_course_id():
@@ -69,14 +88,19 @@ def get_players_not_in_game(game):
 
 def get_current_players_for_game(game):
     current_players = []
-    for player in game.players.all():
-        player_mem = models.PlayerMembership.objects.filter(game=game, player=player).first()
+    memberships = (
+        models.PlayerMembership.objects.filter(game=game)
+        .with_player_data()
+        .order_by("player__last_name", "player__first_name")
+    )
+    for player_mem in memberships:
         current_players.append({
-            "id": player.id,
-            "name": player.name,
-            "hcp": player.handicap,
+            "id": player_mem.player_id,
+            "name": player_mem.player.name,
+            "hcp": player_mem.player_handicap,
             "points_needed": player_mem.points_needed,
             "skins": player_mem.skins,
+            "team": player_mem.team_name,
         })
     return current_players
 
@@ -98,7 +122,7 @@ def get_teams_for_game(game):
 
 def get_team_list_for_game(game):
     team_list = []
-    for team in get_teams_for_game(game):
+    for team in get_teams_for_game(game).prefetch_related("players"):
         team_data = {
             "id": team.id,
             "name": team.name,
@@ -112,8 +136,7 @@ def get_team_list_for_game(game):
 
 
 def get_par_for_course(course):
-    holes = models.Hole.objects.filter(course=course).order_by("order")
-    return sum([h.par for h in holes])
+    return course_index.get_index(course.id)["par"]
 
 
 def get_holes_for_game(game):
@@ -126,17 +149,12 @@ def get_holes_for_game(game):
 
 
 def get_par_for_game(game):
-    holes = get_holes_for_game(game)
-    return sum([h.par for h in holes])
+    return course_index.get_par_for_game(game)
 
 
 def clean_game(game):
     if game.league_game:
-        for player in game.players.all():
-            for score in game.score.get("scores"):
-                if score.get("player_id") == player.id:
-                    player.handicap = score.get("hcp")
-                    player.save()
+        handicaps.revert_game_handicaps(game)
     if game.use_teams:
         for team in get_teams_for_game(game):
             team.delete()
@@ -157,18 +175,68 @@ def create_holes_for_course(course):
 
 
 def create_hole_scores_for_game(game):
-    for hole in get_holes_for_game(game):
-        for player in game.players.all():
-            player_mem = models.PlayerMembership.objects.filter(
-                player=player, game=game
-            ).first()
-            existing_hole_score = models.HoleScore.objects.filter(
-                player=player_mem, hole=hole
+    hole_ids = list(get_holes_for_game(game).values_list("id", flat=True))
+    mem_ids = list(
+        models.PlayerMembership.objects.filter(game=game).values_list("id", flat=True)
+    )
+    existing = set(
+        models.HoleScore.objects.filter(
+            player__game=game, hole__in=hole_ids
+        ).values_list("player_id", "hole_id")
+    )
+    new_scores = [
+        models.HoleScore(player_id=mem_id, hole_id=hole_id)
+        for hole_id in hole_ids
+        for mem_id in mem_ids
+        if (mem_id, hole_id) not in existing
+    ]
+    models.HoleScore.objects.bulk_create(new_scores, ignore_conflicts=True)
+    # ignore_conflicts leaves the new rows without their ids.
+    created = [
+        pk for pk, mem_id, hole_id in models.HoleScore.objects.filter(
+            player__game=game, hole__in=hole_ids
+        ).values_list("id", "player_id", "hole_id")
+        if (mem_id, hole_id) not in existing
+    ]
+    changes.record(models.HoleScore, created, models.ChangeActionChoices.CREATED)
+
+
+def record_scores_for_game(game, scores, user=None):
+    '''
+    Apply scores ({hole_score_id: strokes}) entered by ``user`` for one
+    game with a single fetch and a single bulk_update, then return the
+    leaderboard slice for the players and holes that changed.
+    '''
+    valid_strokes = set(models.StrokeChoices.values)
+    try:
+        scores = {int(pk): int(strokes) for pk, strokes in scores.items()}
+    except (TypeError, ValueError):
+        raise ValidationError("Scores must be whole numbers")
+    bad_strokes = [pk for pk, strokes in scores.items() if strokes not in valid_strokes]
+    if bad_strokes:
+        raise ValidationError(f"Invalid strokes for hole scores: {bad_strokes}")
+    with transaction.atomic():
+        hole_scores = list(
+            models.HoleScore.objects.select_for_update()
+            .filter(pk__in=scores.keys(), player__game=game)
+            .order_by()
+        )
+        missing = set(scores) - {hs.pk for hs in hole_scores}
+        if missing:
+            raise ValidationError(
+                f"Hole scores not found for this game: {sorted(missing)}"
             )
-            if existing_hole_score:
-                continue
-            hole_score = models.HoleScore(player=player_mem, hole=hole)
-            hole_score.save()
+        for hole_score in hole_scores:
+            hole_score.strokes = scores[hole_score.pk]
+        models.HoleScore.objects.bulk_update(hole_scores, ["strokes"])
+        sync.record_online_scores(user, hole_scores)
+        changes.record(
+            models.HoleScore, scores.keys(), models.ChangeActionChoices.UPDATED
+        )
+        leaderboard.record_hole_scores(game.pk, hole_scores)
+    game.refresh_from_db(fields=["leaderboard"])
+    board = leaderboard.get_leaderboard(game)
+    return leaderboard.get_slice(board, hole_scores)
 
 
 def calculate_teams(player_count):
@@ -188,6 +256,7 @@ def calculate_teams(player_count):
     return num_teams, num_players, 1
 
 
+@instrumentation.timed()
 def create_teams_for_game(game):
     '''
     Not doing below. All random at the moment.
@@ -207,90 +276,45 @@ def create_teams_for_game(game):
     num_teams = None
     num_players = None
     remainder = None
-    new_teams = []
-    players = game.players.all()
-    calculated_teams = calculate_teams(players.count())
+    memberships = list(
+        models.PlayerMembership.objects.filter(game=game).select_related("player")
+    )
+    random.shuffle(memberships)
+    instrumentation.set_game_size(len(memberships))
+    calculated_teams = calculate_teams(len(memberships))
     if len(calculated_teams) == 3:
         num_teams, num_players, remainder = calculated_teams
     else:
         num_teams, num_players = calculated_teams
-    for team_num in range(1, num_teams + 1):
-        new_team = models.Team(name=f"Team{team_num}", game=game)
-        new_team.save()
-        new_teams.append(new_team)
-        for _ in range(1, num_players + 1):
-            if players.count() > 0:
-                _player = random.choice(players)
-                player_mem = models.PlayerMembership.objects.filter(
-                    game=game, player=_player
-                ).first()
-                player_mem.team = new_team
-                player_mem.save()
-                players = players.exclude(id=_player.id)
-    if remainder and players.count() == 1:
-        rem_player = players[0]
-        rem_mem = models.PlayerMembership.objects.filter(
-            game=game, player=rem_player
-        ).first()
-        random_team = random.choice(new_teams)
-        rem_mem.team = random_team
-        rem_mem.save()
+    new_teams = models.Team.objects.bulk_create([
+        models.Team(name=f"Team{team_num}", game=game)
+        for team_num in range(1, num_teams + 1)
+    ])
+    for index, team in enumerate(new_teams):
+        team_mems = memberships[index * num_players:(index + 1) * num_players]
+        for player_mem in team_mems:
+            player_mem.team = team
+    if remainder and len(memberships) == num_teams * num_players + 1:
+        memberships[-1].team = random.choice(new_teams)
+    models.PlayerMembership.objects.bulk_update(memberships, ["team"])
+    changes.record(
+        models.PlayerMembership,
+        [m.id for m in memberships],
+        models.ChangeActionChoices.UPDATED,
+    )
     for team in new_teams:
-        team.handicap = get_team_hcp(team, game)
-        team.save()
+        team_hcps = [m.player.handicap for m in memberships if m.team == team]
+        team.handicap = get_avg_hcp(team_hcps)
+    models.Team.objects.bulk_update(new_teams, ["handicap"])
 
 
+@instrumentation.timed()
 def get_team_score(team):
-    team_score = {
-        "team_id": team.id,
-        "team_name": team.name,
-        "handicap": str(team.handicap),
-        "players": [],
-        "hole_list": [],
-        "team_score": 0,
-        "winner": False,
-        "money": 0,
-    }
-    for player in team.players.all():
-        team_score["players"].append(player.name)
-        player_mem = models.PlayerMembership.objects.filter(
-            game=team.game, player=player, team=team
-        ).first()
-        player_score_list = models.HoleScore.objects.filter(
-            player=player_mem,
-            score__gt=0,
-        )
-        for hole_score in player_score_list:
-            hole_data = {
-                "player_name": player.name,
-                "hole_order": hole_score.hole.order,
-                "hole_name": hole_score.hole.name,
-                "hole_score": hole_score.strokes,
-                "hole_par": hole_score.hole.par,
-                "hole_handicap": str(hole_score.hole.handicap),
-            }
-            current_hole_filter = filter(
-                lambda h: h["hole_order"] == hole_score.hole.order,
-                team_score["hole_list"],
-            )
-            current_holes = list(current_hole_filter)
-            if current_holes and len(current_holes) == 1:
-                current_hole = current_holes[0]
-                if current_hole["hole_score"] > hole_score.strokes:
-                    hole_index = team_score["hole_list"].index(current_hole)
-                    old_hole = team_score["hole_list"].pop(hole_index)
-                    team_score["hole_list"].insert(hole_index, hole_data)
-                elif current_hole["hole_score"] == hole_score.strokes:
-                    hole_index = team_score["hole_list"].index(current_hole)
-                    old_hole = team_score["hole_list"].pop(hole_index)
-                    hole_data.update(player_name="Multiple")
-                    team_score["hole_list"].insert(hole_index, hole_data)
-            else:
-                team_score["hole_list"].append(hole_data)
-    team_score["team_score"] = sum([_h["hole_score"] for _h in team_score["hole_list"]])
-    return team_score
+    score_data = scoring.load_game_scores(team.game)
+    return scoring.get_team_score(score_data, team)
 
 
+@instrumentation.timed()
 def update_team_data_low_score(team_data, score_list, pot, percent_money=100):
     low_score = min(score_list)
     low_filter = filter(lambda t: t["team_score"] == low_score, team_data)
@@ -307,19 +331,9 @@ def update_team_data_low_score(team_data, score_list, pot, percent_money=100):
     return team_data, score_list
 
 
+@instrumentation.timed()
 def score_teams(game):
-    team_data = [get_team_score(t) for t in get_teams_for_game(game)]
-    score_list = [td["team_score"] for td in team_data]
-    if not game.payout_positions or game.payout_positions == 1:
-        team_data, _ = update_team_data_low_score(team_data, score_list, game.pot)
-    elif game.payout_positions == 2:
-        team_data, sl = update_team_data_low_score(team_data, score_list, game.pot, 80)
-        team_data, _ = update_team_data_low_score(team_data, sl, game.pot, 20)
-    elif game.payout_positions == 3:
-        team_data, sl = update_team_data_low_score(team_data, score_list, game.pot, 70)
-        team_data, sl = update_team_data_low_score(team_data, sl, game.pot, 20)
-        team_data, _ = update_team_data_low_score(team_data, sl, game.pot, 10)
-    return team_data
+    return scoring.score_teams(scoring.load_game_scores(game))
 
 
 def get_hole_list_for_game(game):
@@ -337,94 +351,12 @@ def get_hole_list_for_game(game):
 
 
 def get_hole_data_for_game(game, final_scores=False):
-    hole_data = []
-    # Always keep track of each players score
-    for player in game.players.all():
-        player_data = {
-            "course_name": game.course.name,
-            "player_id": player.id,
-            "player_name": player.name,
-            "hcp": float(player.handicap),
-            "skins": None,
-            "points_needed": None,
-            "team_id": None,
-            "team_name": None,
-            "team_hcp": None,
-            "game_hcp": None,
-            "game_points": None,
-            "hole_list": [],
-            "player_score": 0,
-            "player_points": 0,
-            "par": 0,
-            "winner": False,
-            "money": 0,
-        }
-        player_mem = models.PlayerMembership.objects.filter(
-            game=game, player=player
-        ).first()
-        player_data["skins"] = player_mem.skins
-        player_data["points_needed"] = player_mem.points_needed
-        if game.use_teams and player_mem.team != None:
-            player_data["team_id"] = player_mem.team.id
-            player_data["team_name"] = player_mem.team.name
-            player_data["team_hcp"] = str(player_mem.team.handicap)
-        hole_score_list = models.HoleScore.objects.filter(player=player_mem)
-        for hole_score in hole_score_list:
-            player_data["hole_list"].append(
-                {
-                    "hole_score_id": hole_score.id,
-                    "hole_order": hole_score.hole.order,
-                    "hole_name": hole_score.hole.name,
-                    "hole_strokes": hole_score.strokes,
-                    "hole_points": hole_score.points,
-                    "hole_par": hole_score.hole.par,
-                    "hole_handicap": str(hole_score.hole.handicap),
-                    "hole_score": hole_score.score,
-                }
-            )
-            player_data["player_score"] += hole_score.strokes
-            player_data["player_points"] += hole_score.points
-            player_data["par"] += hole_score.hole.par
-        player_data["game_hcp"] = player_data["player_score"] - player_data["par"]
-        player_data["game_points"] = player_data["player_points"] - player_data["points_needed"]
-        if final_scores:
-            player_mem.game_handicap = player_data["game_hcp"]
-            player_mem.game_score = player_data["player_score"]
-            player_mem.game_points = player_data["game_points"]
-            player_mem.save()
-        hole_data.append(player_data)
-    return hole_data
+    score_data = scoring.load_game_scores(game)
+    return scoring.get_hole_data(score_data, final_scores=final_scores)
 
 
 def get_all_scores_for_game(game):
-    all_scores = []
-    for hole in get_holes_for_game(game):
-        hole_data = {
-            "order": hole.order,
-            "name": hole.name,
-            "scores": [],
-            "par": hole.par,
-            "handicap": int(hole.handicap),
-        }
-        for player in game.players.all():
-            player_mem = models.PlayerMembership.objects.filter(
-                game=game, player=player
-            ).first()
-            hole_score = models.HoleScore.objects.filter(
-                player=player_mem, hole=hole
-            ).first()
-            hole_score = {
-                "player": player.name,
-                "strokes": hole_score.strokes,
-                "points": hole_score.points,
-                "score": hole_score.score,
-                "skins": player_mem.skins,
-            }
-            hole_data["scores"].append(hole_score)
-        hole_data["scores"].sort(key=lambda s: s["strokes"])
-        all_scores.append(hole_data)
-    all_scores.sort(key=lambda h: h["order"])
-    return all_scores
+    return scoring.get_all_scores(scoring.load_game_scores(game))
 
 
 def all_holes_from_hole_data(hole_data):
@@ -455,6 +387,7 @@ def filter_skins_from_hole_data(hole_data):
     return skin_holes
 
 
+@instrumentation.timed()
 def get_skins_all_scores(all_scores, skin_cost):
     skins = []
     carry_money = None
@@ -482,35 +415,12 @@ def get_skins_all_scores(all_scores, skin_cost):
     return skins
 
 
+@instrumentation.timed()
 def skin_holes_from_game(game):
-    skin_holes = []
-    for hole in get_holes_for_game(game):
-        hole_data = {
-            "order": hole.order,
-            "name": hole.name,
-            "scores": [],
-            "par": hole.par,
-            "handicap": str(hole.handicap),
-        }
-        for player in game.players.all():
-            player_mem = models.PlayerMembership.objects.filter(
-                game=game, player=player
-            ).first()
-            if player_mem.skins:
-                hole_score = models.HoleScore.objects.filter(
-                    player=player_mem, hole=hole
-                ).first()
-                hole_data["scores"].append(
-                    {
-                        "player": player.name,
-                        "strokes": hole_score.strokes
-                    }
-                )
-        skin_holes.append(hole_data)
-    skin_holes.sort(key=lambda s: s["order"])
-    return skin_holes
+    return scoring.get_skin_holes(scoring.load_game_scores(game))
 
 
+@instrumentation.timed()
 def get_skins(game):
     skins = []
     carry_money = None
@@ -539,6 +449,7 @@ def get_skins(game):
     return skins
 
 
+@instrumentation.timed()
 def update_hole_data_high_points(hole_data, points_list, pot, percent_money=100):
     high_score = max(points_list)
     high_filter = filter(lambda t: t["game_points"] == high_score, hole_data)
@@ -555,6 +466,7 @@ def update_hole_data_high_points(hole_data, points_list, pot, percent_money=100)
     return hole_data, points_list
 
 
+@instrumentation.timed()
 def update_hole_data_low_score(hole_data, score_list, pot, percent_money=100):
     low_score = min(score_list)
     low_filter = filter(lambda t: t["player_score"] == low_score, hole_data)
@@ -571,6 +483,7 @@ def update_hole_data_low_score(hole_data, score_list, pot, percent_money=100):
     return hole_data, score_list
 
 
+@instrumentation.timed(get_size=len)
 def score_hole_data(hole_data, pot, payout_positions, use_points=False):
     if use_points:
         points_list = [h["game_points"] for h in hole_data]
@@ -597,46 +510,26 @@ def score_hole_data(hole_data, pot, payout_positions, use_points=False):
     return hole_data
 
 
-def update_player_hcp(hole_data):
-    for pd in hole_data:
-        player = models.Player.objects.filter(pk=pd["player_id"]).first()
-        player.handicap = round(sum([player.handicap, pd["game_hcp"]])/2, 1)
-        player.save()
+@instrumentation.timed()
+def update_player_hcp(game, hole_data):
+    players = handicaps.apply_game_handicaps(game, hole_data)
+    leaderboard.clear_leaderboard(
+        models.Game.objects.filter(
+            players__in=players, status="active"
+        ).values("pk")
+    )
 
 
 def score_game(game):
-    hole_list = get_hole_list_for_game(game)
-    all_scores = get_all_scores_for_game(game)
-    hole_data = get_hole_data_for_game(game, final_scores=True)
-    if game.game_type == "stableford":
-        scores = score_hole_data(hole_data, game.pot, game.payout_positions, use_points=True)
-    else:
-        scores = score_hole_data(hole_data, game.pot, game.payout_positions)
-    game_score = {
-        "all_scores": all_scores,
-        "hole_list": hole_list,
-        "scores": scores,
-    }
-    if game.use_skins:
-        skins = get_skins_all_scores(all_scores, game.skin_cost)
-        game_score.update({"skins": skins})
-    if game.use_teams:
-        team_scores = score_teams(game)
-        game_score.update({"team_scores": team_scores})
-    if game.league_game:
-        update_player_hcp(hole_data)
-    return game_score
+    # Timed in scoring.score_game.
+    return scoring.score_game(game)
 
 
 def get_player_scores_for_course(player, course):
-    scores = []
-    for game in models.Game.objects.filter(course=course, league_game=True):
-        if player in game.players.all():
-            player_mem = models.PlayerMembership.objects.filter(
-                game=game, player=player
-            ).first()
-            scores.append(player_mem.game_score)
-    return scores
+    return list(
+        rounds.get_rounds(player, course, league_only=True)
+        .values_list("gross", flat=True)
+    )
 
 
 def get_player_league_standings(player, course):
@@ -651,36 +544,17 @@ def get_player_league_standings(player, course):
 
 
 def get_league_standings():
-    league_standings = []
-    for player in models.Player.objects.all():
-        points = 36 - round_up(player.handicap)
-        player_standing = {
-            "id": player.id,
-            "name": player.name,
-            "hcp": player.handicap,
-            "points": points
+    return [
+        {
+            "id": standing.player_id,
+            "name": standing.player.name,
+            "hcp": standing.handicap,
+            "points": standing.points,
+            "rank": standing.rank,
         }
-        league_standings.append(player_standing)
-    league_standings.sort(key=lambda p: p["hcp"])
-    rank = 0
-    for person in league_standings:
-        rank += 1
-        person.update({"rank": rank})
-    return league_standings
+        for standing in standings.get_standings()
+    ]
 
 
 def get_ranked_players():
-    player_standings = []
-    for player in models.Player.objects.all():
-        _player = {
-            "player": player,
-            "hcp": player.handicap,
-        }
-        player_standings.append(_player)
-    player_standings.sort(key=lambda p: p["hcp"])
-    rank = 0
-    player_list = []
-    for person in player_standings:
-        rank += 1
-        player_list.append((rank, person["player"]))
-    return player_list
+    return [(standing.rank, standing.player) for standing in standings.get_standings()]
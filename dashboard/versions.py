@@ -0,0 +1,124 @@
+"""Version counters for conditional GETs.
+
+``Game`` and ``GolfCourse`` carry a ``version`` that goes up, with
+``modified_at``, whenever anything they are rendered from changes: a full
+save of the row itself, and through signals and the leaderboard writes,
+their hole scores, memberships, teams, holes and tees. Views turn the
+counters into a strong ETag and a Last-Modified, and answer a matching
+conditional GET with a 304 before loading or rendering anything.
+
+Counters only ever go up through ``F("version") + 1``, so two writers
+never hand out the same version for different content.
+"""
+import hashlib
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import condition
+from dashboard import models
+
+# Saves of only these fields do not change what is rendered.
+UNVERSIONED_FIELDS = {"leaderboard"}
+
+
+def bump(queryset):
+    """Bump the version of every row in ``queryset`` in one query."""
+    return queryset.update(**get_bump_fields())
+
+
+def get_bump_fields():
+    """Return update() keywords that bump the rows being updated."""
+    return {"version": F("version") + 1, "modified_at": timezone.now()}
+
+
+def get_stamp(queryset, pk, prefixes=("",)):
+    """Return ``(versions, last_modified)`` for one row, read from the
+    versioned objects its page is rendered from (``""`` for the row itself,
+    ``"course__"`` for its course), or None when there is no such row."""
+    fields = []
+    for prefix in prefixes:
+        fields += [f"{prefix}version", f"{prefix}modified_at"]
+    try:
+        row = queryset.filter(pk=pk).order_by().values_list(*fields).first()
+    except (TypeError, ValueError):
+        return None
+    if row is None:
+        return None
+    return row[0::2], max(row[1::2])
+
+
+def get_etag(request, kind, pk, versions, per_user=False):
+    parts = [
+        kind,
+        pk,
+        *versions,
+        request.get_host(),
+        request.META.get("QUERY_STRING", ""),
+        request.headers.get("Accept", ""),
+    ]
+    if per_user:
+        # HTML pages carry the user's name, their permissions and a CSRF
+        # token tied to the session, so they are only reusable within it.
+        parts += [request.user.pk, request.session.session_key]
+    digest = hashlib.sha256("|".join(map(str, parts)).encode()).hexdigest()
+    return f'"{kind}-{pk}-{versions[0]}-{digest[:16]}"'
+
+
+def get_cached_stamp(request, queryset, pk, prefixes=("",)):
+    # The ETag and Last-Modified functions of a view share one query.
+    if not hasattr(request, "_version_stamp"):
+        request._version_stamp = get_stamp(queryset, pk, prefixes)
+    return request._version_stamp
+
+
+def get_game_stamp(request, pk, queryset=None):
+    queryset = models.Game.objects.all() if queryset is None else queryset
+    return get_cached_stamp(request, queryset, pk, ("", "course__"))
+
+
+def get_course_stamp(request, pk, queryset=None):
+    queryset = models.GolfCourse.objects.all() if queryset is None else queryset
+    return get_cached_stamp(request, queryset, pk)
+
+
+def get_hole_stamp(request, pk):
+    return get_cached_stamp(request, models.Hole.objects.all(), pk, ("course__",))
+
+
+STAMPS = {
+    "game": get_game_stamp,
+    "course": get_course_stamp,
+    "hole": get_hole_stamp,
+}
+
+
+def conditional(kind):
+    """Decorate an HTML view that takes the object's ``pk`` so that it
+    answers a matching conditional GET with a 304 without running."""
+    get_object_stamp = STAMPS[kind]
+
+    def etag(request, pk, *args, **kwargs):
+        stamp = get_object_stamp(request, pk)
+        if stamp is None:
+            return None
+        return get_etag(request, kind, pk, stamp[0], per_user=True)
+
+    def last_modified(request, pk, *args, **kwargs):
+        stamp = get_object_stamp(request, pk)
+        return stamp[1] if stamp else None
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def get_not_modified(request, etag, last_modified):
+    """Return a 304 when the request already has this version, else None."""
+    return get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp())
+    )
+
+
+def set_headers(response, etag, last_modified):
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified.timestamp())
+    return response
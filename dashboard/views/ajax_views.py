@@ -1,15 +1,19 @@
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.core.exceptions import ValidationError
 from django.http import JsonResponse, HttpResponseBadRequest
 from django.shortcuts import reverse
 from django.utils import timezone
 from dashboard import models
+from dashboard.query_budget import query_budget
+from dashboard import sync
 from dashboard import utils
 import json
 
 
 @login_required
+@query_budget(9)
 def ajax_record_score_for_hole(request):
     data = json.loads(request.body)
     hole_id = data["hole_score_id"]
@@ -18,9 +22,45 @@ def ajax_record_score_for_hole(request):
         return HttpResponseBadRequest("Missing score for hole")
     hole_score = models.HoleScore.objects.filter(pk=hole_id).first()
     hole_score.score_hole(hole_val)
+    sync.record_online_scores(request.user, [hole_score])
     return JsonResponse({"status": "success"})
 
 
+@login_required
+@query_budget(23)
+def ajax_record_scores_for_game(request):
+    data = json.loads(request.body)
+    game_obj = models.Game.objects.filter(pk=data.get("game_id")).first()
+    if game_obj is None:
+        return HttpResponseBadRequest("Unable to find game")
+    scores = {s["hole_score_id"]: s["hole_score"] for s in data.get("scores", [])}
+    if not scores:
+        return HttpResponseBadRequest("Missing scores")
+    try:
+        board_slice = utils.record_scores_for_game(game_obj, scores, request.user)
+    except ValidationError as e:
+        return HttpResponseBadRequest(e.message)
+    return JsonResponse({"status": "success", "leaderboard": board_slice})
+
+
+@login_required
+@query_budget(16)
+def ajax_sync_scores(request):
+    data = json.loads(request.body)
+    mutations = data.get("mutations")
+    if not mutations or not isinstance(mutations, list):
+        return HttpResponseBadRequest("Missing mutations")
+    game_obj = models.Game.objects.filter(pk=data.get("game_id")).first()
+    if game_obj is None:
+        # A deleted game's scores can never be applied.
+        results = [
+            sync.get_rejected_result(m, "Unable to find game") for m in mutations
+        ]
+    else:
+        results = sync.sync_score_mutations(game_obj, request.user, mutations)
+    return JsonResponse({"status": "success", "results": results})
+
+
 @login_required
 @user_passes_test(
     utils.is_admin,
@@ -160,6 +200,7 @@ def ajax_delete_hole_score(request):
     score_obj = models.HoleScore.objects.filter(pk=score_id).first()
     if score_obj:
         score_obj.reset_score()
+        sync.record_online_scores(request.user, [score_obj])
         return JsonResponse({"status": "success"})
     return JsonResponse({"status": "failed", "message": "Unable to find hole score"})
 
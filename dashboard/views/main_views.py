@@ -1,21 +1,35 @@
+import asyncio
+import hmac
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.utils import timezone
 from dashboard import forms
+from dashboard import leaderboard
+from dashboard import live
 from dashboard import models
 from dashboard import pdf_utils
+from dashboard import profiling
+from dashboard.query_budget import query_budget
+from dashboard import standings
+from dashboard import sync
 from dashboard import utils
+from dashboard import versions
 
 
+@query_budget(2)
 def no_permission(request):
     return render(request, "no-permission.html", {})
 
 
 @login_required
+@query_budget(6)
 def dashboard(request):
-    league_standings = utils.get_league_standings()
+    league_standings = standings.get_standings_page(request.GET.get("page"))
     game_list = None
     tee_time_list = None
     is_admin = False
@@ -44,12 +58,16 @@ def dashboard(request):
 
 
 @login_required
+@query_budget(2)
 def view_my_games(request):
-    game_list = models.Game.objects.filter(players__in=[request.user.player])
+    game_list = models.Game.objects.filter(
+        players__in=[request.user.player]
+    ).select_related("course")
     return render(request, "dashboard/view-my-games.html", {"game_list": game_list})
 
 
 @login_required
+@query_budget(1)
 def my_profile(request):
     player_data = models.Player.objects.filter(user_account=request.user).first()
     return render(
@@ -73,25 +91,42 @@ def location_test(request):
     return render(request, "dashboard/location-test.html", {})
 
 
+@query_budget(0)
+def score_sync_worker(request):
+    # Served from the site root rather than /static/ so the worker's scope
+    # covers the game pages.
+    return render(
+        request,
+        "dashboard/score-sync-sw.js",
+        {},
+        content_type="application/javascript",
+    )
+
+
 @login_required
+@query_budget(1)
 def course_list(request):
     course_list = models.GolfCourse.objects.all()
     return render(request, "dashboard/courses.html", {"course_list": course_list})
 
 
 @login_required
+@query_budget(4)
 def game_list(request):
-    game_list = models.Game.objects.all()
+    game_list = models.Game.objects.select_related("course")
     return render(request, "dashboard/game-list.html", {"game_list": game_list})
 
 
 @login_required
+@query_budget(1)
 def player_list(request):
     player_list = utils.get_ranked_players()
     return render(request, "dashboard/players.html", {"player_list": player_list})
 
 
 @login_required
+@query_budget(4)
+@versions.conditional("course")
 def course_detail(request, pk):
     course_data = get_object_or_404(models.GolfCourse, pk=pk)
     course_location = None
@@ -112,6 +147,8 @@ def course_detail(request, pk):
 
 
 @login_required
+@query_budget(4)
+@versions.conditional("hole")
 def hole_detail(request, pk):
     hole_data = get_object_or_404(models.Hole, pk=pk)
     tee_list = models.Tee.objects.filter(hole=hole_data)
@@ -130,6 +167,8 @@ def hole_detail(request, pk):
 
 
 @login_required
+@query_budget(19)
+@versions.conditional("game")
 def game_detail(request, pk):
     team_list = False
     game_data = get_object_or_404(models.Game, pk=pk)
@@ -137,7 +176,16 @@ def game_detail(request, pk):
     current_players = utils.get_current_players_for_game(game_data)
     player_list = utils.get_players_not_in_game(game_data)
     hole_list = utils.get_hole_list_for_game(game_data)
-    hole_data = utils.get_hole_data_for_game(game_data)
+    hole_data = []
+    standings = []
+    skins = []
+    if game_data.status == "active":
+        board = leaderboard.get_leaderboard(game_data)
+        hole_data = leaderboard.get_hole_data(board)
+        standings = leaderboard.get_standings(
+            board, use_points=game_data.game_type == "stableford"
+        )
+        skins = board["skins"]
     if game_data.use_teams:
         team_list = utils.get_team_list_for_game(game_data)
     return render(
@@ -146,17 +194,133 @@ def game_detail(request, pk):
         {
             "user_is_admin": utils.is_admin(request.user),
             "game_data": game_data,
+            "live_stream": live.can_stream(request),
             "team_list": team_list,
             "player_list": player_list,
             "current_player_count": current_player_count,
             "current_players": current_players,
             "hole_data": hole_data,
             "hole_list": hole_list,
+            "standings": standings,
+            "skins": skins,
+        },
+    )
+
+
+@login_required
+@query_budget(10)
+@versions.conditional("game")
+def game_score_grid(request, pk):
+    game_data = get_object_or_404(models.Game, pk=pk, status="active")
+    board = leaderboard.get_leaderboard(game_data)
+    return render(
+        request,
+        "dashboard/fragments/game-score-grid.html",
+        {
+            "user_is_admin": utils.is_admin(request.user),
+            "game_data": game_data,
+            "hole_list": utils.get_hole_list_for_game(game_data),
+            "hole_data": leaderboard.get_hole_data(board),
+        },
+    )
+
+
+@login_required
+@query_budget(10)
+@versions.conditional("game")
+def game_leaderboard(request, pk):
+    game_data = get_object_or_404(models.Game, pk=pk, status="active")
+    board = leaderboard.get_leaderboard(game_data)
+    return render(
+        request,
+        "dashboard/fragments/game-leaderboard.html",
+        {
+            "game_data": game_data,
+            "standings": leaderboard.get_standings(
+                board, use_points=game_data.game_type == "stableford"
+            ),
+        },
+    )
+
+
+@login_required
+@query_budget(4)
+@versions.conditional("game")
+def game_team_list(request, pk):
+    game_data = get_object_or_404(models.Game, pk=pk)
+    return render(
+        request,
+        "dashboard/fragments/game-team-list.html",
+        {
+            "game_data": game_data,
+            "team_list": utils.get_team_list_for_game(game_data),
         },
     )
 
 
 @login_required
+@query_budget(10)
+@versions.conditional("game")
+def game_skins(request, pk):
+    game_data = get_object_or_404(models.Game, pk=pk, status="active")
+    board = leaderboard.get_leaderboard(game_data)
+    return render(
+        request,
+        "dashboard/fragments/game-skins.html",
+        {
+            "game_data": game_data,
+            "skins": board["skins"],
+        },
+    )
+
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def _get_fresh_leaderboard(game):
+    game.leaderboard = None
+    return leaderboard.get_leaderboard(game)
+
+
+@login_required
+async def game_leaderboard_stream(request, pk):
+    if not live.can_stream(request):
+        raise Http404("Live updates are not available on this server")
+    game_data = await models.Game.objects.filter(pk=pk, status="active").afirst()
+    if game_data is None:
+        raise Http404("No active game found")
+    broker = live.get_broker()
+    channel = live.game_channel(game_data.pk)
+    # Subscribe before taking the snapshot so no diff falls between them.
+    queue = broker.subscribe(channel)
+
+    async def events():
+        try:
+            board = await sync_to_async(_get_fresh_leaderboard)(game_data)
+            yield _sse_event("snapshot", board)
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if message["type"] == "reset":
+                    board = await sync_to_async(_get_fresh_leaderboard)(game_data)
+                    yield _sse_event("snapshot", board)
+                else:
+                    yield _sse_event(message["type"], message)
+        finally:
+            broker.unsubscribe(channel, queue)
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@login_required
+@query_budget(29)
 def game_score(request, pk):
     game_data = get_object_or_404(models.Game, pk=pk)
     game_data.stop()
@@ -170,20 +334,25 @@ def game_score(request, pk):
 
 
 @login_required
+@query_budget(2)
 def game_score_detail(request, pk):
     game_data = get_object_or_404(models.Game, pk=pk)
     if game_data.status != "completed":
-        current_scores = []
         filter_scores = request.GET.get("filter_scores", "false")
-        for player in game_data.players.all():
-            player_game_link = models.PlayerMembership.objects.filter(
-                game=game_data, player=player
-            ).first()
-            if filter_scores == "true":
-                hole_score_list = models.HoleScore.objects.filter(player=player_game_link, strokes__gt=0)
-            else:
-                hole_score_list = models.HoleScore.objects.filter(player=player_game_link)
-            current_scores.extend(hole_score_list)
+        current_scores = (
+            models.HoleScore.objects.filter(player__game=game_data)
+            .select_related("player__player", "player__team", "hole")
+            .order_by(
+                "player__player__last_name",
+                "player__player__first_name",
+                "player",
+                "hole",
+                "-strokes",
+            )
+        )
+        if filter_scores == "true":
+            current_scores = current_scores.filter(strokes__gt=0)
+        current_scores = list(current_scores)
         return render(
             request,
             "dashboard/game-score-detail.html",
@@ -205,18 +374,21 @@ def game_score_detail(request, pk):
 
 
 @login_required
+@query_budget(2)
 def player_detail(request, pk):
     player_data = get_object_or_404(models.Player, pk=pk)
     return render(request, "dashboard/player-detail.html", {"player_data": player_data})
 
 
 @login_required
+@query_budget(2)
 def tee_time_list(request):
     tee_times = models.TeeTime.objects.all()
     return render(request, "dashboard/tee-time-list.html", {"tee_time_list": tee_times})
 
 
 @login_required
+@query_budget(2)
 def create_tee_time(request):
     if request.method == "POST":
         form = forms.TeeTimeForm(request.POST)
@@ -229,6 +401,7 @@ def create_tee_time(request):
 
 
 @login_required
+@query_budget(5)
 def tee_time_detail(request, pk):
     teetime_data = get_object_or_404(models.TeeTime, pk=pk)
     potential_player_list = models.Player.objects.all().exclude(teetime__in=[teetime_data.id])
@@ -240,6 +413,7 @@ def tee_time_detail(request, pk):
 
 
 @login_required
+@query_budget(5)
 def hole_score_detail(request, pk):
     hole_score_data = get_object_or_404(models.HoleScore, pk=pk)
     return render(
@@ -258,6 +432,7 @@ def hole_score_detail(request, pk):
     login_url="/no-permission/",
     redirect_field_name=None
 )
+@query_budget(0)
 def create_course(request):
     if request.method == "POST":
         form = forms.GolfCourseForm(request.POST, request.FILES)
@@ -276,6 +451,7 @@ def create_course(request):
     login_url="/no-permission/",
     redirect_field_name=None
 )
+@query_budget(1)
 def edit_course(request, pk):
     course_data = get_object_or_404(models.GolfCourse, pk=pk)
     if request.method == "POST":
@@ -295,6 +471,7 @@ def edit_course(request, pk):
     login_url="/no-permission/",
     redirect_field_name=None
 )
+@query_budget(1)
 def create_tee(request, hole_pk):
     hole_data = get_object_or_404(models.Hole, pk=hole_pk)
     if request.method == "POST":
@@ -319,6 +496,7 @@ def create_tee(request, hole_pk):
     login_url="/no-permission/",
     redirect_field_name=None
 )
+@query_budget(1)
 def edit_tee(request, hole_pk):
     hole_data = get_object_or_404(models.Hole, pk=hole_pk)
     if request.method == "POST":
@@ -341,6 +519,7 @@ def edit_tee(request, hole_pk):
     login_url="/no-permission/",
     redirect_field_name=None
 )
+@query_budget(4)
 def create_game(request):
     if request.method == "POST":
         form = forms.GameForm(request.POST)
@@ -359,6 +538,7 @@ def create_game(request):
     login_url="/no-permission/",
     redirect_field_name=None
 )
+@query_budget(3)
 def edit_game(request, pk):
     game_data = get_object_or_404(models.Game, pk=pk)
     if request.method == "POST":
@@ -382,6 +562,7 @@ def edit_game(request, pk):
     login_url="/no-permission/",
     redirect_field_name=None
 )
+@query_budget(1)
 def create_player(request):
     if request.method == "POST":
         form = forms.PlayerForm(request.POST, request.FILES)
@@ -402,6 +583,7 @@ def create_player(request):
     login_url="/no-permission/",
     redirect_field_name=None
 )
+@query_budget(2)
 def edit_player(request, pk):
     player_data = get_object_or_404(models.Player, pk=pk)
     if request.method == "POST":
@@ -425,6 +607,7 @@ def edit_player(request, pk):
     login_url="/no-permission/",
     redirect_field_name=None
 )
+@query_budget(2)
 def create_hole(request, pk):
     course_data = get_object_or_404(models.GolfCourse, pk=pk)
     if request.method == "POST":
@@ -450,6 +633,7 @@ def create_hole(request, pk):
     login_url="/no-permission/",
     redirect_field_name=None
 )
+@query_budget(1)
 def edit_hole(request, pk):
     hole_data = get_object_or_404(models.Hole, pk=pk)
     if request.method == "POST":
@@ -471,12 +655,14 @@ def edit_hole(request, pk):
     login_url="/no-permission/",
     redirect_field_name=None
 )
+@query_budget(9)
 def edit_hole_score(request, pk):
     hole_score_data = get_object_or_404(models.HoleScore, pk=pk)
     if request.method == "POST":
         form = forms.EditHoleScoreForm(request.POST, instance=hole_score_data)
         if form.is_valid():
             form.save()
+            sync.record_online_scores(request.user, [hole_score_data])
             messages.add_message(request, messages.INFO, "Hole score updated.")
             return redirect("dashboard:hole_score_detail", pk)
     form = forms.EditHoleScoreForm(instance=hole_score_data)
@@ -488,3 +674,36 @@ def edit_hole_score(request, pk):
             "hole_score_id": pk
         }
     )
+
+
+@login_required
+@user_passes_test(
+    utils.is_admin,
+    login_url="/no-permission/",
+    redirect_field_name=None
+)
+@query_budget(3)
+def profiling_stats(request):
+    return render(
+        request, "dashboard/profiling.html",
+        {
+            "stats": profiling.get_stats(),
+            "is_enabled": getattr(settings, "PROFILING_ENABLED", False),
+            "sample_rate": getattr(settings, "PROFILING_SAMPLE_RATE", 1),
+        }
+    )
+
+
+@query_budget(3)
+def profiling_metrics(request):
+    # Scrapers send the token; admins can read it from a browser session.
+    token = getattr(settings, "PROFILING_METRICS_TOKEN", "")
+    auth = request.headers.get("Authorization", "")
+    if not (
+        token and hmac.compare_digest(auth, f"Bearer {token}")
+    ) and not utils.is_admin(request.user):
+        return HttpResponse(status=403)
+    return HttpResponse(
+        profiling.format_metrics(profiling.get_stats()),
+        content_type="text/plain; version=0.0.4",
+    )
@@ -0,0 +1,112 @@
+// IndexedDB backed queue of score changes made on the course.
+// Loaded by game-detail.html and by the score sync service worker, so it
+// only uses APIs available in both (no DOM, no cookies).
+const ScoreQueue = (() => {
+  const DB_NAME = "rs-golf-scores";
+  const STORE = "mutations";
+  const CONFIG_STORE = "config";
+
+  const openDb = () => new Promise((resolve, reject) => {
+    const request = indexedDB.open(DB_NAME, 1);
+    request.onupgradeneeded = () => {
+      request.result.createObjectStore(STORE, { keyPath: "mutation_id" });
+      request.result.createObjectStore(CONFIG_STORE);
+    };
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+
+  const run = async (storeName, mode, fn) => {
+    const db = await openDb();
+    return new Promise((resolve, reject) => {
+      const tx = db.transaction(storeName, mode);
+      const result = fn(tx.objectStore(storeName));
+      tx.oncomplete = () => resolve(result && result.result);
+      tx.onerror = () => reject(tx.error);
+    });
+  };
+
+  const enqueue = (gameId, holeScoreId, strokes) => run(STORE, "readwrite", (store) => store.put({
+    mutation_id: crypto.randomUUID(),
+    game_id: gameId,
+    hole_score_id: holeScoreId,
+    strokes: strokes,
+    recorded_at: new Date().toISOString()
+  }));
+
+  const pending = () => run(STORE, "readonly", (store) => store.getAll());
+
+  const remove = (mutationIds) => run(STORE, "readwrite", (store) => {
+    mutationIds.forEach((mutationId) => store.delete(mutationId));
+  });
+
+  // The worker has no access to the page, so the page stores where and how
+  // to sync for it.
+  const configure = (syncUrl, csrfToken) => run(CONFIG_STORE, "readwrite", (store) => {
+    store.put(syncUrl, "syncUrl");
+    store.put(csrfToken, "csrfToken");
+  });
+
+  const getConfig = async (key) => run(CONFIG_STORE, "readonly", (store) => store.get(key));
+
+  // Mutations the server has dealt with for good, including the ones it
+  // rejected, which would be rejected again. Anything the server did not
+  // answer for stays queued.
+  const SETTLED = new Set(["applied", "duplicate", "superseded", "rejected"]);
+
+  // Sends every queued mutation, one request per game. Returns the server
+  // results. Mutations stay queued until the server reports them settled,
+  // and the flush throws if it should be retried later.
+  const flush = async () => {
+    const syncUrl = await getConfig("syncUrl");
+    const csrfToken = await getConfig("csrfToken");
+    const mutations = await pending();
+    const byGame = new Map();
+    mutations.forEach((mutation) => {
+      const gameMutations = byGame.get(mutation.game_id) || [];
+      gameMutations.push(mutation);
+      byGame.set(mutation.game_id, gameMutations);
+    });
+    let results = [];
+    for (const [gameId, gameMutations] of byGame) {
+      const response = await fetch(syncUrl, {
+        method: "POST",
+        credentials: "same-origin",
+        headers: {
+          "X-CSRFToken": csrfToken,
+          "Content-Type": "application/json"
+        },
+        body: JSON.stringify({ game_id: gameId, mutations: gameMutations })
+      });
+      // An expired session is redirected to the login page, and a stale CSRF
+      // token is refused. Both work again once the scorer signs back in.
+      const isJson = (response.headers.get("Content-Type") || "").startsWith("application/json");
+      if (
+        response.redirected
+        || response.status === 401
+        || response.status === 403
+        || response.status >= 500
+        || (response.ok && !isJson)
+      ) {
+        throw new Error(`Error syncing scores (${response.status})`);
+      }
+      if (!response.ok) {
+        console.log("Scores rejected: ", await response.text());
+        continue;
+      }
+      const jsonData = await response.json();
+      jsonData.results
+        .filter((result) => result.status === "rejected")
+        .forEach((result) => console.log("Score rejected: ", result.message));
+      await remove(
+        jsonData.results
+          .filter((result) => result.mutation_id && SETTLED.has(result.status))
+          .map((result) => result.mutation_id)
+      );
+      results = results.concat(jsonData.results);
+    }
+    return results;
+  };
+
+  return { enqueue, pending, flush, configure };
+})();
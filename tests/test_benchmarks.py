@@ -0,0 +1,136 @@
+"""rs-golf scoring benchmarks.
+
+Times the scoring hot paths against a synthetic league at several field
+sizes. Query counts are compared to ``benchmarks.json``, which is
+committed. Wall times depend on the machine, so they are compared to a
+baseline recorded on the same machine, kept out of the repository in
+``BENCHMARK_TIMINGS`` (default ``.benchmark-timings.json`` next to this
+file).
+
+Benchmarks are skipped unless ``BENCHMARK`` is set:
+
+    BENCHMARK=1 pytest tests/test_benchmarks.py -p no:xdist
+    BENCHMARK=update pytest tests/test_benchmarks.py -p no:xdist
+
+``update`` rewrites both baselines. A run fails when a function makes
+more queries than its baseline, or, once this machine has a timing
+baseline, takes longer than it times ``BENCHMARK_THRESHOLD`` (default
+1.5) plus ``BENCHMARK_SLACK_MS``.
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from dashboard import course_index
+from dashboard import models
+from dashboard import synthetic
+from dashboard import utils
+
+BASELINE_PATH = Path(__file__).with_name("benchmarks.json")
+TIMINGS_PATH = Path(
+    os.environ.get("BENCHMARK_TIMINGS", Path(__file__).with_name(".benchmark-timings.json"))
+)
+BENCHMARK = os.environ.get("BENCHMARK", "")
+THRESHOLD = float(os.environ.get("BENCHMARK_THRESHOLD", "1.5"))
+SLACK_MS = float(os.environ.get("BENCHMARK_SLACK_MS", "2"))
+FIELD_SIZES = [4, 12, 24]
+REPEAT = 5
+
+pytestmark = [
+    pytest.mark.slow,
+    pytest.mark.skipif(not BENCHMARK, reason="set BENCHMARK=1 to run benchmarks"),
+]
+
+
+def delete_hole_scores(game):
+    """Remove a game's scores so create_hole_scores_for_game does real work."""
+    models.HoleScore.objects.filter(player__game=game).delete()
+
+
+BENCHMARKS = {
+    "score_game": (utils.score_game, None),
+    "get_hole_data_for_game": (utils.get_hole_data_for_game, None),
+    "get_all_scores_for_game": (utils.get_all_scores_for_game, None),
+    "get_skins": (utils.get_skins, None),
+    "score_teams": (utils.score_teams, None),
+    "create_hole_scores_for_game": (utils.create_hole_scores_for_game, delete_hole_scores),
+    "get_league_standings": (lambda game: utils.get_league_standings(), None),
+}
+
+
+def load(path):
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def save(path, data):
+    path.write_text(json.dumps(data, indent=2, sort_keys=True) + "\n")
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    """Load the stored baselines and write the new ones in update mode."""
+    queries, timings = load(BASELINE_PATH), load(TIMINGS_PATH)
+    results = {}
+    yield queries, timings, results
+    if BENCHMARK == "update":
+        queries.update({key: result["queries"] for key, result in results.items()})
+        timings.update({key: result["ms"] for key, result in results.items()})
+        save(BASELINE_PATH, queries)
+        save(TIMINGS_PATH, timings)
+
+
+@pytest.fixture
+def league(request):
+    """Return a synthetic league with one active game of the given size."""
+    course_index.clear()
+    cache.clear()
+    return synthetic.generate_league(
+        players=request.param * 2,
+        completed_games=3,
+        active_games=1,
+        field_size=request.param,
+    )
+
+
+def measure(func, game, setup=None):
+    """Return the best wall time in ms and the query count over REPEAT runs."""
+    times = []
+    for _ in range(REPEAT):
+        if setup:
+            setup(game)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            func(game)
+            times.append(time.perf_counter() - started)
+    return {"ms": round(min(times) * 1000, 3), "queries": len(queries.captured_queries)}
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("league", FIELD_SIZES, indirect=True, ids=lambda s: f"{s}p")
+@pytest.mark.parametrize("name", BENCHMARKS.keys())
+def test_benchmark(name, league, baseline):
+    """Test a scoring function has not regressed against its baseline."""
+    queries, timings, results = baseline
+    game = league["active"][0]
+    func, setup = BENCHMARKS[name]
+    key = f"{name}[{game.players.count()}]"
+    result = measure(func, game, setup)
+    results[key] = result
+    if BENCHMARK == "update":
+        return
+    if key in queries:
+        assert result["queries"] <= queries[key], (
+            f"{key} made {result['queries']} queries, baseline {queries[key]}"
+        )
+    if key in timings:
+        limit = timings[key] * THRESHOLD + SLACK_MS
+        assert result["ms"] <= limit, (
+            f"{key} took {result['ms']} ms, baseline {timings[key]} ms (limit {limit:.3f})"
+        )
@@ -0,0 +1,486 @@
+"""rs-golf query budget tests.
+
+Requests every dashboard and api endpoint against a small and a large
+synthetic league. Test settings use ``QUERY_BUDGET_MODE = "raise"``, so a
+view that runs more queries than its budget fails the request; the same
+budget holding at both sizes is what rules out an N+1.
+"""
+
+import json
+import uuid
+
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api import packing
+from dashboard import course_index
+from dashboard import models
+from dashboard import synthetic
+from dashboard.query_budget import BUDGETS
+
+FIELD_SIZES = [4, 16]
+# Views left without a budget on purpose.
+UNBUDGETED = {
+    # Streams for as long as the client listens.
+    "dashboard:game_leaderboard_stream",
+    # Admin-only maintenance actions.
+    "dashboard:ajax_manage_game",
+    "dashboard:ajax_manage_players_for_game",
+    "dashboard:ajax_edit_hole_score",
+    "dashboard:ajax_manage_tee_time",
+    "dashboard:ajax_delete_hole_score",
+    "dashboard:ajax_delete_tee",
+    # Runs other endpoints, each within its own budget.
+    "api:batch-list",
+    # Broken independently of their queries: the template is missing and
+    # the scorecard filters HoleScore on a field it does not have.
+    "dashboard:location-test",
+    "dashboard:download-scorecard",
+}
+
+
+@pytest.fixture
+def league(request):
+    """Return a synthetic league with an admin user who plays in it."""
+    course_index.clear()
+    cache.clear()
+    league = synthetic.generate_league(
+        players=request.param + 4,
+        completed_games=2,
+        active_games=1,
+        field_size=request.param,
+    )
+    # create_game defaults the course to the club's home course.
+    models.GolfCourse.objects.filter(pk=league["course"].pk).update(initials="TTCC")
+    user = models.User.objects.create_superuser(
+        username="budget_admin", email="budget_admin@example.com", password="pw"
+    )
+    game = league["active"][0]
+    player = game.players.first()
+    player.user_account = user
+    player.added_by = user
+    player.save()
+    tee_time = models.TeeTime.objects.create(
+        course=league["course"], tee_time=timezone.now()
+    )
+    tee_time.players.set(league["players"])
+    setup_game = models.Game.objects.create(course=league["course"], use_teams=True)
+    models.PlayerMembership.objects.bulk_create([
+        models.PlayerMembership(game=setup_game, player=p, _order=order)
+        for order, p in enumerate(league["players"][:request.param])
+    ])
+    league.update({
+        "user": user,
+        "player": player,
+        "game": game,
+        "completed_game": league["completed"][0],
+        "hole": models.Hole.objects.filter(course=league["course"]).first(),
+        "hole_score": models.HoleScore.objects.filter(player__game=game).first(),
+        "tee_time": tee_time,
+        "setup_game": setup_game,
+        "free_player": models.Player.objects.exclude(game=game).first(),
+    })
+    return league
+
+
+GET_ENDPOINTS = [
+    ("dashboard:dashboard", lambda lg: []),
+    ("dashboard:profile", lambda lg: []),
+    ("dashboard:no_permission", lambda lg: []),
+    ("dashboard:score_sync_worker", lambda lg: []),
+    ("dashboard:courses", lambda lg: []),
+    ("dashboard:create_course", lambda lg: []),
+    ("dashboard:course_detail", lambda lg: [lg["course"].pk]),
+    ("dashboard:edit_course", lambda lg: [lg["course"].pk]),
+    ("dashboard:create_hole", lambda lg: [lg["course"].pk]),
+    ("dashboard:hole_detail", lambda lg: [lg["hole"].pk]),
+    ("dashboard:edit_hole", lambda lg: [lg["hole"].pk]),
+    ("dashboard:create_tee", lambda lg: [lg["hole"].pk]),
+    ("dashboard:edit_tee", lambda lg: [lg["hole"].pk]),
+    ("dashboard:games", lambda lg: []),
+    ("dashboard:create_game", lambda lg: []),
+    ("dashboard:my-game-list", lambda lg: []),
+    ("dashboard:game_detail", lambda lg: [lg["game"].pk]),
+    ("dashboard:game_detail", lambda lg: [lg["completed_game"].pk]),
+    ("dashboard:edit_game", lambda lg: [lg["game"].pk]),
+    ("dashboard:game_score_grid", lambda lg: [lg["game"].pk]),
+    ("dashboard:game_leaderboard", lambda lg: [lg["game"].pk]),
+    ("dashboard:game_team_list", lambda lg: [lg["game"].pk]),
+    ("dashboard:game_skins", lambda lg: [lg["game"].pk]),
+    ("dashboard:game_score_detail", lambda lg: [lg["game"].pk]),
+    ("dashboard:game_score_detail", lambda lg: [lg["completed_game"].pk]),
+    ("dashboard:game_score", lambda lg: [lg["game"].pk]),
+    ("dashboard:players", lambda lg: []),
+    ("dashboard:create_player", lambda lg: []),
+    ("dashboard:player_detail", lambda lg: [lg["player"].pk]),
+    ("dashboard:edit_player", lambda lg: [lg["player"].pk]),
+    ("dashboard:hole_score_detail", lambda lg: [lg["hole_score"].pk]),
+    ("dashboard:edit_hole_score", lambda lg: [lg["hole_score"].pk]),
+    ("dashboard:tee_times", lambda lg: []),
+    ("dashboard:create_tee_time", lambda lg: []),
+    ("dashboard:tee_time_detail", lambda lg: [lg["tee_time"].pk]),
+    ("dashboard:profiling", lambda lg: []),
+    ("dashboard:profiling_metrics", lambda lg: []),
+    ("api:golf-course-list", lambda lg: []),
+    ("api:golf-course-detail", lambda lg: [lg["course"].pk]),
+    ("api:game-list", lambda lg: []),
+    ("api:game-detail", lambda lg: [lg["game"].pk]),
+    ("api:players-list", lambda lg: []),
+    ("api:players-detail", lambda lg: [lg["player"].pk]),
+    ("api:tee-times-list", lambda lg: []),
+    ("api:tee-times-detail", lambda lg: [lg["tee_time"].pk]),
+    ("api:tee-list", lambda lg: []),
+    ("api:changes-list", lambda lg: []),
+]
+
+
+def get_scores(league, strokes=5):
+    """Return every hole score of the active game set to ``strokes``."""
+    return [
+        {"id": pk, "strokes": strokes}
+        for pk in models.HoleScore.objects.filter(
+            player__game=league["game"]
+        ).values_list("id", flat=True)
+    ]
+
+
+POST_ENDPOINTS = [
+    (
+        "dashboard:ajax_record_score_for_hole",
+        lambda lg: [],
+        lambda lg: {"hole_score_id": lg["hole_score"].pk, "hole_score": 5},
+    ),
+    (
+        "dashboard:ajax_record_scores_for_game",
+        lambda lg: [],
+        lambda lg: {
+            "game_id": lg["game"].pk,
+            "scores": [
+                {"hole_score_id": s["id"], "hole_score": s["strokes"]}
+                for s in get_scores(lg)
+            ],
+        },
+    ),
+    (
+        "dashboard:ajax_sync_scores",
+        lambda lg: [],
+        lambda lg: {
+            "game_id": lg["game"].pk,
+            "mutations": [
+                {
+                    "mutation_id": str(uuid.uuid4()),
+                    "hole_score_id": s["id"],
+                    "strokes": s["strokes"],
+                    "recorded_at": timezone.now().isoformat(),
+                }
+                for s in get_scores(lg)
+            ],
+        },
+    ),
+    (
+        "api:game-record_scores",
+        lambda lg: [lg["game"].pk],
+        lambda lg: {"score_list": get_scores(lg)},
+    ),
+    (
+        "api:game-set_score",
+        lambda lg: [lg["game"].pk],
+        lambda lg: {"score_list": get_scores(lg)},
+    ),
+    (
+        "api:game-add_player",
+        lambda lg: [lg["game"].pk],
+        lambda lg: {"player": lg["free_player"].pk},
+    ),
+    (
+        "api:game-remove_player",
+        lambda lg: [lg["game"].pk],
+        lambda lg: {"player": lg["game"].players.exclude(pk=lg["player"].pk).first().pk},
+    ),
+    ("api:game-start_game", lambda lg: [lg["setup_game"].pk], lambda lg: {}),
+]
+
+
+@pytest.mark.django_db
+@override_settings(STATIC_URL="/static/")
+@pytest.mark.parametrize("league", FIELD_SIZES, indirect=True, ids=lambda s: f"{s}p")
+@pytest.mark.parametrize("name,get_args", GET_ENDPOINTS)
+def test_get_endpoint_within_budget(league, name, get_args):
+    """Test a GET endpoint stays within its query budget."""
+    client = APIClient()
+    client.force_login(league["user"])
+    response = client.get(reverse(name, args=get_args(league)))
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("league", FIELD_SIZES, indirect=True, ids=lambda s: f"{s}p")
+@pytest.mark.parametrize("name,get_args,get_data", POST_ENDPOINTS)
+def test_post_endpoint_within_budget(league, name, get_args, get_data):
+    """Test a score-writing endpoint stays within its query budget."""
+    client = APIClient()
+    client.force_login(league["user"])
+    response = client.post(
+        reverse(name, args=get_args(league)),
+        json.dumps(get_data(league)),
+        content_type="application/json",
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("league", FIELD_SIZES, indirect=True, ids=lambda s: f"{s}p")
+def test_lite_game_representation_matches_serializer(league):
+    """Test ?lite=true returns what GameSerializer does, within the same budget."""
+    client = APIClient()
+    client.force_login(league["user"])
+    for url in [
+        reverse("api:game-list"),
+        reverse("api:game-detail", args=[league["game"].pk]),
+    ]:
+        full = client.get(url)
+        lite = client.get(url, {"lite": "true"})
+        assert lite.status_code == 200
+        assert lite.json() == full.json()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("league", FIELD_SIZES, indirect=True, ids=lambda s: f"{s}p")
+def test_sparse_fields_skip_nested_objects(league, django_assert_max_num_queries):
+    """Test ?fields= and ?expand= trim the output and the queries behind it."""
+    client = APIClient()
+    client.force_login(league["user"])
+    url = reverse("api:game-list")
+    params = {"fields": "course,players,status", "expand": ""}
+    # Session, user, player, games and membership ids: no courses, users
+    # or hole scores.
+    with django_assert_max_num_queries(5):
+        res = client.get(url, params)
+    games = res.json()["results"]
+    assert set(games[0]) == {"id", "course", "players", "status"}
+    assert games[0]["course"] == league["course"].pk
+    assert all(isinstance(pk, int) for pk in games[0]["players"])
+    assert client.get(url, {**params, "lite": "true"}).json()["results"] == games
+    expanded = client.get(url, {"fields": "course", "expand": "course"}).json()
+    assert expanded["results"][0]["course"]["id"] == league["course"].pk
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("league", [4], indirect=True, ids=lambda s: f"{s}p")
+def test_cursor_pagination_walks_every_game(league):
+    """Test following ``next`` visits each game once, newest first."""
+    client = APIClient()
+    client.force_login(league["user"])
+    res = client.get(reverse("api:game-list"), {"page_size": 1, "fields": "id"})
+    seen = []
+    while True:
+        page = res.json()
+        assert len(page["results"]) <= 1
+        seen += [g["id"] for g in page["results"]]
+        if not page["next"]:
+            break
+        res = client.get(page["next"])
+    expected = models.Game.objects.filter(players=league["player"]).order_by("-date_played")
+    assert seen == list(expected.values_list("id", flat=True))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("league", FIELD_SIZES, indirect=True, ids=lambda s: f"{s}p")
+@override_settings(CHANGES_SETTLE_SECONDS=0)
+def test_change_feed_returns_each_change_once(league):
+    """Test the change feed walks every visible change after a cursor."""
+    client = APIClient()
+    client.force_login(league["user"])
+    url = reverse("api:changes-list")
+    cursor = client.get(url).json()["cursor"]
+    hole_scores = list(models.HoleScore.objects.filter(player__game=league["game"]))
+    for strokes in [4, 5]:
+        for hole_score in hole_scores:
+            hole_score.strokes = strokes
+            hole_score.save()
+    membership_id = league["setup_game"].playermembership_set.first().pk
+    models.PlayerMembership.objects.get(pk=membership_id).delete()
+    league["player"].save()
+    tee_time = models.TeeTime.objects.create(
+        course=league["course"], tee_time=timezone.now()
+    )
+    tee_time.players.set([league["player"]])
+    hidden = models.TeeTime.objects.create(course=league["course"], tee_time=timezone.now())
+    deleted_tee_time = models.TeeTime.objects.create(
+        course=league["course"], tee_time=timezone.now()
+    )
+    deleted_tee_time.players.set([league["player"]])
+    deleted_tee_time_id = deleted_tee_time.pk
+    deleted_tee_time.delete()
+    hidden_game = models.Game.objects.create(course=league["course"])
+    hidden_game_id = hidden_game.pk
+    hidden_game.delete()
+    seen = []
+    while True:
+        page = client.get(url, {"since": cursor, "page_size": 7}).json()
+        seen += page["changes"]
+        cursor = page["cursor"]
+        if not page["has_more"]:
+            break
+    assert client.get(url, {"since": cursor}).json()["changes"] == []
+    changes = {(c["resource"], c["id"]): c for c in seen}
+    for hole_score in hole_scores:
+        change = changes[("hole-scores", hole_score.pk)]
+        assert change["data"]["strokes"] == 5
+    assert changes[("player-memberships", membership_id)]["action"] == "deleted"
+    assert "data" not in changes[("player-memberships", membership_id)]
+    assert changes[("players", league["player"].pk)]["data"]["user_account"] == league["user"].pk
+    assert changes[("tee-times", tee_time.pk)]["data"]["players"] == [league["player"].pk]
+    assert ("tee-times", hidden.pk) not in changes
+    assert changes[("tee-times", deleted_tee_time_id)]["action"] == "deleted"
+    assert ("games", hidden_game_id) not in changes
+    games = [c for c in seen if c["resource"] == "games"]
+    assert {g["id"] for g in games} <= set(
+        models.Game.objects.filter(players=league["player"]).values_list("id", flat=True)
+    )
+    assert client.get(url, {"since": "x"}).status_code == 400
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("league", FIELD_SIZES, indirect=True, ids=lambda s: f"{s}p")
+def test_batch_matches_separate_requests_in_fewer_queries(league):
+    """Test a batch returns what its requests return one by one, sharing
+    the session, the user and the user's player."""
+    client = APIClient()
+    client.force_login(league["user"])
+    # Each sub-request with the list url and query it stands for.
+    cases = [
+        ({"resource": "golf-courses"}, "api:golf-course-list", {}),
+        (
+            {"resource": "players", "fields": ["id", "first_name"]},
+            "api:players-list",
+            {"fields": "id,first_name"},
+        ),
+        (
+            {"resource": "tee-times", "fields": "id,players", "expand": ""},
+            "api:tee-times-list",
+            {"fields": "id,players", "expand": ""},
+        ),
+        (
+            {"resource": "games", "filters": {"lite": True, "page_size": 2}},
+            "api:game-list",
+            {"lite": "true", "page_size": 2},
+        ),
+        ({"resource": "tees", "filters": {"course": "x"}}, "api:tee-list", {"course": "x"}),
+    ]
+    sub_requests = [sub_request for sub_request, _, _ in cases]
+    separate = []
+    with CaptureQueriesContext(connection) as separate_queries:
+        for _, name, params in cases:
+            res = client.get(reverse(name), params)
+            separate.append({"status": res.status_code, "data": res.json()})
+    with CaptureQueriesContext(connection) as batch_queries:
+        res = client.post(
+            reverse("api:batch-list"),
+            json.dumps({"requests": sub_requests}),
+            content_type="application/json",
+        )
+    assert res.status_code == 200
+    assert res.json()["responses"] == separate
+    assert separate[-1]["status"] == 400
+    # Session and user once instead of per request, and the player once
+    # for games and tee times.
+    saved = 2 * (len(sub_requests) - 1) + 1
+    assert len(batch_queries) == len(separate_queries) - saved
+    bad = client.post(
+        reverse("api:batch-list"),
+        json.dumps({"requests": [{"resource": "holes"}]}),
+        content_type="application/json",
+    )
+    assert bad.status_code == 400
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("league", [4], indirect=True, ids=lambda s: f"{s}p")
+def test_adding_a_player_twice_keeps_one_membership(league):
+    """Test adding a player who is already in the game is a no-op."""
+    client = APIClient()
+    client.force_login(league["user"])
+    url = reverse("api:game-add_player", args=[league["game"].pk])
+    for _ in range(2):
+        res = client.post(url, {"player": league["free_player"].pk}, format="json")
+        assert res.status_code == 200
+    assert models.PlayerMembership.objects.filter(
+        game=league["game"], player=league["free_player"]
+    ).count() == 1
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("league", FIELD_SIZES, indirect=True, ids=lambda s: f"{s}p")
+def test_packed_scores_match_json(league):
+    """Test the packed card of an active game carries the JSON strokes."""
+    client = APIClient()
+    client.force_login(league["user"])
+    url = reverse("api:game-detail", args=[league["game"].pk])
+    game = client.get(url, {"lite": "true"}).json()
+    res = client.get(url, HTTP_ACCEPT=packing.MEDIA_TYPE)
+    assert res.status_code == 200
+    assert res["Content-Type"] == packing.MEDIA_TYPE
+    # Header, hole orders, then a player id and 18 stroke bytes per player.
+    assert len(res.content) == 15 + 18 + (4 + 18) * len(game["players"])
+    card = packing.unpack_game(res.content)
+    orders = dict(models.Hole.objects.values_list("id", "order"))
+    assert (card["id"], card["version"]) == (game["id"], game["version"])
+    assert card["players"] == [m["player"]["id"] for m in game["players"]]
+    for strokes, membership in zip(card["strokes"], game["players"]):
+        by_order = {orders[s["hole"]]: s["strokes"] for s in membership["scores"]}
+        assert strokes == [by_order.get(order, 0) for order in card["holes"]]
+    etag = res["ETag"]
+    assert etag.startswith('"game-packed-')
+    assert "Accept" in res["Vary"]
+    not_modified = client.get(url, HTTP_ACCEPT=packing.MEDIA_TYPE, HTTP_IF_NONE_MATCH=etag)
+    assert not_modified.status_code == 304
+    assert "Accept" in not_modified["Vary"]
+    res = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert res.status_code == 200
+    assert res["ETag"].startswith('"game-json-')
+    assert "Accept" in res["Vary"]
+    assert client.get(url, {"lite": "true"})["ETag"].startswith('"game-lite-')
+    models.Game.objects.filter(pk=league["game"].pk).update(status="completed")
+    res = client.get(url, {"format": "packed"})
+    assert res.status_code == 406
+    assert res["Content-Type"] == "application/json"
+    assert client.get(reverse("api:game-list"), HTTP_ACCEPT=packing.MEDIA_TYPE).status_code == 406
+
+
+def get_budget_names(patterns, namespace=""):
+    """Yield (url name, budget name or None) for every named url."""
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from get_budget_names(
+                pattern.url_patterns, pattern.namespace or namespace
+            )
+            continue
+        if not isinstance(pattern, URLPattern) or not pattern.name:
+            continue
+        callback = pattern.callback
+        budget_name = getattr(callback, "query_budget", None)
+        if hasattr(callback, "cls") and hasattr(callback, "actions"):
+            view_name = f"{callback.cls.__module__}.{callback.cls.__qualname__}"
+            budget_names = [
+                f"{view_name}.{action}" for action in callback.actions.values()
+            ]
+            budget_name = next((n for n in budget_names if n in BUDGETS), None)
+        yield f"{namespace}:{pattern.name}", budget_name
+
+
+def test_every_endpoint_has_a_budget():
+    """Test every dashboard and api url is budgeted or knowingly exempt."""
+    missing = [
+        name for name, budget_name in get_budget_names(get_resolver().url_patterns)
+        if name.split(":")[0] in ("dashboard", "api")
+        and name not in UNBUDGETED
+        and name != "api:api-root"
+        and budget_name not in BUDGETS
+    ]
+    assert missing == []